@@ -0,0 +1,545 @@
+"""
+Load test for every endpoint of blog_post, user_management and
+inventory_management_system.
+
+For each service the harness seeds a scratch SQLite database (kept in --db-dir
+and topped up on later runs), serves the app from a threaded local WSGI server
+(--mode wsgi) or from uvicorn through the service's asgi.py (--mode asgi) and
+drives every endpoint with a pool of concurrent HTTP clients. It reports
+requests/sec, p50/p95/p99 latency, SQL queries per request, peak RSS and the
+cold start time (import, create_app, init_db and first request), and
+writes the results as JSON so runs can be diffed between releases. Passing
+both modes adds a per endpoint throughput comparison to the report.
+
+Rate limiting is turned off in the benchmarked app unless --rate-limit is
+passed, otherwise the production limits would answer most of the load with
+429s. Every response other than 2xx and 304 is counted as an error.
+
+    python benchmarks/bench_endpoints.py --service all --output results.json
+    python benchmarks/bench_endpoints.py --service inventory --inventory-rows 1000000 --requests 2000
+    python benchmarks/bench_endpoints.py --mode wsgi --mode asgi --concurrency 256 --keep-alive
+
+Every service runs in its own subprocess because the three apps share module
+names (app, models, config, ...). Per endpoint progress is printed on stderr.
+"""
+import argparse
+import datetime
+import http.client
+import itertools
+import json
+import logging
+import os
+import platform
+import random
+import resource
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+SERVICES = {
+    'blog': 'blog_post',
+    'users': 'user_management',
+    'inventory': 'inventory_management_system',
+}
+
+MODES = {
+    'wsgi': 'wsgi-threaded',
+    'asgi': 'asgi-uvicorn',
+}
+
+PASSWORD = 'benchmark-password'
+
+
+class Endpoint:
+    """
+    One benchmarked route. `path`, `body` and `headers` may be callables so every
+    request can target a different row; `build` replaces all three with one
+    callable returning (path, body, headers) when they must agree
+    """
+
+    def __init__(self, name, method, path=None, body=None, headers=None, weight=1.0, build=None):
+        self.name = name
+        self.method = method
+        self.weight = weight  # fraction of --requests to send, expensive endpoints use less
+        if build is None:
+            def build():
+                return (_value(path), _value(body), _value(headers) or {})
+        self.build = build
+
+
+def _value(value):
+    return value() if callable(value) else value
+
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, int(round(fraction * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+def error_count(statuses):
+    """
+    Responses other than 2xx and 304 in a {status: count} map, a 429 of the rate
+    limiter or a failed connection ('None') did not do the work being measured
+    """
+    return sum(count for status, count in statuses.items()
+               if status == 'None' or not (200 <= int(status) < 300 or int(status) == 304))
+
+
+def peak_rss_mb():
+    # ru_maxrss is in KiB on Linux
+    return round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+
+
+_client = threading.local()
+
+
+def _connection(base_url, keep_alive):
+    parts = urlsplit(base_url)
+    if not keep_alive:
+        return http.client.HTTPConnection(parts.hostname, parts.port, timeout=60)
+    # Every client thread keeps one connection open, like a keep-alive HTTP client
+    connections = _client.__dict__.setdefault('connections', {})
+    if base_url not in connections:
+        connections[base_url] = http.client.HTTPConnection(parts.hostname, parts.port, timeout=60)
+    return connections[base_url]
+
+
+def send(base_url, endpoint, keep_alive=False):
+    connection = _connection(base_url, keep_alive)
+    path, body, headers = endpoint.build()
+    headers = dict(headers)
+    payload = None
+    if body is not None:
+        payload = json.dumps(body)
+        headers['Content-Type'] = 'application/json'
+    started = time.perf_counter()
+    try:
+        connection.request(endpoint.method, path, body=payload, headers=headers)
+        response = connection.getresponse()
+        response.read()
+        status = response.status
+    except (OSError, http.client.HTTPException):
+        status = None
+        connection.close()
+    finally:
+        if not keep_alive:
+            connection.close()
+    return status, time.perf_counter() - started
+
+
+def drive(base_url, endpoint, requests, concurrency, query_counter=None, keep_alive=False):
+    """
+    Sends `requests` requests with `concurrency` clients and returns the endpoint statistics
+    """
+    queries_before = query_counter() if query_counter else None
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        results = list(executor.map(lambda _: send(base_url, endpoint, keep_alive), range(requests)))
+    elapsed = time.perf_counter() - started
+
+    latencies = sorted(duration for _, duration in results)
+    statuses = {}
+    for status, _ in results:
+        statuses[str(status)] = statuses.get(str(status), 0) + 1
+    errors = error_count(statuses)
+
+    return {
+        "name": endpoint.name,
+        "method": endpoint.method,
+        "requests": requests,
+        "concurrency": concurrency,
+        "statuses": statuses,
+        "errors": errors,
+        "req_per_sec": round(requests / elapsed, 1),
+        "p50_ms": round(percentile(latencies, 0.50) * 1000, 2),
+        "p95_ms": round(percentile(latencies, 0.95) * 1000, 2),
+        "p99_ms": round(percentile(latencies, 0.99) * 1000, 2),
+        "queries_per_request": (
+            round((query_counter() - queries_before) / requests, 2) if query_counter else None
+        ),
+    }
+
+
+def insert_in_batches(db, table, rows, batch_size=10000):
+    for batch in iter(lambda: list(itertools.islice(rows, batch_size)), []):
+        db.session.execute(table.insert(), batch)
+        db.session.commit()
+
+
+def make_token(service, user_id):
+    import jwt
+    from flask import current_app
+    return jwt.encode(
+        {'user_id': user_id, 'exp': datetime.datetime.utcnow() + datetime.timedelta(hours=2)},
+        current_app.config['SECRET_KEY'], algorithm="HS256"
+    )
+
+
+def seed_users(service, count):
+    from flask import current_app
+    db, User = service.db, service.User
+    existing = db.session.query(db.func.count(User.id)).scalar()
+    if existing >= count:
+        return
+    # Hashing is deliberately done once, seeding is not what is being measured
+    password_hash = current_app.extensions['password_hasher'].hash(PASSWORD)
+    insert_in_batches(db, User.__table__, ({
+        "username": f"user{i}", "email": f"user{i}@example.com", "password_hash": password_hash,
+        "first_name": "Bench", "last_name": f"User{i}",
+    } for i in range(existing, count)))
+
+
+def blog_endpoints(service, volumes):
+    from utils import encode_cursor
+
+    db, Post, Comment = service.db, service.Post, service.Comment
+    users = volumes['users']
+    seed_users(service, users)
+
+    base_time = datetime.datetime(2020, 1, 1)
+    existing = db.session.query(db.func.count(Post.id)).scalar()
+    insert_in_batches(db, Post.__table__, ({
+        "title": f"Post {i}", "content": f"Content of post {i} " * 5, "user_id": i % users + 1,
+        "created_at": base_time + datetime.timedelta(seconds=i), "updated_at": base_time + datetime.timedelta(seconds=i),
+    } for i in range(existing, volumes['posts'])))
+    posts = volumes['posts']
+
+    existing = db.session.query(db.func.count(Comment.id)).scalar()
+    insert_in_batches(db, Comment.__table__, ({
+        "post_id": i % posts + 1, "content": f"Comment {i}", "user_id": i % users + 1,
+        "created_at": base_time + datetime.timedelta(seconds=i),
+    } for i in range(existing, volumes['comments'])))
+
+    headers = {'x-access-tokens': make_token(service, 1)}
+    post_id = lambda: random.randint(1, posts)  # noqa: E731
+    middle_cursor = encode_cursor(str(base_time + datetime.timedelta(seconds=posts // 2)), posts // 2)
+    # Deletes walk down from the newest posts so every request removes an existing row
+    delete_ids = itertools.count(posts, -1)
+
+    return [
+        Endpoint('list posts', 'GET', '/blog/posts'),
+        Endpoint('list posts (projection)', 'GET', '/blog/posts?fields=id,title&limit=50'),
+        Endpoint('list posts (deep cursor)', 'GET', '/blog/posts?cursor=' + middle_cursor),
+        Endpoint('get post', 'GET', lambda: f'/blog/posts/{post_id()}'),
+        Endpoint('list comments', 'GET', lambda: f'/blog/posts/{post_id()}/comments'),
+        # A few hot profiles are served from the author feed cache, the others query the index
+        Endpoint('author posts (hot)', 'GET', lambda: f'/blog/users/user{random.randrange(10)}/posts'),
+        Endpoint('author posts', 'GET', lambda: f'/blog/users/user{random.randrange(users)}/posts'),
+        Endpoint('create post', 'POST', '/blog/posts/create',
+                 body={"title": "Benchmark", "content": "Benchmark content"}, headers=headers),
+        Endpoint('update post', 'PUT', lambda: f'/blog/posts/update/{post_id()}',
+                 body={"title": "Updated", "content": "Updated content"}, headers=headers),
+        Endpoint('add comment', 'POST', lambda: f'/blog/posts/{post_id()}/comments',
+                 body={"content": "Benchmark comment"}, headers=headers),
+        Endpoint('delete post', 'DELETE', lambda: f'/blog/posts/delete/{next(delete_ids)}',
+                 headers=headers, weight=0.2),
+        Endpoint('login', 'POST', '/blog/auth/login',
+                 body=lambda: {"email": f"user{random.randrange(users)}@example.com", "password": PASSWORD},
+                 weight=0.1),
+        Endpoint('register', 'POST', '/blog/auth/register', body=lambda: _new_user_payload(), weight=0.1),
+        Endpoint('cache stats', 'GET', '/blog/cache/stats'),
+        Endpoint('export posts', 'GET', '/blog/posts/export', weight=0.001),
+    ]
+
+
+def user_endpoints(service, volumes):
+    users = volumes['users']
+    seed_users(service, users)
+
+    tokens = {user_id: {'x-access-tokens': make_token(service, user_id)} for user_id in range(1, min(users, 1000) + 1)}
+
+    def update_profile():
+        # The payload must keep the token owner's username and email
+        user_id = random.choice(list(tokens))
+        body = {"username": f"user{user_id - 1}", "email": f"user{user_id - 1}@example.com",
+                "first_name": "Bench", "last_name": f"Updated{random.randrange(1000)}"}
+        return '/auth/profile', body, tokens[user_id]
+
+    return [
+        Endpoint('get profile', 'GET', '/auth/profile', headers=lambda: random.choice(list(tokens.values()))),
+        Endpoint('update profile', 'PUT', build=update_profile),
+        Endpoint('login', 'POST', '/auth/login',
+                 body=lambda: {"email": f"user{random.randrange(users)}@example.com", "password": PASSWORD},
+                 weight=0.1),
+        Endpoint('register', 'POST', '/auth/register', body=lambda: _new_user_payload(), weight=0.1),
+        Endpoint('cache stats', 'GET', '/auth/cache/stats'),
+        Endpoint('export users', 'GET', '/auth/users/export', headers=tokens[1], weight=0.001),
+    ]
+
+
+def _new_user_payload():
+    suffix = f"{os.getpid()}-{time.perf_counter_ns()}-{random.randrange(10 ** 9)}"
+    return {"username": f"new{suffix}", "email": f"new{suffix}@example.com", "password": PASSWORD,
+            "first_name": "New", "last_name": "User"}
+
+
+def inventory_endpoints(service, volumes):
+    db, Inventory = service.db, service.Inventory
+    rows = volumes['inventory_rows']
+    words = ['apple', 'banana', 'cable', 'drill', 'engine', 'filter', 'gasket', 'hammer', 'inverter', 'jack']
+
+    existing = db.session.query(db.func.count(Inventory.id)).scalar()
+    insert_in_batches(db, Inventory.__table__, ({
+        "name": f"item-{i}", "description": f"{words[i % 10]} {words[i // 10 % 10]} part number {i}",
+        "quantity": i % 500, "price": round((i % 10000) / 10, 2), "category": f"category-{i % 100}",
+    } for i in range(existing, rows)))
+
+    item_id = lambda: random.randint(1, rows)  # noqa: E731
+    created = itertools.count()
+    delete_ids = itertools.count(rows, -1)
+
+    def item_payload(name):
+        return {"name": name, "description": "benchmark item", "quantity": random.randint(0, 100),
+                "price": 9.99, "category": f"category-{random.randrange(100)}"}
+
+    return [
+        Endpoint('read item', 'GET', lambda: f'/inventory/read/{item_id()}'),
+        Endpoint('search text', 'POST', '/inventory/search',
+                 body=lambda: {"search_string": random.choice(words), "per_page": 20}),
+        # Browsing deeper pages of the same searches, their totals come from the totals cache
+        Endpoint('search text (page flips)', 'POST', '/inventory/search',
+                 body=lambda: {"search_string": random.choice(words), "per_page": 20, "page_number": random.randint(1, 50)}),
+        Endpoint('search text (count=approx)', 'POST', '/inventory/search',
+                 body=lambda: {"search_string": random.choice(words), "per_page": 20, "count": "approx"}),
+        Endpoint('search text (count=none)', 'POST', '/inventory/search',
+                 body=lambda: {"search_string": random.choice(words), "per_page": 20, "count": "none"}),
+        Endpoint('search text + category', 'POST', '/inventory/search',
+                 body=lambda: {"search_string": random.choice(words), "category": f"category-{random.randrange(100)}"}),
+        Endpoint('search category', 'POST', '/inventory/search',
+                 body=lambda: {"search_string": "", "category": f"category-{random.randrange(100)}"}),
+        Endpoint('list categories', 'GET', '/inventory/category'),
+        Endpoint('category stats', 'GET', '/inventory/category/stats'),
+        Endpoint('stock value', 'GET', '/inventory/analytics/value'),
+        Endpoint('low stock', 'GET', lambda: f'/inventory/analytics/low-stock?threshold={random.randint(1, 20)}'),
+        Endpoint('low stock + category', 'GET',
+                 lambda: f'/inventory/analytics/low-stock?category=category-{random.randrange(100)}'),
+        Endpoint('price histogram', 'GET', '/inventory/analytics/price-histogram?bins=50'),
+        Endpoint('create item', 'POST', '/inventory/create',
+                 body=lambda: item_payload(f"bench-{os.getpid()}-{next(created)}-{time.perf_counter_ns()}")),
+        Endpoint('update item', 'PUT', lambda: f'/inventory/update/{item_id()}',
+                 body=lambda: item_payload("ignored")),
+        Endpoint('adjust stock', 'POST', lambda: f'/inventory/{item_id()}/adjust',
+                 body=lambda: {"delta": random.choice([-1, 1])}),
+        Endpoint('adjust stock batch 20', 'POST', '/inventory/adjust',
+                 body=lambda: {"adjustments": [{"id": item_id(), "delta": 1} for _ in range(20)]}, weight=0.5),
+        Endpoint('bulk upsert 100', 'POST', '/inventory/bulk',
+                 body=lambda: [item_payload(f"item-{random.randrange(rows)}") for _ in range(100)], weight=0.1),
+        Endpoint('delete item', 'POST', lambda: f'/inventory/delete/{next(delete_ids)}', weight=0.2),
+        Endpoint('export inventory', 'GET', '/inventory/export', weight=0.001),
+    ]
+
+
+ENDPOINTS = {
+    'blog': blog_endpoints,
+    'users': user_endpoints,
+    'inventory': inventory_endpoints,
+}
+
+
+def run_service(args):
+    """
+    Runs in the service subprocess: seeds the database, starts the app and drives every endpoint
+    """
+    app_dir = os.path.join(ROOT, SERVICES[args.service], 'app')
+    os.makedirs(args.db_dir, exist_ok=True)
+    os.environ['DATABASE_URL'] = 'sqlite:///' + os.path.join(os.path.abspath(args.db_dir), f'{args.service}.db')
+    os.environ['APP_PROFILE'] = args.profile
+    os.environ['RATE_LIMIT_ENABLED'] = '1' if args.rate_limit else '0'
+    sys.path.insert(0, app_dir)
+
+    from sqlalchemy import event
+    from werkzeug.serving import make_server
+
+    # Cold start: importing the service, building the app and creating the schema are timed separately
+    import_started = time.perf_counter()
+    import app as service
+    imported = time.perf_counter()
+    flask_app = service.create_app()
+    created = time.perf_counter()
+    service.init_db(flask_app)
+    initialized = time.perf_counter()
+
+    flask_app.logger.disabled = True
+    logging.getLogger('werkzeug').setLevel(logging.ERROR)
+    volumes = {
+        'users': args.users,
+        'posts': args.posts,
+        'comments': args.comments,
+        'inventory_rows': args.inventory_rows,
+    }
+    seed_started = time.perf_counter()
+    with flask_app.app_context():
+        endpoints = ENDPOINTS[args.service](service, volumes)
+        engine = service.db.engine
+    seed_seconds = time.perf_counter() - seed_started
+
+    query_count = [0]
+
+    def count_query(*_):
+        query_count[0] += 1
+
+    event.listen(engine, 'before_cursor_execute', count_query)
+
+    if args.mode == 'asgi':
+        server, base_url, async_engine = start_asgi_server()
+        event.listen(async_engine.sync_engine, 'before_cursor_execute', count_query)
+    else:
+        server = make_server('127.0.0.1', 0, flask_app, threaded=True)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        base_url = f'http://127.0.0.1:{server.server_port}'
+
+    first_request_started = time.perf_counter()
+    connection = http.client.HTTPConnection(urlsplit(base_url).netloc)
+    connection.request('GET', '/')
+    connection.getresponse().read()
+    connection.close()
+    cold_start = {
+        "import_ms": round((imported - import_started) * 1000, 1),
+        "create_app_ms": round((created - imported) * 1000, 1),
+        "init_db_ms": round((initialized - created) * 1000, 1),
+        "first_request_ms": round((time.perf_counter() - first_request_started) * 1000, 1),
+    }
+
+    results = []
+    for endpoint in endpoints:
+        if args.endpoint and endpoint.name not in args.endpoint:
+            continue
+        requests = max(1, int(args.requests * endpoint.weight))
+        result = drive(base_url, endpoint, requests, args.concurrency, lambda: query_count[0], args.keep_alive)
+        results.append(result)
+        print(json.dumps(result), file=sys.stderr)
+
+    if args.mode == 'asgi':
+        server.should_exit = True
+    else:
+        server.shutdown()
+    return {
+        "service": SERVICES[args.service],
+        "mode": MODES[args.mode],
+        "profile": args.profile,
+        "rate_limit": args.rate_limit,
+        "keep_alive": args.keep_alive,
+        "volumes": volumes,
+        "cold_start": cold_start,
+        "seed_seconds": round(seed_seconds, 2),
+        "peak_rss_mb": peak_rss_mb(),
+        "endpoints": results,
+    }
+
+
+def start_asgi_server():
+    """
+    Serves the service's asgi.py application with a single uvicorn worker in a thread,
+    returns the server, its base URL and the async engine of the application
+    """
+    import asgi
+    import uvicorn
+
+    server = uvicorn.Server(uvicorn.Config(asgi.application, host='127.0.0.1', port=0, log_level='error',
+                                           lifespan='on', backlog=4096))
+    threading.Thread(target=server.run, daemon=True).start()
+    while not server.started:
+        time.sleep(0.01)
+    port = server.servers[0].sockets[0].getsockname()[1]
+    return server, f'http://127.0.0.1:{port}', asgi.application.engine
+
+
+def compare_modes(reports):
+    """
+    Lists the requests/sec of every endpoint per mode, with the ratio to the first mode
+    """
+    by_service = {}
+    for report in reports:
+        for result in report["endpoints"]:
+            by_service.setdefault(report["service"], {}).setdefault(result["name"], {})[report["mode"]] = result
+    comparison = []
+    for service, endpoints in by_service.items():
+        for name, modes in endpoints.items():
+            baseline = next(iter(modes.values()))["req_per_sec"]
+            comparison.append({
+                "service": service,
+                "endpoint": name,
+                **{f"{mode}_req_per_sec": result["req_per_sec"] for mode, result in modes.items()},
+                **{f"{mode}_p99_ms": result["p99_ms"] for mode, result in modes.items()},
+                **{f"{mode}_speedup": round(result["req_per_sec"] / baseline, 2) if baseline else None
+                   for mode, result in list(modes.items())[1:]},
+            })
+    return comparison
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--service', choices=sorted(SERVICES) + ['all'], default='all')
+    parser.add_argument('--profile', default='production', help='APP_PROFILE used by the app')
+    parser.add_argument('--rate-limit', action='store_true',
+                        help='keep the rate limits of the profile, requests over them answer 429 and count as errors')
+    parser.add_argument('--db-dir', default=os.path.join(tempfile.gettempdir(), 'pepsico-bench'),
+                        help='directory for the seeded databases, reused between runs')
+    parser.add_argument('--users', type=int, default=10000)
+    parser.add_argument('--posts', type=int, default=100000)
+    parser.add_argument('--comments', type=int, default=100000)
+    parser.add_argument('--inventory-rows', type=int, default=100000)
+    parser.add_argument('--requests', type=int, default=1000, help='requests per endpoint (scaled by its weight)')
+    parser.add_argument('--concurrency', type=int, default=16)
+    parser.add_argument('--keep-alive', action='store_true', help='reuse one connection per client')
+    parser.add_argument('--mode', action='append', choices=sorted(MODES),
+                        help='server to benchmark, repeat to compare (default wsgi)')
+    parser.add_argument('--endpoint', action='append', help='only run the endpoints with this name')
+    parser.add_argument('--output', help='write the results as JSON to this file')
+    parser.add_argument('--child', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        # Called by the parent run: hand the report back on stdout
+        args.mode = args.mode[0]
+        print(json.dumps(run_service(args)))
+        return
+
+    modes = args.mode or ['wsgi']
+    reports = []
+    for service in sorted(SERVICES) if args.service == 'all' else [args.service]:
+        for mode in modes:
+            command = [sys.executable, os.path.abspath(__file__), '--child', '--mode', mode]
+            completed = subprocess.run(command + _forwarded_arguments(args, service), stdout=subprocess.PIPE, check=True)
+            reports.append(json.loads(completed.stdout))
+
+    results = {
+        "started_at": datetime.datetime.utcnow().isoformat(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "services": reports,
+    }
+    if len(modes) > 1:
+        results["comparison"] = compare_modes(reports)
+    if args.output:
+        with open(args.output, 'w') as output:
+            json.dump(results, output, indent=2)
+    else:
+        print(json.dumps(results, indent=2))
+
+
+def _forwarded_arguments(args, service):
+    forwarded = ['--service', service, '--profile', args.profile, '--db-dir', args.db_dir,
+                 '--users', str(args.users), '--posts', str(args.posts), '--comments', str(args.comments),
+                 '--inventory-rows', str(args.inventory_rows), '--requests', str(args.requests),
+                 '--concurrency', str(args.concurrency)]
+    if args.keep_alive:
+        forwarded.append('--keep-alive')
+    if args.rate_limit:
+        forwarded.append('--rate-limit')
+    for name in args.endpoint or []:
+        forwarded += ['--endpoint', name]
+    return forwarded
+
+
+if __name__ == '__main__':
+    main()
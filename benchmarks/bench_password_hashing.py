@@ -0,0 +1,74 @@
+"""
+Measures password verification throughput (logins/sec) for a hashing method,
+inline on the request thread and through the process pool used by login.
+
+    python benchmarks/bench_password_hashing.py --method scrypt --workers 4 --seconds 5
+"""
+import argparse
+import json
+import os
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'user_management', 'app'))
+
+from passwords import PasswordHasher  # noqa: E402
+
+
+def run(hasher, password_hash, threads, seconds):
+    """
+    Runs `threads` concurrent login loops for `seconds` and returns the number of verifications done
+    """
+    deadline = time.perf_counter() + seconds
+    counts = [0] * threads
+
+    def login_loop(slot):
+        while time.perf_counter() < deadline:
+            hasher.verify(password_hash, 'correct horse battery staple')
+            counts[slot] += 1
+
+    workers = [threading.Thread(target=login_loop, args=(slot,)) for slot in range(threads)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    return sum(counts)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--method', action='append', help='werkzeug hashing method, can be repeated')
+    parser.add_argument('--workers', type=int, default=os.cpu_count(), help='process pool size')
+    parser.add_argument('--seconds', type=float, default=5)
+    parser.add_argument('--output', help='write the results as JSON to this file')
+    args = parser.parse_args()
+
+    results = []
+    for method in args.method or ['scrypt', 'pbkdf2:sha256:600000', 'pbkdf2:sha256:100000']:
+        inline = PasswordHasher(method=method)
+        password_hash = inline.hash('correct horse battery staple')
+
+        inline_count = run(inline, password_hash, 1, args.seconds)
+
+        pooled = PasswordHasher(method=method, workers=args.workers)
+        pooled_count = run(pooled, password_hash, args.workers * 2, args.seconds)
+        pooled.shutdown()
+
+        result = {
+            "method": inline.method_prefix,
+            "inline_logins_per_sec": round(inline_count / args.seconds, 1),
+            "pool_workers": args.workers,
+            "pool_logins_per_sec": round(pooled_count / args.seconds, 1),
+            "pool_logins_per_sec_per_core": round(pooled_count / args.seconds / args.workers, 1),
+        }
+        results.append(result)
+        print(json.dumps(result))
+
+    if args.output:
+        with open(args.output, 'w') as output:
+            json.dump(results, output, indent=2)
+
+
+if __name__ == '__main__':
+    main()
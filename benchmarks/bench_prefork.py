@@ -0,0 +1,278 @@
+"""
+Throughput of the read endpoints of one service under the pre-fork launcher
+(wsgi.py) as the number of worker processes grows.
+
+The harness seeds a scratch SQLite database like bench_endpoints.py (same
+--db-dir and volumes), then for every --workers count starts `python wsgi.py`
+with PREFORK_WORKERS set and drives each read endpoint for --duration seconds
+from --client-processes processes of --client-threads keep-alive connections
+each. It reports requests/sec and latency per worker count, and the speedup
+and scaling efficiency (speedup / workers) against the first count. Like
+bench_endpoints.py, rate limiting is off unless --rate-limit is passed and
+every response other than 2xx and 304 counts as an error.
+
+The load generator runs on the same host and needs CPU too: near-linear
+scaling shows up while workers + client processes fit in the cores. On a small
+machine keep the worker counts at half the cores.
+
+    python benchmarks/bench_prefork.py --service inventory --workers 1 --workers 2 --workers 4
+    python benchmarks/bench_prefork.py --service blog --duration 20 --client-processes 4 --output prefork.json
+"""
+import argparse
+import datetime
+import http.client
+import json
+import multiprocessing
+import os
+import platform
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+from bench_endpoints import ROOT, SERVICES, ENDPOINTS, error_count, percentile, send
+
+READ_ENDPOINTS = {
+    'blog': ['list posts', 'get post', 'list comments', 'author posts (hot)'],
+    'users': ['get profile'],
+    'inventory': ['read item', 'category stats', 'low stock'],
+}
+
+
+def default_worker_counts():
+    cpus = os.cpu_count() or 1
+    counts = [1]
+    while counts[-1] * 2 <= cpus:
+        counts.append(counts[-1] * 2)
+    if counts[-1] != cpus:
+        counts.append(cpus)
+    return counts
+
+
+def free_port():
+    with socket.socket() as probe:
+        probe.bind(('127.0.0.1', 0))
+        return probe.getsockname()[1]
+
+
+def start_server(args, workers, log):
+    """
+    Starts wsgi.py of the service with `workers` workers, returns the process and its base URL once it answers
+    """
+    port = free_port()
+    # DATABASE_URL, APP_PROFILE and RATE_LIMIT_ENABLED are set by seed()
+    env = dict(
+        os.environ,
+        PREFORK_BIND=f'127.0.0.1:{port}',
+        PREFORK_WORKERS=str(workers),
+        PREFORK_THREADS=str(args.worker_threads),
+    )
+    process = subprocess.Popen([sys.executable, 'wsgi.py'], cwd=os.path.join(ROOT, SERVICES[args.service], 'app'),
+                               env=env, stdout=log, stderr=log)
+    deadline = time.monotonic() + args.start_timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"wsgi.py exited with {process.returncode}, see {log.name}")
+        try:
+            connection = http.client.HTTPConnection('127.0.0.1', port, timeout=5)
+            connection.request('GET', '/')
+            connection.getresponse().read()
+            connection.close()
+            return process, f'http://127.0.0.1:{port}'
+        except OSError:
+            time.sleep(0.2)
+    stop_server(process)
+    raise RuntimeError(f"wsgi.py did not answer within {args.start_timeout}s, see {log.name}")
+
+
+def stop_server(process):
+    process.send_signal(signal.SIGTERM)
+    try:
+        process.wait(timeout=60)
+    except subprocess.TimeoutExpired:
+        process.kill()
+        process.wait()
+
+
+def client_process(base_url, endpoint, threads, measure_from, measure_until, results):
+    """
+    Sends requests from `threads` keep-alive connections until measure_until, reports the ones
+    completed after measure_from (the requests before warm up the connections and caches)
+    """
+    latencies, statuses = [], {}
+    lock = threading.Lock()
+
+    def run():
+        thread_latencies, thread_statuses = [], {}
+        while True:
+            status, duration = send(base_url, endpoint, keep_alive=True)
+            finished = time.time()
+            if finished >= measure_until:
+                break
+            if finished >= measure_from:
+                thread_latencies.append(duration)
+                thread_statuses[str(status)] = thread_statuses.get(str(status), 0) + 1
+        with lock:
+            latencies.extend(thread_latencies)
+            for status, count in thread_statuses.items():
+                statuses[status] = statuses.get(status, 0) + count
+
+    client_threads = [threading.Thread(target=run) for _ in range(threads)]
+    for thread in client_threads:
+        thread.start()
+    for thread in client_threads:
+        thread.join()
+    results.put((latencies, statuses))
+
+
+def measure(base_url, endpoint, args):
+    context = multiprocessing.get_context('fork')
+    results = context.Queue()
+    measure_from = time.time() + args.warmup
+    measure_until = measure_from + args.duration
+    clients = [
+        context.Process(target=client_process,
+                        args=(base_url, endpoint, args.client_threads, measure_from, measure_until, results))
+        for _ in range(args.client_processes)
+    ]
+    for client in clients:
+        client.start()
+    latencies, statuses = [], {}
+    for _ in clients:
+        client_latencies, client_statuses = results.get()
+        latencies.extend(client_latencies)
+        for status, count in client_statuses.items():
+            statuses[status] = statuses.get(status, 0) + count
+    for client in clients:
+        client.join()
+
+    latencies.sort()
+    errors = error_count(statuses)
+    return {
+        "name": endpoint.name,
+        "requests": len(latencies),
+        "statuses": statuses,
+        "errors": errors,
+        "req_per_sec": round(len(latencies) / args.duration, 1),
+        "p50_ms": round(percentile(latencies, 0.50) * 1000, 2) if latencies else None,
+        "p99_ms": round(percentile(latencies, 0.99) * 1000, 2) if latencies else None,
+    }
+
+
+def scaling(runs):
+    """
+    Speedup and efficiency of every endpoint against the run with the fewest workers
+    """
+    baseline = {result["name"]: (runs[0]["workers"], result["req_per_sec"]) for result in runs[0]["endpoints"]}
+    rows = []
+    for run in runs:
+        for result in run["endpoints"]:
+            base_workers, base_rate = baseline[result["name"]]
+            speedup = result["req_per_sec"] / base_rate if base_rate else None
+            rows.append({
+                "endpoint": result["name"],
+                "workers": run["workers"],
+                "req_per_sec": result["req_per_sec"],
+                "speedup": round(speedup, 2) if speedup is not None else None,
+                "efficiency": round(speedup * base_workers / run["workers"], 2) if speedup is not None else None,
+            })
+    return rows
+
+
+def seed(args):
+    """
+    Seeds the database and returns the service's endpoints, built like bench_endpoints.py builds them
+    """
+    os.makedirs(args.db_dir, exist_ok=True)
+    os.environ['DATABASE_URL'] = 'sqlite:///' + os.path.join(os.path.abspath(args.db_dir), f'{args.service}.db')
+    os.environ['APP_PROFILE'] = args.profile
+    os.environ['RATE_LIMIT_ENABLED'] = '1' if args.rate_limit else '0'
+    sys.path.insert(0, os.path.join(ROOT, SERVICES[args.service], 'app'))
+
+    import app as service
+
+    flask_app = service.create_app()
+    service.init_db(flask_app)
+    volumes = {
+        'users': args.users,
+        'posts': args.posts,
+        'comments': args.comments,
+        'inventory_rows': args.inventory_rows,
+    }
+    with flask_app.app_context():
+        endpoints = ENDPOINTS[args.service](service, volumes)
+        # The client processes are forked from this one
+        service.db.engine.dispose()
+    return volumes, endpoints
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--service', choices=sorted(SERVICES), required=True)
+    parser.add_argument('--profile', default='production', help='APP_PROFILE used by the app')
+    parser.add_argument('--rate-limit', action='store_true',
+                        help='keep the rate limits of the profile, requests over them answer 429 and count as errors')
+    parser.add_argument('--db-dir', default=os.path.join(tempfile.gettempdir(), 'pepsico-bench'),
+                        help='directory for the seeded databases, shared with bench_endpoints.py')
+    parser.add_argument('--users', type=int, default=10000)
+    parser.add_argument('--posts', type=int, default=100000)
+    parser.add_argument('--comments', type=int, default=100000)
+    parser.add_argument('--inventory-rows', type=int, default=100000)
+    parser.add_argument('--workers', type=int, action='append',
+                        help='worker processes, repeat for several runs (default 1, 2, 4, ... up to the CPU count)')
+    parser.add_argument('--worker-threads', type=int, default=8, help='PREFORK_THREADS of the workers')
+    parser.add_argument('--client-processes', type=int, default=os.cpu_count() or 1)
+    parser.add_argument('--client-threads', type=int, default=8, help='keep-alive connections per client process')
+    parser.add_argument('--duration', type=float, default=10, help='measured seconds per endpoint')
+    parser.add_argument('--warmup', type=float, default=2, help='seconds of load before measuring')
+    parser.add_argument('--start-timeout', type=float, default=120)
+    parser.add_argument('--endpoint', action='append', help='endpoints to drive (default: the read endpoints)')
+    parser.add_argument('--output', help='write the results as JSON to this file')
+    args = parser.parse_args()
+
+    volumes, endpoints = seed(args)
+    names = args.endpoint or READ_ENDPOINTS[args.service]
+    endpoints = [endpoint for endpoint in endpoints if endpoint.name in names]
+
+    runs = []
+    with open(os.path.join(args.db_dir, f'{args.service}-prefork.log'), 'a') as log:
+        for workers in args.workers or default_worker_counts():
+            process, base_url = start_server(args, workers, log)
+            try:
+                results = []
+                for endpoint in endpoints:
+                    result = measure(base_url, endpoint, args)
+                    results.append(result)
+                    print(json.dumps({"workers": workers, **result}), file=sys.stderr)
+            finally:
+                stop_server(process)
+            runs.append({"workers": workers, "endpoints": results})
+
+    report = {
+        "started_at": datetime.datetime.utcnow().isoformat(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "service": SERVICES[args.service],
+        "profile": args.profile,
+        "rate_limit": args.rate_limit,
+        "volumes": volumes,
+        "client_processes": args.client_processes,
+        "client_threads": args.client_threads,
+        "worker_threads": args.worker_threads,
+        "duration": args.duration,
+        "runs": runs,
+        "scaling": scaling(runs),
+    }
+    if args.output:
+        with open(args.output, 'w') as output:
+            json.dump(report, output, indent=2)
+    else:
+        print(json.dumps(report, indent=2))
+
+
+if __name__ == '__main__':
+    main()
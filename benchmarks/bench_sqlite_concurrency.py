@@ -0,0 +1,132 @@
+"""
+Compares read/write throughput of concurrent SQLite clients under the default
+engine settings and the production profile (WAL, pragmas, sized pool).
+
+Reader threads run primary key lookups and category filters on the inventory
+table while writer threads update quantities, each write in its own commit.
+
+    python benchmarks/bench_sqlite_concurrency.py --rows 100000 --readers 8 --writers 2 --seconds 10
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'inventory_management_system', 'app'))
+
+from sqlalchemy import create_engine, text  # noqa: E402
+
+from config import Config, ProductionConfig  # noqa: E402
+from service_common.database import configure_engine  # noqa: E402
+
+PROFILES = {
+    'default': Config,
+    'production': ProductionConfig,
+}
+
+
+def seed(path, rows):
+    engine = create_engine('sqlite:///' + path)
+    with engine.begin() as connection:
+        connection.execute(text(
+            "CREATE TABLE inventory (id INTEGER PRIMARY KEY, name VARCHAR(80) UNIQUE NOT NULL, "
+            "description VARCHAR(400), quantity INTEGER NOT NULL, price FLOAT NOT NULL, category VARCHAR(50) NOT NULL)"
+        ))
+        connection.execute(text("CREATE INDEX ix_inventory_category ON inventory (category, quantity, price)"))
+        connection.execute(
+            text("INSERT INTO inventory (name, description, quantity, price, category) "
+                 "VALUES (:name, :description, :quantity, :price, :category)"),
+            [{"name": f"item-{i}", "description": f"description {i}", "quantity": i % 500,
+              "price": (i % 1000) / 10, "category": f"category-{i % 50}"} for i in range(rows)]
+        )
+    engine.dispose()
+
+
+def run_profile(path, profile, rows, readers, writers, seconds):
+    config = PROFILES[profile]
+    engine = create_engine('sqlite:///' + path, **getattr(config, 'SQLALCHEMY_ENGINE_OPTIONS', {}))
+    configure_engine(engine, config.SQLITE_PRAGMAS)
+
+    deadline = time.perf_counter() + seconds
+    counters = {"reads": 0, "writes": 0, "errors": 0}
+    lock = threading.Lock()
+
+    def reader():
+        done = errors = 0
+        while time.perf_counter() < deadline:
+            try:
+                with engine.connect() as connection:
+                    connection.execute(text("SELECT * FROM inventory WHERE id = :id"),
+                                       {"id": random.randint(1, rows)}).first()
+                    connection.execute(text("SELECT id, name FROM inventory WHERE category = :category LIMIT 20"),
+                                       {"category": f"category-{random.randint(0, 49)}"}).all()
+                done += 1
+            except Exception:
+                errors += 1
+        with lock:
+            counters["reads"] += done
+            counters["errors"] += errors
+
+    def writer():
+        done = errors = 0
+        while time.perf_counter() < deadline:
+            try:
+                with engine.begin() as connection:
+                    connection.execute(text("UPDATE inventory SET quantity = quantity + 1 WHERE id = :id"),
+                                       {"id": random.randint(1, rows)})
+                done += 1
+            except Exception:
+                errors += 1
+        with lock:
+            counters["writes"] += done
+            counters["errors"] += errors
+
+    threads = [threading.Thread(target=reader) for _ in range(readers)]
+    threads += [threading.Thread(target=writer) for _ in range(writers)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    engine.dispose()
+
+    return {
+        "profile": profile,
+        "readers": readers,
+        "writers": writers,
+        "reads_per_sec": round(counters["reads"] / seconds, 1),
+        "writes_per_sec": round(counters["writes"] / seconds, 1),
+        "errors": counters["errors"],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, default=100000)
+    parser.add_argument('--readers', type=int, default=8)
+    parser.add_argument('--writers', type=int, default=2)
+    parser.add_argument('--seconds', type=float, default=10)
+    parser.add_argument('--profile', action='append', choices=sorted(PROFILES))
+    parser.add_argument('--output', help='write the results as JSON to this file')
+    args = parser.parse_args()
+
+    results = []
+    with tempfile.TemporaryDirectory() as directory:
+        for profile in args.profile or ['default', 'production']:
+            # Every profile starts from a fresh copy so the journal mode of one run does not leak into the next
+            path = os.path.join(directory, f'{profile}.db')
+            seed(path, args.rows)
+            result = run_profile(path, profile, args.rows, args.readers, args.writers, args.seconds)
+            results.append(result)
+            print(json.dumps(result))
+
+    if args.output:
+        with open(args.output, 'w') as output:
+            json.dump(results, output, indent=2)
+
+
+if __name__ == '__main__':
+    main()
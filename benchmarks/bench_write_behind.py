@@ -0,0 +1,169 @@
+"""
+Compares comment creation on blog_post with direct commits and with the
+write-behind queue (WRITE_BEHIND_ENABLED).
+
+Client threads post comments through the Flask test client, so the numbers
+cover the app and the database without the HTTP server. For each mode the
+harness reports accepted requests/sec, rows committed/sec (until the queue is
+drained), database commits/sec, the request latency percentiles and the end to
+end latency from the request to the commit of its row.
+
+    python benchmarks/bench_write_behind.py --threads 16 --comments 20000
+    python benchmarks/bench_write_behind.py --profile default --batch-size 1000 --flush-interval 0.1
+"""
+import argparse
+import json
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'blog_post', 'app'))
+
+from sqlalchemy import event  # noqa: E402
+
+import app as service  # noqa: E402
+from config import CONFIGS  # noqa: E402
+from models import db  # noqa: E402
+
+MODES = ('direct', 'write-behind')
+
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(len(sorted_values) - 1, int(len(sorted_values) * fraction))]
+
+
+def make_app(mode, directory, args):
+    base = CONFIGS[args.profile]
+
+    class BenchmarkConfig(base):
+        SQLALCHEMY_DATABASE_URI = 'sqlite:///' + os.path.join(directory, f'{mode}.db')
+        WRITE_BEHIND_ENABLED = mode == 'write-behind'
+        WRITE_BEHIND_SPOOL_DIR = os.path.join(directory, f'{mode}-spool')
+        WRITE_BEHIND_BATCH_SIZE = args.batch_size
+        WRITE_BEHIND_FLUSH_INTERVAL = args.flush_interval
+        WRITE_BEHIND_QUEUE_SIZE = args.queue_size
+        WRITE_BEHIND_SPOOL_FSYNC = args.fsync
+        RATE_LIMIT_ENABLED = False
+
+    flask_app = service.create_app(BenchmarkConfig)
+    service.init_db(flask_app)
+    return flask_app
+
+
+def run_mode(mode, directory, args):
+    flask_app = make_app(mode, directory, args)
+    client = flask_app.test_client()
+    user = {"username": "bench", "email": "bench@example.com", "password": "benchmark-password",
+            "first_name": "Bench", "last_name": "Mark"}
+    client.post('/blog/auth/register', json=user)
+    token = client.post('/blog/auth/login', json={"email": user["email"], "password": user["password"]}).json['token']
+    headers = {'x-access-tokens': token}
+    client.post('/blog/posts/create', json={"title": "Live event", "content": "Comments below"}, headers=headers)
+    writer = flask_app.extensions['write_behind']
+    if writer is not None:
+        writer.flush()
+
+    commits = [0]
+    with flask_app.app_context():
+        engine = db.engine
+
+    @event.listens_for(engine, 'commit')
+    def count_commit(connection):
+        commits[0] += 1
+
+    per_thread = args.comments // args.threads
+    latencies = []
+    statuses = {}
+    lock = threading.Lock()
+
+    def post_comments():
+        thread_client = flask_app.test_client()
+        thread_latencies, thread_statuses = [], {}
+        for i in range(per_thread):
+            started = time.perf_counter()
+            response = thread_client.post('/blog/posts/1/comments', json={"content": f"comment {i}"}, headers=headers)
+            thread_latencies.append(time.perf_counter() - started)
+            thread_statuses[response.status_code] = thread_statuses.get(response.status_code, 0) + 1
+        with lock:
+            latencies.extend(thread_latencies)
+            for status, count in thread_statuses.items():
+                statuses[status] = statuses.get(status, 0) + count
+
+    threads = [threading.Thread(target=post_comments) for _ in range(args.threads)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    accepted_seconds = time.perf_counter() - started
+    if writer is not None:
+        writer.flush()
+    committed_seconds = time.perf_counter() - started
+    event.remove(engine, 'commit', count_commit)
+
+    comment_count = client.get('/blog/posts/1').json['post']['comment_count']
+
+    latencies.sort()
+    requests = len(latencies)
+    request_avg = sum(latencies) / requests if requests else 0.0
+    report = {
+        "mode": mode,
+        "requests": requests,
+        "statuses": statuses,
+        "comments_committed": comment_count,
+        "accepted_per_second": round(requests / accepted_seconds, 1),
+        "committed_per_second": round(comment_count / committed_seconds, 1),
+        "commits": commits[0],
+        "commits_per_second": round(commits[0] / committed_seconds, 1),
+        "request_latency_ms": {
+            "avg": round(request_avg * 1000, 3),
+            "p50": round(percentile(latencies, 0.50) * 1000, 3),
+            "p99": round(percentile(latencies, 0.99) * 1000, 3),
+        },
+    }
+    if writer is None:
+        # The row is committed when the response is sent
+        report["end_to_end_latency_ms"] = {"avg": report["request_latency_ms"]["avg"],
+                                           "max": round(latencies[-1] * 1000, 3) if latencies else 0.0}
+    else:
+        stats = writer.stats()
+        report["rows_per_transaction"] = stats["rows_per_transaction"]
+        report["end_to_end_latency_ms"] = {"avg": round(request_avg * 1000 + stats["latency_avg_ms"], 3),
+                                           "max": round(latencies[-1] * 1000 + stats["latency_max_ms"], 3)}
+        writer.close()
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--mode', action='append', choices=MODES, help='modes to run (default: both)')
+    parser.add_argument('--profile', default='production', choices=sorted(CONFIGS))
+    parser.add_argument('--threads', type=int, default=16)
+    parser.add_argument('--comments', type=int, default=10000, help='comments posted in total')
+    parser.add_argument('--batch-size', type=int, default=500)
+    parser.add_argument('--flush-interval', type=float, default=0.05)
+    parser.add_argument('--queue-size', type=int, default=10000)
+    parser.add_argument('--fsync', action='store_true', help='fsync the spool after every row')
+    parser.add_argument('--output', help='write the results as JSON to this file')
+    args = parser.parse_args()
+
+    directory = tempfile.mkdtemp(prefix='bench-write-behind-')
+    try:
+        reports = [run_mode(mode, directory, args) for mode in args.mode or MODES]
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+    result = {"profile": args.profile, "threads": args.threads, "results": reports}
+    print(json.dumps(result, indent=2))
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(result, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,27 +1,110 @@
-from flask import Flask, request, jsonify
+from flask import Blueprint, Flask, current_app, Response, request, jsonify
 from models import db, User, Post, Comment
-from config import Config
-from utils import validate_create_user_payload, username_exists, email_exists
-
+from config import get_config
+from utils import validate_create_user_payload, username_exists, email_exists, parse_fields, ndjson_response
+from cache import init_auth_cache, decode_token, load_user, user_statement, auth_cache_stats
+from passwords import init_password_hasher, HasherBusy
+from migrations import upgrade as upgrade_schema
+from service_common.database import configure_engine
+from service_common.instrumentation import init_instrumentation, query_budget
+from query_plans import sample_requests
+from service_common.query_plans import print_query_plans
+from read_queries import POST_LIST_FIELDS, DEFAULT_POST_LIST_FIELDS, single_post_statement, single_post_resource, \
+    post_list_statement, post_list_page, comment_count_statement, comment_list_statement, comment_list_page
+from serializers import POST_SCHEMA, init_json_provider
+from service_common.metrics import init_metrics, render_metrics, CONTENT_TYPE as METRICS_CONTENT_TYPE
+from service_common.rate_limit import init_rate_limiting, rate_limit, rate_limit_stats
+from service_common.http_cache import init_http_cache, cached_json_response, invalidate as invalidate_http_cache, http_cache_stats
+from author_posts import init_author_posts, author_id, author_posts_page, invalidate_author, author_posts_stats
+from write_behind import init_write_behind, write_behind_queue, write_behind_stats, WriteQueueFull
+
+import click
 import jwt
 import datetime
 from functools import wraps
 
 
-app = Flask(__name__)
-app.config.from_object(Config)
+bp = Blueprint('blog', __name__, cli_group=None)
+
+
+def create_app(config=None):
+    """
+    Builds the blog app from `config` (a config class), by default the one selected by APP_PROFILE.
+    Creating the app does not touch the database, the schema is created by `flask --app app init-db`
+    """
+    app = Flask(__name__)
+    app.config.from_object(config or get_config())
+    init_json_provider(app)
+
+    db.init_app(app)
+    init_auth_cache(app)
+    init_password_hasher(app)
+    init_http_cache(app)
+    init_author_posts(app)
+    init_metrics(app, cache_stats=lambda: {**auth_cache_stats(), **author_posts_stats(), "http": http_cache_stats()})
+    init_rate_limiting(app)
+    init_write_behind(app)
 
+    with app.app_context():
+        configure_engine(db.engine, app.config['SQLITE_PRAGMAS'])
+        init_instrumentation(app)
 
-# Initialize the database
-db.init_app(app)
+    app.register_blueprint(bp)
+    return app
 
 
-# Create the database tables
-with app.app_context():
-    db.create_all()
+def init_db(app):
+    """
+    Creates the missing tables and applies the pending migrations, returns the versions applied
+    """
+    with app.app_context():
+        db.create_all()
+        applied = upgrade_schema(db.engine)
+    return applied
 
 
-@app.route('/')
+def warm_up(app):
+    """
+    Runs the queries of the read endpoints once, wsgi.py calls it before forking
+    its workers so that they start with compiled statements
+    """
+    with app.app_context():
+        for statement in (
+            post_list_statement(DEFAULT_POST_LIST_FIELDS, app.config['POSTS_PAGE_SIZE']),
+            post_list_statement(POST_LIST_FIELDS, app.config['AUTHOR_POSTS_CACHE_POSTS'], author_id=0),
+            single_post_statement(0),
+            comment_count_statement(0),
+            comment_list_statement(0, app.config['COMMENTS_PAGE_SIZE']),
+            user_statement(0),
+        ):
+            db.session.execute(statement).all()
+
+
+@bp.cli.command('init-db')
+def init_db_command():
+    """Create the missing tables and apply the pending schema migrations"""
+    applied = init_db(current_app._get_current_object())
+    click.echo(f"Applied migrations: {applied}" if applied else "Schema is up to date")
+
+
+@bp.cli.command('db-upgrade')
+def db_upgrade_command():
+    """Apply the pending schema migrations"""
+    applied = upgrade_schema(db.engine)
+    click.echo(f"Applied migrations: {applied}" if applied else "Schema is up to date")
+
+
+@bp.cli.command('explain-queries')
+@click.option('--fail-on-scan', is_flag=True, help='Exit with an error when an endpoint scans a table')
+def explain_queries_command(fail_on_scan):
+    """Print EXPLAIN QUERY PLAN for the queries of every read endpoint"""
+    app = current_app._get_current_object()
+    unexpected_scans = print_query_plans(app, sample_requests(app), echo=click.echo)
+    if fail_on_scan and unexpected_scans:
+        raise click.ClickException(f"{unexpected_scans} unexpected full table scan(s)")
+
+
+@bp.route('/')
 def hello_world():
     return 'Hello, World!'
 
@@ -35,8 +118,8 @@ def token_required(f):
             return jsonify({'message': 'Token is missing'}), 403
 
         try:
-            data = jwt.decode(token, app.config['SECRET_KEY'], algorithms=["HS256"])
-            current_user = User.query.filter_by(id=data['user_id']).first()
+            data = decode_token(token)
+            current_user = load_user(data['user_id'])
         except Exception as e:
             return jsonify({'message': 'Token is invalid', 'error': str(e)}), 403
 
@@ -45,7 +128,8 @@ def token_required(f):
     return decorated
 
 
-@app.route('/blog/auth/register', methods=['POST'])
+@bp.route('/blog/auth/register', methods=['POST'])
+@rate_limit(per_client=(1, 10))
 def add_user():
     data = request.get_json()
     if not data:
@@ -73,7 +157,8 @@ def add_user():
     return jsonify({'success': True, 'message': 'User created successfully'}), 201
 
 
-@app.route('/blog/auth/login', methods=['POST'])
+@bp.route('/blog/auth/login', methods=['POST'])
+@rate_limit(per_client=(1, 10))
 def login():
     data = request.get_json()
 
@@ -85,15 +170,23 @@ def login():
 
     user = User.query.filter_by(email=email).first()
 
-    if not user or not user.check_password(password):
-        return jsonify({"error": 'email or password is incorrect'}), 401
+    try:
+        if not user or not user.check_password(password):
+            return jsonify({"error": 'email or password is incorrect'}), 401
+    except HasherBusy:
+        return jsonify({"error": 'Too many login attempts, please try again'}), 503
+
+    if user.password_needs_rehash():
+        # The hashing parameters changed since this password was stored
+        user.set_password(password)
+        db.session.commit()
 
-    token = jwt.encode({'user_id': user.id, 'exp': datetime.datetime.utcnow() + datetime.timedelta(minutes=30)}, app.config['SECRET_KEY'], algorithm="HS256")
+    token = jwt.encode({'user_id': user.id, 'exp': datetime.datetime.utcnow() + datetime.timedelta(minutes=30)}, current_app.config['SECRET_KEY'], algorithm="HS256")
 
     return jsonify({'token': token})
 
 
-@app.route('/blog/posts/create', methods=['POST'])
+@bp.route('/blog/posts/create', methods=['POST'])
 @token_required
 def create_post(user):
     """
@@ -110,6 +203,17 @@ def create_post(user):
     if "title" not in data or "content" not in data:
         return jsonify({'error': 'Bad Request', 'message': 'Please provide title, and content'}), 400
 
+    writer = write_behind_queue()
+    if writer is not None:
+        try:
+            writer.enqueue('post', {"title": data.get('title'), "content": data.get('content'), "user_id": user.id})
+        except WriteQueueFull:
+            return jsonify({"error": "Too many posts are being saved, please try again"}), 503
+        except Exception as e:
+            # Log the exception
+            return jsonify({"error": "error while saving the post"})
+        return jsonify({"success": True, "message": "Post was accepted and will be created shortly"}), 202
+
     post = Post(
         title=data.get('title'),
         content=data.get('content'),
@@ -121,46 +225,100 @@ def create_post(user):
     except Exception as e:
         # Log the exception
         return jsonify({"error": "error while saving the post"})
+    invalidate_author(user.id)
 
     return jsonify({"success": True, "message": "Post was created successfully"}), 201
 
 
-@app.route('/blog/posts', methods=['GET'])
+@bp.route('/blog/posts', methods=['GET'])
+@query_budget(1)
 def get_blog_posts():
     """
-    This API is to list all blog posts available
+    This API is to list the blog posts, newest first, using keyset pagination
+    Query parameters:
+        limit: number of posts per page
+        cursor: the `next_cursor` value returned by the previous page
+        fields: comma separated list of fields to return (id, title, content, author, created_at, comment_count)
     """
-    post_objects = Post.query.all()
-    post_json = {"posts": []}
-    for post in post_objects:
-        each_post = {
-            "title": post.title,
-            "content": post.content,
-            "author": post.author.username
-        }
-        post_json["posts"].append(each_post)
+    fields = parse_fields(request.args.get('fields'), POST_LIST_FIELDS, DEFAULT_POST_LIST_FIELDS)
+    if fields is None:
+        return jsonify({'error': 'Bad Request', 'message': 'Unknown field requested'}), 400
+
+    limit = request.args.get('limit', current_app.config['POSTS_PAGE_SIZE'], type=int)
+    limit = max(1, min(limit, current_app.config['POSTS_MAX_PAGE_SIZE']))
+
+    statement = post_list_statement(fields, limit, request.args.get('cursor'))
+    if statement is None:
+        return jsonify({'error': 'Bad Request', 'message': 'Invalid cursor'}), 400
+
+    rows = db.session.execute(statement).all()
+    return jsonify(post_list_page(rows, fields, limit)), 201
+
+
+@bp.route('/blog/users/<username>/posts', methods=['GET'])
+@query_budget(2)
+def get_author_posts(username):
+    """
+    This API lists the posts of one user, newest first, using keyset pagination.
+    The first page of recently viewed authors is served from memory
+    Query parameters:
+        limit: number of posts per page
+        cursor: the `next_cursor` value returned by the previous page
+        fields: comma separated list of fields to return (id, title, content, author, created_at, comment_count)
+    """
+    fields = parse_fields(request.args.get('fields'), POST_LIST_FIELDS, DEFAULT_POST_LIST_FIELDS)
+    if fields is None:
+        return jsonify({'error': 'Bad Request', 'message': 'Unknown field requested'}), 400
+
+    limit = request.args.get('limit', current_app.config['POSTS_PAGE_SIZE'], type=int)
+    limit = max(1, min(limit, current_app.config['POSTS_MAX_PAGE_SIZE']))
+
+    user_id = author_id(username)
+    if user_id is None:
+        return jsonify({"error": "User not found"}), 404
+
+    page = author_posts_page(user_id, fields, limit, request.args.get('cursor'))
+    if page is None:
+        return jsonify({'error': 'Bad Request', 'message': 'Invalid cursor'}), 400
+    return jsonify(page), 200
+
+
+@bp.route('/blog/posts/export', methods=['GET'])
+@query_budget(1)
+def export_blog_posts():
+    """
+    This API streams every post as newline delimited JSON.
+    Rows are fetched in batches of EXPORT_BATCH_SIZE so memory usage stays constant
+    """
+    statement = db.select(*POST_SCHEMA.columns).join(User, User.id == Post.user_id).order_by(Post.id).execution_options(
+        yield_per=current_app.config['EXPORT_BATCH_SIZE']
+    )
+
+    def rows():
+        for row in db.session.execute(statement):
+            yield POST_SCHEMA.serialize(row)
 
-    return jsonify({"success": True, "posts": post_json["posts"]}), 201
+    return ndjson_response(rows())
 
 
-@app.route('/blog/posts/<int:post_id>', methods=['GET'])
+@bp.route('/blog/posts/<int:post_id>', methods=['GET'])
+@query_budget(1)
 def get_single_post(post_id):
     """
-    This function will return a single post with the given post id
+    This function will return a single post with the given post id.
+    The serialized post is cached and the response carries ETag/Last-Modified
+    validators, so conditional requests get a 304 Not Modified
     """
-    post_object = Post.query.filter_by(id=post_id).first()
-    if post_object:
-        post = {
-            "title": post_object.title,
-            "content": post_object.content,
-            "author": post_object.author.username
-        }
-        return jsonify({"success": True, "post": post}), 201
-    else:
+    def load():
+        return single_post_resource(db.session.execute(single_post_statement(post_id)).first())
+
+    response = cached_json_response(('post', post_id), load, status=201)
+    if response is None:
         return jsonify({"error": "Post not found"}), 401
+    return response
 
 
-@app.route('/blog/posts/update/<int:post_id>', methods=['PUT'])
+@bp.route('/blog/posts/update/<int:post_id>', methods=['PUT'])
 @token_required
 def update_post(user, post_id):
     """
@@ -179,31 +337,62 @@ def update_post(user, post_id):
 
     post_object.title = post_data.get('title', '')
     post_object.content = post_data.get('content', '')
-    post_object.updated_at = post_data.get('updated', datetime.datetime.now())
+    post_object.updated_at = post_data.get('updated', datetime.datetime.utcnow())
+    author = post_object.user_id
 
     db.session.add(post_object)
     db.session.commit()
+    invalidate_http_cache(('post', post_id))
+    invalidate_author(author)
 
     return jsonify({"success": True, "message":"post successfully updated"}), 201
 
 
-@app.route('/blog/posts/delete/<int:post_id>', methods=['DELETE'])
+@bp.route('/blog/posts/delete/<int:post_id>', methods=['DELETE'])
 @token_required
 def delete_post(user, post_id):
     post_object = Post.query.filter_by(id=post_id).first()
     if not post_object:
         return jsonify({"error": "Post not found with given post id"}), 401
 
+    author = post_object.user_id
     try:
         db.session.delete(post_object)
         db.session.commit()
     except Exception as e:
         # Log the exception
         return jsonify({"error":"Error deleting the post"}), 500
+    invalidate_http_cache(('post', post_id))
+    invalidate_author(author)
     return jsonify({"success": True, "message": "Post deleted successfully"}), 201
 
 
-@app.route('/blog/posts/<int:post_id>/comments', methods=['POST'])
+@bp.route('/blog/posts/<int:post_id>/comments', methods=['GET'])
+@query_budget(2)
+def get_post_comments(post_id):
+    """
+    This API lists the comments of a post, oldest first, using keyset pagination.
+    The authors are loaded with the comments in a single joined query
+    Query parameters:
+        limit: number of comments per page
+        cursor: the `next_cursor` value returned by the previous page
+    """
+    post_object = db.session.execute(comment_count_statement(post_id)).first()
+    if not post_object:
+        return jsonify({"error": "Post not found"}), 401
+
+    limit = request.args.get('limit', current_app.config['COMMENTS_PAGE_SIZE'], type=int)
+    limit = max(1, min(limit, current_app.config['COMMENTS_MAX_PAGE_SIZE']))
+
+    statement = comment_list_statement(post_id, limit, request.args.get('cursor'))
+    if statement is None:
+        return jsonify({'error': 'Bad Request', 'message': 'Invalid cursor'}), 400
+
+    rows = db.session.execute(statement).all()
+    return jsonify(comment_list_page(rows, post_object.comment_count, limit)), 200
+
+
+@bp.route('/blog/posts/<int:post_id>/comments', methods=['POST'])
 @token_required
 def add_comment(user, post_id):
     comment_data = request.get_json()
@@ -216,6 +405,18 @@ def add_comment(user, post_id):
     post_object = Post.query.filter_by(id=post_id).first()
     if not post_object:
         return jsonify({'error': 'Error finding the post object'}), 401
+    author = post_object.user_id
+
+    writer = write_behind_queue()
+    if writer is not None:
+        try:
+            writer.enqueue('comment', {"post_id": post_object.id, "content": comment_data["content"], "user_id": user.id})
+        except WriteQueueFull:
+            return jsonify({'error': "Too many comments are being saved, please try again"}), 503
+        except Exception as e:
+            # Log the exception
+            return jsonify({'error': "Failed to create comment"}), 500
+        return jsonify({'success': True, 'message': "Comment was accepted and will be created shortly"}), 202
 
     try:
         comment = Comment(
@@ -228,9 +429,51 @@ def add_comment(user, post_id):
     except Exception as e:
         # Log the exception
         return jsonify({'error': "Failed to create comment"}), 500
+    # The cached post and author feed carry the comment count
+    invalidate_http_cache(('post', post_id))
+    invalidate_author(author)
 
     return jsonify({'success': True, 'message': "Comment created successfully"}), 200
 
 
+@bp.route('/blog/cache/stats', methods=['GET'])
+def get_cache_stats():
+    """
+    This API returns the size and hit/miss counters of the token, user, author feed and HTTP response caches
+    """
+    caches = auth_cache_stats()
+    caches.update(author_posts_stats())
+    caches["http"] = http_cache_stats()
+    return jsonify({"success": True, "caches": caches})
+
+
+@bp.route('/blog/rate-limit/stats', methods=['GET'])
+def get_rate_limit_stats():
+    """
+    This API returns the rate limiter counters: allowed and limited requests per route,
+    requests in flight and requests shed by the concurrency limit
+    """
+    return jsonify({"success": True, "rate_limit": rate_limit_stats()})
+
+
+@bp.route('/blog/write-behind/stats', methods=['GET'])
+def get_write_behind_stats():
+    """
+    This API returns the write-behind queue counters: queued rows, commits, rows per transaction
+    and the average and maximum time from acceptance to commit
+    """
+    return jsonify({"success": True, "write_behind": write_behind_stats()})
+
+
+@bp.route('/metrics', methods=['GET'])
+def get_metrics():
+    """
+    This API exposes request, database, cache and rate limiting metrics in the Prometheus text format
+    """
+    return Response(render_metrics(current_app), content_type=METRICS_CONTENT_TYPE)
+
+
 if __name__ == '__main__':
+    app = create_app()
+    init_db(app)
     app.run(port=5003, debug=True)
@@ -0,0 +1,67 @@
+"""
+ASGI entry point of the blog service.
+
+The post listing, single post and comment listing are served by async
+handlers, every other endpoint by the Flask app.
+
+    python asgi.py
+    uvicorn asgi:application --port 5003 --workers 4
+"""
+from app import create_app, init_db
+from service_common.async_app import AsyncApp, json_response, serve
+from read_queries import POST_LIST_FIELDS, DEFAULT_POST_LIST_FIELDS, single_post_statement, single_post_resource, \
+    post_list_statement, post_list_page, comment_count_statement, comment_list_statement, comment_list_page
+from utils import parse_fields
+
+app = create_app()
+application = AsyncApp(app)
+
+
+@application.route('/blog/posts')
+async def get_blog_posts(request, session):
+    fields = parse_fields(request.args.get('fields'), POST_LIST_FIELDS, DEFAULT_POST_LIST_FIELDS)
+    if fields is None:
+        return json_response({'error': 'Bad Request', 'message': 'Unknown field requested'}, 400)
+
+    limit = request.args.get('limit', app.config['POSTS_PAGE_SIZE'], type=int)
+    limit = max(1, min(limit, app.config['POSTS_MAX_PAGE_SIZE']))
+
+    statement = post_list_statement(fields, limit, request.args.get('cursor'))
+    if statement is None:
+        return json_response({'error': 'Bad Request', 'message': 'Invalid cursor'}, 400)
+
+    rows = (await session.execute(statement)).all()
+    return json_response(post_list_page(rows, fields, limit), 201)
+
+
+@application.route('/blog/posts/<int:post_id>')
+async def get_single_post(request, session, post_id):
+    async def load():
+        return single_post_resource((await session.execute(single_post_statement(post_id))).first())
+
+    response = await application.cached_json(request, ('post', post_id), load, status=201)
+    if response is None:
+        return json_response({"error": "Post not found"}, 401)
+    return response
+
+
+@application.route('/blog/posts/<int:post_id>/comments')
+async def get_post_comments(request, session, post_id):
+    post_object = (await session.execute(comment_count_statement(post_id))).first()
+    if not post_object:
+        return json_response({"error": "Post not found"}, 401)
+
+    limit = request.args.get('limit', app.config['COMMENTS_PAGE_SIZE'], type=int)
+    limit = max(1, min(limit, app.config['COMMENTS_MAX_PAGE_SIZE']))
+
+    statement = comment_list_statement(post_id, limit, request.args.get('cursor'))
+    if statement is None:
+        return json_response({'error': 'Bad Request', 'message': 'Invalid cursor'}, 400)
+
+    rows = (await session.execute(statement)).all()
+    return json_response(comment_list_page(rows, post_object.comment_count, limit), 200)
+
+
+if __name__ == '__main__':
+    init_db(app)
+    serve('asgi:application', app.config, port=5003)
@@ -0,0 +1,92 @@
+"""
+Per author post index behind GET /blog/users/<username>/posts.
+
+The feed lists one user's posts newest first with the same keyset cursors as
+/blog/posts, seeking into the (user_id, created_at) index. The newest
+AUTHOR_POSTS_CACHE_POSTS posts of recently viewed authors are kept in memory
+together with the username to id mapping, so the first page of a profile is
+served without a query. Routes that create, update or delete a post or add a
+comment (the cached posts carry their comment count) must call
+`invalidate_author`; entries also expire after AUTHOR_POSTS_CACHE_TTL seconds
+so other worker processes' writes become visible.
+"""
+from collections import namedtuple
+
+from flask import current_app
+
+from service_common.lru_cache import LRUCache
+from models import db, User
+from read_queries import POST_LIST_FIELDS, post_list_statement, post_list_page
+from serializers import POST_SCHEMA
+from utils import encode_cursor
+
+EXTENSION_KEY = 'author_posts'
+
+CachedPost = namedtuple('CachedPost', POST_LIST_FIELDS + ('cursor_created_at',))
+
+
+def init_author_posts(app):
+    app.extensions[EXTENSION_KEY] = {
+        "author_ids": LRUCache(app.config['AUTHOR_CACHE_SIZE']),
+        "author_posts": LRUCache(app.config['AUTHOR_CACHE_SIZE'], ttl=app.config['AUTHOR_POSTS_CACHE_TTL']),
+    }
+
+
+def _caches():
+    return current_app.extensions[EXTENSION_KEY]
+
+
+def author_id(username):
+    """
+    Returns the id of the user with `username` or None. Ids never change, found ones are cached without expiry
+    """
+    author_ids = _caches()["author_ids"]
+    user_id = author_ids.get(username)
+    if user_id is None:
+        user_id = db.session.scalar(db.select(User.id).where(User.username == username))
+        if user_id is not None:
+            author_ids.set(username, user_id)
+    return user_id
+
+
+def _recent_posts(user_id):
+    """
+    Returns the cached newest posts of an author, one more than AUTHOR_POSTS_CACHE_POSTS
+    is loaded so a full first page knows whether there is a next one
+    """
+    cache = _caches()["author_posts"]
+    posts = cache.get(user_id)
+    if posts is None:
+        statement = post_list_statement(POST_LIST_FIELDS, current_app.config['AUTHOR_POSTS_CACHE_POSTS'],
+                                        author_id=user_id)
+        posts = tuple(
+            CachedPost(*row[:len(POST_LIST_FIELDS)], row._created_at) for row in db.session.execute(statement)
+        )
+        cache.set(user_id, posts)
+    return posts
+
+
+def author_posts_page(user_id, fields, limit, cursor=None):
+    """
+    Returns a page of the author feed, or None if the cursor is invalid.
+    The first page is served from the cache unless `limit` exceeds AUTHOR_POSTS_CACHE_POSTS
+    """
+    if not cursor and limit <= current_app.config['AUTHOR_POSTS_CACHE_POSTS']:
+        posts = _recent_posts(user_id)
+        page = posts[:limit]
+        next_cursor = encode_cursor(page[-1].cursor_created_at, page[-1].id) if len(posts) > limit else None
+        schema = POST_SCHEMA.only(*fields)
+        return {"success": True, "posts": [schema.serialize_object(post) for post in page], "next_cursor": next_cursor}
+
+    statement = post_list_statement(fields, limit, cursor, author_id=user_id)
+    if statement is None:
+        return None
+    return post_list_page(db.session.execute(statement).all(), fields, limit)
+
+
+def invalidate_author(user_id):
+    _caches()["author_posts"].invalidate(user_id)
+
+
+def author_posts_stats():
+    return {name: cache.stats() for name, cache in _caches().items()}
@@ -5,5 +5,107 @@ basedir = os.path.abspath(os.path.dirname(__file__))
 
 class Config:
     SECRET_KEY = os.environ.get('SECRET_KEY') or 'you-will-never-guess'
-    SQLALCHEMY_DATABASE_URI = 'sqlite:///' + os.path.join(basedir, 'blog_post.db')
-    SQLALCHEMY_TRACK_MODIFICATIONS = False
\ No newline at end of file
+    SQLALCHEMY_DATABASE_URI = os.environ.get('DATABASE_URL') or 'sqlite:///' + os.path.join(basedir, 'blog_post.db')
+    SQLALCHEMY_TRACK_MODIFICATIONS = False
+    SQLITE_PRAGMAS = {}
+    POSTS_PAGE_SIZE = 20
+    POSTS_MAX_PAGE_SIZE = 100
+    COMMENTS_PAGE_SIZE = 50
+    COMMENTS_MAX_PAGE_SIZE = 200
+    EXPORT_BATCH_SIZE = 1000
+    TOKEN_CACHE_SIZE = 10000
+    USER_CACHE_SIZE = 10000
+    USER_CACHE_TTL = 60
+    HTTP_CACHE_SIZE = int(os.environ.get('HTTP_CACHE_SIZE', 10000))
+    HTTP_CACHE_TTL = int(os.environ.get('HTTP_CACHE_TTL', 30))
+    # Authors whose id and newest posts are kept in memory for GET /blog/users/<username>/posts
+    AUTHOR_CACHE_SIZE = int(os.environ.get('AUTHOR_CACHE_SIZE', 10000))
+    AUTHOR_POSTS_CACHE_POSTS = int(os.environ.get('AUTHOR_POSTS_CACHE_POSTS', 50))
+    AUTHOR_POSTS_CACHE_TTL = int(os.environ.get('AUTHOR_POSTS_CACHE_TTL', 30))
+    PASSWORD_HASH_METHOD = os.environ.get('PASSWORD_HASH_METHOD', 'scrypt')
+    PASSWORD_HASH_WORKERS = int(os.environ.get('PASSWORD_HASH_WORKERS', 0))
+    PASSWORD_HASH_MAX_PENDING = int(os.environ.get('PASSWORD_HASH_MAX_PENDING', 64))
+    PASSWORD_HASH_TIMEOUT = float(os.environ.get('PASSWORD_HASH_TIMEOUT', 2))
+    SQL_INSTRUMENTATION = os.environ.get('SQL_INSTRUMENTATION', '0') == '1'
+    SLOW_QUERY_MS = float(os.environ.get('SLOW_QUERY_MS', 100))
+    QUERY_BUDGET = int(os.environ['QUERY_BUDGET']) if os.environ.get('QUERY_BUDGET') else None
+    QUERY_BUDGETS = {}
+    QUERY_BUDGET_STRICT = os.environ.get('QUERY_BUDGET_STRICT', '0') == '1'
+    ASGI_HOST = os.environ.get('ASGI_HOST', '127.0.0.1')
+    ASGI_WORKERS = int(os.environ.get('ASGI_WORKERS', 1))
+    # Threads running the endpoints that are not served asynchronously
+    ASGI_THREADS = int(os.environ.get('ASGI_THREADS', 32))
+    ASGI_BACKLOG = int(os.environ.get('ASGI_BACKLOG', 2048))
+    ASGI_KEEP_ALIVE_TIMEOUT = int(os.environ.get('ASGI_KEEP_ALIVE_TIMEOUT', 5))
+    # Pre-fork mode (wsgi.py): gunicorn worker processes, each running PREFORK_THREADS requests at a time
+    PREFORK_BIND = os.environ.get('PREFORK_BIND', '127.0.0.1:5003')
+    PREFORK_WORKERS = int(os.environ.get('PREFORK_WORKERS', os.cpu_count() or 1))
+    PREFORK_THREADS = int(os.environ.get('PREFORK_THREADS', 8))
+    PREFORK_BACKLOG = int(os.environ.get('PREFORK_BACKLOG', 2048))
+    PREFORK_KEEP_ALIVE_TIMEOUT = int(os.environ.get('PREFORK_KEEP_ALIVE_TIMEOUT', 5))
+    # Seconds a worker may stop responding before it is replaced
+    PREFORK_TIMEOUT = int(os.environ.get('PREFORK_TIMEOUT', 30))
+    # Seconds a stopping worker is given to finish its in-flight requests
+    PREFORK_GRACEFUL_TIMEOUT = int(os.environ.get('PREFORK_GRACEFUL_TIMEOUT', 30))
+    RATE_LIMIT_ENABLED = os.environ.get('RATE_LIMIT_ENABLED', '0') == '1'
+    # {endpoint: {"per_client": (requests per second, burst), "per_route": (...)}}, overrides @rate_limit
+    RATE_LIMITS = {}
+    # Per client (requests per second, burst) of the routes without their own limits
+    RATE_LIMIT_DEFAULT = None
+    RATE_LIMIT_MAX_CONCURRENT = int(os.environ.get('RATE_LIMIT_MAX_CONCURRENT', 0))
+    RATE_LIMIT_QUEUE_TIMEOUT = float(os.environ.get('RATE_LIMIT_QUEUE_TIMEOUT', 0))
+    RATE_LIMIT_MAX_KEYS = int(os.environ.get('RATE_LIMIT_MAX_KEYS', 100000))
+    # Shares the buckets between the worker processes of a host
+    RATE_LIMIT_SQLITE_PATH = os.environ.get('RATE_LIMIT_SQLITE_PATH')
+    WRITE_BEHIND_ENABLED = os.environ.get('WRITE_BEHIND_ENABLED', '0') == '1'
+    # Rows accepted and not committed yet, further creates wait WRITE_BEHIND_ENQUEUE_TIMEOUT seconds, then get a 503
+    WRITE_BEHIND_QUEUE_SIZE = int(os.environ.get('WRITE_BEHIND_QUEUE_SIZE', 10000))
+    WRITE_BEHIND_ENQUEUE_TIMEOUT = float(os.environ.get('WRITE_BEHIND_ENQUEUE_TIMEOUT', 1))
+    WRITE_BEHIND_BATCH_SIZE = int(os.environ.get('WRITE_BEHIND_BATCH_SIZE', 500))
+    WRITE_BEHIND_FLUSH_INTERVAL = float(os.environ.get('WRITE_BEHIND_FLUSH_INTERVAL', 0.05))
+    WRITE_BEHIND_SHUTDOWN_TIMEOUT = float(os.environ.get('WRITE_BEHIND_SHUTDOWN_TIMEOUT', 10))
+    WRITE_BEHIND_SPOOL_DIR = os.environ.get('WRITE_BEHIND_SPOOL_DIR') or os.path.join(basedir, 'write_behind_spool')
+    WRITE_BEHIND_SPOOL_FSYNC = os.environ.get('WRITE_BEHIND_SPOOL_FSYNC', '0') == '1'
+
+
+class ProductionConfig(Config):
+    """
+    Engine profile for serving concurrent traffic: SQLite runs in WAL mode so
+    readers do not block on writers, and connections come from a sized pool.
+    Setting DATABASE_URL to a postgresql:// URI switches the database and
+    enables pool_pre_ping, the SQLite pragmas are ignored in that case.
+    The ASGI mode starts one worker process per CPU, and rate limiting is on
+    with at most RATE_LIMIT_MAX_CONCURRENT (default 64) requests per process.
+    """
+    SQLITE_PRAGMAS = {
+        'journal_mode': 'WAL',
+        'synchronous': 'NORMAL',
+        # Negative values are in KiB
+        'cache_size': int(os.environ.get('SQLITE_CACHE_SIZE', -64000)),
+        'mmap_size': int(os.environ.get('SQLITE_MMAP_SIZE', 268435456)),
+        'busy_timeout': int(os.environ.get('SQLITE_BUSY_TIMEOUT', 5000)),
+        'temp_store': 'MEMORY',
+    }
+    ASGI_WORKERS = int(os.environ.get('ASGI_WORKERS', os.cpu_count() or 1))
+    RATE_LIMIT_ENABLED = os.environ.get('RATE_LIMIT_ENABLED', '1') == '1'
+    RATE_LIMIT_MAX_CONCURRENT = int(os.environ.get('RATE_LIMIT_MAX_CONCURRENT', 64))
+    SQLALCHEMY_ENGINE_OPTIONS = {
+        'pool_size': int(os.environ.get('DB_POOL_SIZE', 10)),
+        'max_overflow': int(os.environ.get('DB_MAX_OVERFLOW', 20)),
+        'pool_timeout': int(os.environ.get('DB_POOL_TIMEOUT', 10)),
+        'pool_recycle': 1800,
+        'pool_pre_ping': not Config.SQLALCHEMY_DATABASE_URI.startswith('sqlite'),
+    }
+
+
+CONFIGS = {
+    'default': Config,
+    'production': ProductionConfig,
+}
+
+
+def get_config():
+    """
+    Returns the config class selected by the APP_PROFILE environment variable
+    """
+    return CONFIGS[os.environ.get('APP_PROFILE', 'default')]
@@ -0,0 +1,81 @@
+"""
+Versioned schema migrations.
+
+db.create_all() creates missing tables but never changes existing ones, so
+every schema change is added to MIGRATIONS with the next version number.
+`upgrade` applies the pending migrations in order, each in its own
+transaction, and records them in the schema_migrations table. Steps are SQL
+strings or callables taking the connection, and must be safe to run on a
+database that create_all() just built from the current models.
+
+    flask --app app db-upgrade
+"""
+import datetime
+
+from sqlalchemy import inspect, text
+
+
+def add_column_if_missing(table_name, column_name, column_ddl):
+    """
+    Returns a migration step adding a column unless the table already has it
+    """
+    def step(connection):
+        columns = [column['name'] for column in inspect(connection).get_columns(table_name)]
+        if column_name not in columns:
+            connection.execute(text(f"ALTER TABLE {table_name} ADD COLUMN {column_name} {column_ddl}"))
+    return step
+
+
+MIGRATIONS = [
+    (1, "Add indexes for the post listing and comment lookups", [
+        "CREATE INDEX IF NOT EXISTS ix_post_created_at_id ON post (created_at, id)",
+        "CREATE INDEX IF NOT EXISTS ix_post_user_id_created_at ON post (user_id, created_at)",
+        "CREATE INDEX IF NOT EXISTS ix_comment_post_id_created_at ON comment (post_id, created_at)",
+        "CREATE INDEX IF NOT EXISTS ix_comment_user_id ON comment (user_id)",
+    ]),
+    (2, "Denormalize the number of comments on posts", [
+        add_column_if_missing('post', 'comment_count', "INTEGER NOT NULL DEFAULT 0"),
+        "UPDATE post SET comment_count = (SELECT COUNT(*) FROM comment WHERE comment.post_id = post.id)",
+    ]),
+    (3, "Track the committed sequence of the write-behind spools", [
+        "CREATE TABLE IF NOT EXISTS write_behind_offset ("
+        "spool VARCHAR(100) NOT NULL PRIMARY KEY, sequence INTEGER NOT NULL)",
+    ]),
+]
+
+_CREATE_VERSION_TABLE = (
+    "CREATE TABLE IF NOT EXISTS schema_migrations ("
+    "version INTEGER PRIMARY KEY, description VARCHAR(200) NOT NULL, applied_at VARCHAR(32) NOT NULL)"
+)
+
+
+def applied_versions(connection):
+    connection.execute(text(_CREATE_VERSION_TABLE))
+    return {row[0] for row in connection.execute(text("SELECT version FROM schema_migrations"))}
+
+
+def upgrade(engine, migrations=MIGRATIONS):
+    """
+    Applies the pending migrations and returns the list of versions applied
+    """
+    with engine.begin() as connection:
+        done = applied_versions(connection)
+
+    applied = []
+    for version, description, steps in sorted(migrations, key=lambda migration: migration[0]):
+        if version in done:
+            continue
+        with engine.begin() as connection:
+            for step in steps:
+                if callable(step):
+                    step(connection)
+                else:
+                    connection.execute(text(step))
+            connection.execute(
+                text("INSERT INTO schema_migrations (version, description, applied_at) "
+                     "VALUES (:version, :description, :applied_at)"),
+                {"version": version, "description": description,
+                 "applied_at": datetime.datetime.utcnow().isoformat()}
+            )
+        applied.append(version)
+    return applied
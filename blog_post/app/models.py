@@ -1,6 +1,7 @@
 from flask_sqlalchemy import SQLAlchemy
-from sqlalchemy import func
-from werkzeug.security import generate_password_hash, check_password_hash
+from sqlalchemy import event, func
+
+from passwords import get_password_hasher
 
 db = SQLAlchemy()
 
@@ -16,10 +17,13 @@ class User(db.Model):
     comments = db.relationship('Comment', backref='author')
 
     def set_password(self, password):
-        self.password_hash = generate_password_hash(password)
+        self.password_hash = get_password_hasher().hash(password)
 
     def check_password(self, password):
-        return check_password_hash(self.password_hash, password)
+        return get_password_hasher().verify(self.password_hash, password)
+
+    def password_needs_rehash(self):
+        return get_password_hasher().needs_rehash(self.password_hash)
 
     def __repr__(self):
         return f'<User {self.username}>'
@@ -32,8 +36,15 @@ class Post(db.Model):
     user_id = db.Column(db.Integer, db.ForeignKey('user.id', ondelete='CASCADE'), nullable=False)
     created_at = db.Column(db.DateTime(timezone=True), server_default=func.now())
     updated_at = db.Column(db.DateTime(timezone=True), server_default=func.now())
+    # Maintained by the Comment insert/delete events below
+    comment_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
     comments = db.relationship('Comment', backref='post')
 
+    __table_args__ = (
+        db.Index('ix_post_created_at_id', 'created_at', 'id'),
+        db.Index('ix_post_user_id_created_at', 'user_id', 'created_at'),
+    )
+
     def __repr__(self):
         return f'<Post {self.title}>'
 
@@ -45,5 +56,32 @@ class Comment(db.Model):
     user_id = db.Column(db.Integer, db.ForeignKey('user.id', ondelete='CASCADE'))
     created_at = db.Column(db.DateTime(timezone=True), server_default=func.now())
 
+    __table_args__ = (
+        db.Index('ix_comment_post_id_created_at', 'post_id', 'created_at'),
+        db.Index('ix_comment_user_id', 'user_id'),
+    )
+
     def __repr__(self):
         return f'<Comment {self.content}>'
+
+
+class WriteBehindOffset(db.Model):
+    """
+    Last sequence of every write-behind spool that is committed, see write_behind.py
+    """
+    spool = db.Column(db.String(100), primary_key=True)
+    sequence = db.Column(db.Integer, nullable=False)
+
+
+@event.listens_for(Comment, 'after_insert')
+def increment_comment_count(mapper, connection, comment):
+    connection.execute(
+        db.update(Post).where(Post.id == comment.post_id).values(comment_count=Post.comment_count + 1)
+    )
+
+
+@event.listens_for(Comment, 'after_delete')
+def decrement_comment_count(mapper, connection, comment):
+    connection.execute(
+        db.update(Post).where(Post.id == comment.post_id).values(comment_count=Post.comment_count - 1)
+    )
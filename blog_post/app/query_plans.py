@@ -0,0 +1,33 @@
+"""
+Sample requests of `flask --app app explain-queries`, the plans are printed by
+service_common.query_plans.
+"""
+import datetime
+
+import jwt
+from models import db, User
+from utils import encode_cursor
+
+
+def sample_requests(app):
+    """
+    (method, url, json payload, headers, whether a full scan is expected) per endpoint
+    """
+    token = jwt.encode(
+        {'user_id': 1, 'exp': datetime.datetime.utcnow() + datetime.timedelta(minutes=5)},
+        app.config['SECRET_KEY'], algorithm="HS256"
+    )
+    cursor = encode_cursor('2024-01-01 00:00:00', 1)
+    with app.app_context():
+        username = db.session.scalar(db.select(User.username).order_by(User.id).limit(1)) or 'nobody'
+    return [
+        ('GET', '/blog/posts', None, {}, False),
+        ('GET', '/blog/posts?fields=id,title&cursor=' + cursor, None, {}, False),
+        ('GET', '/blog/posts/1', None, {}, False),
+        ('GET', f'/blog/users/{username}/posts?fields=id,title,author&cursor=' + cursor, None, {}, False),
+        ('GET', '/blog/posts/1/comments?cursor=' + cursor, None, {}, False),
+        ('GET', '/blog/posts/export', None, {}, True),
+        ('POST', '/blog/auth/login', {'email': 'nobody@example.com', 'password': 'x'}, {}, False),
+        ('POST', '/blog/posts/0/comments', {'content': 'x'}, {'x-access-tokens': token}, False),
+    ]
+
@@ -0,0 +1,123 @@
+"""
+Statements and payload builders of the public read endpoints.
+
+They are shared by the Flask routes in app.py and the async handlers in
+asgi.py, so every statement is a 2.0 style select that runs unchanged on the
+sync and on the async session.
+"""
+from models import db, User, Post, Comment
+from serializers import POST_SCHEMA, COMMENT_SCHEMA
+from utils import encode_cursor, decode_cursor
+
+# Fields that can be requested through the `fields` query parameter of the post listing
+POST_LIST_FIELDS = ("id", "title", "content", "author", "created_at", "comment_count")
+DEFAULT_POST_LIST_FIELDS = ("title", "content", "author", "comment_count")
+SINGLE_POST_SCHEMA = POST_SCHEMA.only("title", "content", "author", "comment_count")
+
+
+def _cursor_position(cursor):
+    position = decode_cursor(cursor)
+    if not isinstance(position, list) or len(position) != 2:
+        return None
+    return position
+
+
+def single_post_statement(post_id):
+    return db.select(
+        *SINGLE_POST_SCHEMA.columns, Post.updated_at.label('_updated_at')
+    ).join(User, User.id == Post.user_id).where(Post.id == post_id)
+
+
+def single_post_resource(row):
+    """
+    Returns the (version, last_modified, build_payload) tuple http_cache expects for a
+    row of single_post_statement, or None when the post does not exist
+    """
+    if row is None:
+        return None
+    version = (row._updated_at, row.comment_count)
+    return version, row._updated_at, lambda: {"success": True, "post": SINGLE_POST_SCHEMA.serialize(row)}
+
+
+def post_list_statement(fields, limit, cursor=None, author_id=None):
+    """
+    Returns the keyset paginated post listing, newest first, or None if the cursor is invalid.
+    With `author_id` only that user's posts are listed, through the (user_id, created_at) index.
+    One extra row is fetched to know whether there is a next page
+    """
+    # created_at is compared as stored so that the cursor value round trips exactly
+    created_at_key = db.type_coerce(Post.created_at, db.String)
+    statement = db.select(
+        *POST_SCHEMA.only(*fields).columns,
+        Post.id.label('_id'),
+        created_at_key.label('_created_at')
+    )
+    if "author" in fields:
+        statement = statement.join(User, User.id == Post.user_id)
+    if author_id is not None:
+        statement = statement.where(Post.user_id == author_id)
+
+    if cursor:
+        position = _cursor_position(cursor)
+        if position is None:
+            return None
+        last_created_at, last_id = position
+        # The leading range condition lets SQLite seek into the (created_at, id) index
+        statement = statement.where(
+            created_at_key <= last_created_at,
+            db.or_(created_at_key < last_created_at, Post.id < last_id)
+        )
+
+    return statement.order_by(Post.created_at.desc(), Post.id.desc()).limit(limit + 1)
+
+
+def post_list_page(rows, fields, limit):
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor(rows[-1]._created_at, rows[-1]._id)
+
+    posts = POST_SCHEMA.only(*fields).serialize_many(rows)
+    return {"success": True, "posts": posts, "next_cursor": next_cursor}
+
+
+def comment_count_statement(post_id):
+    return db.select(Post.id, Post.comment_count).where(Post.id == post_id)
+
+
+def comment_list_statement(post_id, limit, cursor=None):
+    """
+    Returns the keyset paginated comments of a post, oldest first, with their authors
+    in the same query, or None if the cursor is invalid
+    """
+    created_at_key = db.type_coerce(Comment.created_at, db.String)
+    statement = db.select(
+        *COMMENT_SCHEMA.columns, created_at_key.label('_created_at')
+    ).join(User, User.id == Comment.user_id).where(Comment.post_id == post_id)
+
+    if cursor:
+        position = _cursor_position(cursor)
+        if position is None:
+            return None
+        last_created_at, last_id = position
+        # The leading range condition lets SQLite seek into the (post_id, created_at) index
+        statement = statement.where(
+            created_at_key >= last_created_at,
+            db.or_(created_at_key > last_created_at, Comment.id > last_id)
+        )
+
+    return statement.order_by(Comment.created_at, Comment.id).limit(limit + 1)
+
+
+def comment_list_page(rows, comment_count, limit):
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor(rows[-1]._created_at, rows[-1].id)
+
+    return {
+        "success": True,
+        "comment_count": comment_count,
+        "comments": COMMENT_SCHEMA.serialize_many(rows),
+        "next_cursor": next_cursor
+    }
@@ -1,4 +1,10 @@
+import base64
+import json
+
+from flask import Response, stream_with_context
+
 from models import User
+from serializers import dumps
 
 
 def validate_create_user_payload(request_json):
@@ -25,4 +31,54 @@ def email_exists(email):
         user_object = User.query.filter_by(email=email).first()
     except Exception as e:
         return False
-    return user_object
\ No newline at end of file
+    return user_object
+
+def encode_cursor(*values):
+    """
+    Builds an opaque pagination cursor out of the last row's sort key values
+    """
+    raw = json.dumps(values, separators=(',', ':'), default=str).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    """
+    Reverses encode_cursor. Returns None when the cursor can not be decoded
+    """
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        return json.loads(base64.urlsafe_b64decode(padded.encode()))
+    except (ValueError, TypeError):
+        return None
+
+
+def parse_fields(fields_param, allowed_fields, default_fields):
+    """
+    Parses the comma separated `fields` query parameter.
+    Returns the list of requested fields or None if an unknown field was requested
+    """
+    if not fields_param:
+        return list(default_fields)
+
+    fields = []
+    for field in fields_param.split(','):
+        field = field.strip()
+        if not field:
+            continue
+        if field not in allowed_fields:
+            return None
+        if field not in fields:
+            fields.append(field)
+    return fields or list(default_fields)
+
+
+def ndjson_response(rows):
+    """
+    Streams an iterable of dicts as newline delimited JSON.
+    `rows` should be a generator so the query only runs once the response is being sent
+    """
+    def generate():
+        for row in rows:
+            yield dumps(row) + b'\n'
+
+    return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
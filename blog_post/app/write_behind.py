@@ -0,0 +1,510 @@
+"""
+Write-behind batching of post and comment creation.
+
+With WRITE_BEHIND_ENABLED the create endpoints validate the request, append
+the new row to a local spool file and put it on a bounded in-process queue,
+then answer 202 without waiting for the database. A background writer takes
+up to WRITE_BEHIND_BATCH_SIZE rows at a time, or whatever arrived within
+WRITE_BEHIND_FLUSH_INTERVAL seconds of the oldest queued row, and inserts them
+in one transaction, so a burst of comments costs one commit per batch instead
+of one per comment.
+
+* Backpressure: at most WRITE_BEHIND_QUEUE_SIZE rows may be waiting for their
+  commit. A request that finds no room within WRITE_BEHIND_ENQUEUE_TIMEOUT
+  seconds gets WriteQueueFull (503).
+* Crash safety: every spooled row carries a sequence number and each batch
+  records the last sequence it committed in the write_behind_offset table,
+  in the same transaction. On start the rows of the spool past that offset
+  are queued again, so a row is written exactly once. The spool is written
+  through to the OS, WRITE_BEHIND_SPOOL_FSYNC also syncs it to disk.
+* Shutdown: the queue is drained when the process exits. Rows still pending
+  after WRITE_BEHIND_SHUTDOWN_TIMEOUT stay in the spool for the next start.
+
+Every process claims its own spool in WRITE_BEHIND_SPOOL_DIR with a file lock
+and replays the spools no running process holds, e.g. those of a crashed
+worker. The writer starts with the first request, creating the app does not
+touch the database or the spool.
+
+Reads are eventually consistent: a created post or comment shows up once its
+batch is committed, usually within WRITE_BEHIND_FLUSH_INTERVAL.
+"""
+import atexit
+import datetime
+import glob
+import logging
+import os
+import threading
+import time
+from collections import Counter, deque, namedtuple
+
+from flask import current_app
+from sqlalchemy import bindparam
+from sqlalchemy.exc import OperationalError
+
+from models import db, Post, Comment, WriteBehindOffset
+from serializers import dumps, loads
+from service_common.http_cache import invalidate as invalidate_http_cache
+from author_posts import invalidate_author
+
+try:
+    import fcntl
+except ImportError:  # not available on Windows, a single unlocked spool is used
+    fcntl = None
+
+EXTENSION_KEY = 'write_behind'
+
+logger = logging.getLogger(__name__)
+
+Write = namedtuple('Write', ['sequence', 'kind', 'values', 'line', 'enqueued'])
+
+
+class WriteQueueFull(Exception):
+    """
+    Raised when the queue stays full for the enqueue timeout
+    """
+
+
+def _parse_spool(path, after):
+    """
+    Returns the Writes stored in a spool file with a sequence above `after` and the last sequence seen
+    """
+    writes, last_sequence = [], after
+    try:
+        with open(path, 'rb') as f:
+            for line in f:
+                try:
+                    record = loads(line)
+                except ValueError:
+                    # A line cut short by a crash, it was never acknowledged
+                    continue
+                last_sequence = max(last_sequence, record['sequence'])
+                if record['sequence'] > after:
+                    writes.append(Write(record['sequence'], record['kind'], record['values'], line, time.monotonic()))
+    except FileNotFoundError:
+        pass
+    return writes, last_sequence
+
+
+class Spool:
+    """
+    Append-only file of the queued writes, guarded by an exclusive lock on a companion .lock file
+    """
+
+    def __init__(self, path, fsync=False):
+        self.path = path
+        self.name = os.path.basename(path)
+        self.fsync = fsync
+        self.size = 0
+        self._lock_file = None
+        self._file = None
+
+    def try_lock(self):
+        self._lock_file = open(self.path + '.lock', 'a')
+        if fcntl is not None:
+            try:
+                fcntl.flock(self._lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError:
+                self._lock_file.close()
+                self._lock_file = None
+                return False
+        return True
+
+    def open(self):
+        self._file = open(self.path, 'ab')
+        self.size = self._file.tell()
+
+    def append(self, line):
+        self._file.write(line)
+        self._file.flush()
+        if self.fsync:
+            os.fsync(self._file.fileno())
+        self.size += len(line)
+
+    def rewrite(self, lines):
+        """
+        Atomically replaces the content with `lines`, the writes which are not committed yet
+        """
+        temporary_path = self.path + '.tmp'
+        with open(temporary_path, 'wb') as f:
+            f.writelines(lines)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temporary_path, self.path)
+        self._file.close()
+        self.open()
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+        if self._lock_file is not None:
+            self._lock_file.close()
+
+
+class WriteBehindQueue:
+
+    def __init__(self, app, spool_dir, max_size=10000, batch_size=500, flush_interval=0.05,
+                 enqueue_timeout=1.0, shutdown_timeout=10.0, spool_max_bytes=64 * 1024 * 1024, fsync=False):
+        self.app = app
+        self.spool_dir = spool_dir
+        self.max_size = max_size
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.enqueue_timeout = enqueue_timeout
+        self.shutdown_timeout = shutdown_timeout
+        self.spool_max_bytes = spool_max_bytes
+        self.fsync = fsync
+
+        self._spool = None
+        self._sequence = 0
+        self._spool_lock = threading.Lock()
+        self._lock = threading.Lock()
+        # Signalled when rows are queued, and when rows are committed
+        self._queued = threading.Condition(self._lock)
+        self._committed = threading.Condition(self._lock)
+        self._queue = deque()
+        # Rows enqueued and not committed yet, including the batch being written
+        self._outstanding = 0
+        self._closing = False
+        self._thread = None
+        self._start_lock = threading.Lock()
+        self._counters = Counter()
+        # Last sequence committed per spool, only touched by the writer thread
+        self._offsets = {}
+        self._latency_total = 0.0
+        self._latency_max = 0.0
+
+    def start(self):
+        """
+        Claims a spool, queues its uncommitted rows again and starts the writer thread. Idempotent
+        """
+        if self._thread is not None:
+            return
+        with self._start_lock:
+            if self._thread is not None:
+                return
+            os.makedirs(self.spool_dir, exist_ok=True)
+            self._spool = self._claim_spool()
+            writes, self._sequence = _parse_spool(self._spool.path, self._committed_sequence(self._spool.name))
+            self._spool.open()
+            with self._lock:
+                self._queue.extend(writes)
+                self._outstanding += len(writes)
+                self._counters["replayed"] += len(writes)
+            thread = threading.Thread(target=self._run, name='write-behind', daemon=True)
+            thread.start()
+            self._thread = thread
+            atexit.register(self.close)
+
+    def _claim_spool(self):
+        for index in range(1024):
+            spool = Spool(os.path.join(self.spool_dir, f'spool-{index}.ndjson'), fsync=self.fsync)
+            if spool.try_lock():
+                return spool
+        raise RuntimeError(f"No free write-behind spool in {self.spool_dir}")
+
+    def _committed_sequence(self, spool_name):
+        with self.app.app_context():
+            sequence = db.session.scalar(
+                db.select(WriteBehindOffset.sequence).where(WriteBehindOffset.spool == spool_name)
+            )
+            db.session.rollback()
+        return sequence or 0
+
+    def enqueue(self, kind, values):
+        """
+        Spools and queues a new post or comment, returns its sequence number.
+        Raises WriteQueueFull when no room frees up within the enqueue timeout
+        """
+        self.start()
+        values = dict(values, created_at=datetime.datetime.utcnow().isoformat())
+        with self._lock:
+            if not self._committed.wait_for(lambda: self._outstanding < self.max_size, self.enqueue_timeout):
+                self._counters["rejected"] += 1
+                raise WriteQueueFull()
+            self._outstanding += 1
+
+        try:
+            with self._spool_lock:
+                self._sequence += 1
+                sequence = self._sequence
+                line = dumps({"sequence": sequence, "kind": kind, "values": values}) + b'\n'
+                self._spool.append(line)
+                # Queued under the spool lock so the queue keeps the order of the spool
+                with self._lock:
+                    self._queue.append(Write(sequence, kind, values, line, time.monotonic()))
+                    self._counters["enqueued"] += 1
+                    if len(self._queue) == 1 or len(self._queue) == self.batch_size:
+                        self._queued.notify()
+        except Exception:
+            with self._lock:
+                self._outstanding -= 1
+                self._committed.notify()
+            raise
+        return sequence
+
+    def _next_batch(self):
+        """
+        Waits for a full batch or for the oldest row to be flush_interval old, None once closed and drained
+        """
+        with self._lock:
+            while len(self._queue) < self.batch_size and not (self._queue and self._closing):
+                if self._queue:
+                    remaining = self._queue[0].enqueued + self.flush_interval - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self._queued.wait(remaining)
+                elif self._closing:
+                    return None
+                else:
+                    self._queued.wait()
+            return [self._queue.popleft() for _ in range(min(self.batch_size, len(self._queue)))]
+
+    def _run(self):
+        self._replay_orphaned_spools()
+        while True:
+            batch = self._next_batch()
+            if batch is None:
+                return
+            if not self._write_with_retry(batch, self._spool.name):
+                # Shutting down and the database stays unavailable, the rows are replayed on the next start
+                return
+            with self._lock:
+                finished = time.monotonic()
+                for write in batch:
+                    latency = finished - write.enqueued
+                    self._latency_total += latency
+                    self._latency_max = max(self._latency_max, latency)
+                self._outstanding -= len(batch)
+                self._committed.notify_all()
+            self._compact_spool()
+
+    def _write_with_retry(self, batch, spool_name):
+        delay = 0.05
+        while True:
+            # Part of a split batch may have been committed before the failure
+            batch = [write for write in batch if write.sequence > self._offsets.get(spool_name, 0)]
+            if not batch:
+                return True
+            try:
+                self._write(batch, spool_name)
+                return True
+            except OperationalError:
+                # Most likely the database is locked by another writer, the same batch is tried again
+                logger.exception("Write-behind batch failed, retrying in %.2fs", delay)
+                with self._lock:
+                    self._counters["retries"] += 1
+                    if self._closing and self._counters["retries"] > 10:
+                        return False
+                time.sleep(delay)
+                delay = min(delay * 2, 2.0)
+
+    def _write(self, batch, spool_name):
+        """
+        Inserts a batch in one transaction together with the spool offset.
+        A batch rejected by the database is split, so only the offending rows are dropped
+        """
+        with self.app.app_context():
+            try:
+                comment_post_ids, authors = self._insert(batch)
+                self._record_offset(spool_name, batch[-1].sequence)
+                db.session.commit()
+                self._offsets[spool_name] = batch[-1].sequence
+            except OperationalError:
+                db.session.rollback()
+                raise
+            except Exception:
+                db.session.rollback()
+                if len(batch) > 1:
+                    middle = len(batch) // 2
+                    self._write(batch[:middle], spool_name)
+                    self._write(batch[middle:], spool_name)
+                    return
+                logger.exception("Dropping write-behind %s %s", batch[0].kind, batch[0].sequence)
+                self._record_offset(spool_name, batch[0].sequence)
+                db.session.commit()
+                self._offsets[spool_name] = batch[0].sequence
+                with self._lock:
+                    self._counters["failed"] += 1
+                return
+
+            # The cached posts and author feeds carry the comment counts
+            for post_id in comment_post_ids:
+                invalidate_http_cache(('post', post_id))
+            for user_id in authors:
+                invalidate_author(user_id)
+        with self._lock:
+            self._counters["committed"] += len(batch)
+            self._counters["transactions"] += 1
+
+    def _insert(self, batch):
+        """
+        Inserts the rows of a batch, returns the ids of the posts which got comments
+        and the ids of the users whose author feed changed
+        """
+        posts, comments = [], []
+        for write in batch:
+            values = dict(write.values, created_at=datetime.datetime.fromisoformat(write.values['created_at']))
+            if write.kind == 'post':
+                posts.append(dict(values, updated_at=values['created_at']))
+            else:
+                comments.append(values)
+
+        if comments:
+            # The post may have been deleted since the comment was accepted
+            post_authors = dict(db.session.execute(
+                db.select(Post.id, Post.user_id).where(Post.id.in_({comment['post_id'] for comment in comments}))
+            ).all())
+            kept = [comment for comment in comments if comment['post_id'] in post_authors]
+            if len(kept) < len(comments):
+                with self._lock:
+                    self._counters["dropped"] += len(comments) - len(kept)
+            comments = kept
+
+        authors = {post['user_id'] for post in posts}
+        if posts:
+            db.session.execute(db.insert(Post), posts)
+        if not comments:
+            return [], authors
+
+        # Bulk inserts skip the ORM events maintaining comment_count, it is updated once per post instead
+        db.session.execute(db.insert(Comment), comments)
+        added = Counter(comment['post_id'] for comment in comments)
+        post_table = Post.__table__
+        db.session.execute(
+            post_table.update().where(post_table.c.id == bindparam('b_post_id'))
+            .values(comment_count=post_table.c.comment_count + bindparam('b_added')),
+            [{"b_post_id": post_id, "b_added": count} for post_id, count in added.items()]
+        )
+        authors.update(post_authors[post_id] for post_id in added)
+        return list(added), authors
+
+    def _record_offset(self, spool_name, sequence):
+        offset_table = WriteBehindOffset.__table__
+        updated = db.session.execute(
+            offset_table.update().where(offset_table.c.spool == spool_name).values(sequence=sequence)
+        ).rowcount
+        if not updated:
+            db.session.execute(offset_table.insert().values(spool=spool_name, sequence=sequence))
+
+    def _compact_spool(self):
+        """
+        Drops the committed rows from the spool once it is drained or grew past spool_max_bytes
+        """
+        with self._spool_lock:
+            with self._lock:
+                if self._queue and self._spool.size <= self.spool_max_bytes:
+                    return
+                if not self._queue and not self._spool.size:
+                    return
+                lines = [write.line for write in self._queue]
+            self._spool.rewrite(lines)
+
+    def _replay_orphaned_spools(self):
+        """
+        Commits the rows left in the spools of processes which are no longer running
+        """
+        if fcntl is None:
+            return
+        for path in sorted(glob.glob(os.path.join(self.spool_dir, 'spool-*.ndjson'))):
+            if path == self._spool.path:
+                continue
+            spool = Spool(path)
+            if not spool.try_lock():
+                continue
+            try:
+                writes, _ = _parse_spool(path, self._committed_sequence(spool.name))
+                for start in range(0, len(writes), self.batch_size):
+                    if not self._write_with_retry(writes[start:start + self.batch_size], spool.name):
+                        return
+                with self._lock:
+                    self._counters["replayed"] += len(writes)
+                if writes:
+                    logger.info("Replayed %d write-behind rows of %s", len(writes), spool.name)
+                os.remove(path)
+            finally:
+                spool.close()
+
+    def flush(self, timeout=None):
+        """
+        Waits until every queued row is committed, returns False on timeout
+        """
+        with self._lock:
+            return self._committed.wait_for(lambda: self._outstanding == 0, timeout)
+
+    def close(self):
+        """
+        Drains the queue and stops the writer, called when the process exits
+        """
+        with self._lock:
+            self._closing = True
+            self._queued.notify()
+        if self._thread is not None:
+            self._thread.join(self.shutdown_timeout)
+            if self._thread.is_alive():
+                logger.warning("Write-behind queue not drained on shutdown, %d rows stay in the spool",
+                               self._outstanding)
+        if self._spool is not None:
+            with self._spool_lock:
+                self._spool.close()
+
+    def stats(self):
+        with self._lock:
+            committed = self._counters["committed"]
+            transactions = self._counters["transactions"]
+            return {
+                "enabled": True,
+                "queued": self._outstanding,
+                "max_size": self.max_size,
+                "enqueued": self._counters["enqueued"],
+                "committed": committed,
+                "transactions": transactions,
+                "rows_per_transaction": round(committed / transactions, 1) if transactions else 0.0,
+                "rejected": self._counters["rejected"],
+                "replayed": self._counters["replayed"],
+                "dropped": self._counters["dropped"],
+                "failed": self._counters["failed"],
+                "retries": self._counters["retries"],
+                "latency_avg_ms": round(self._latency_total / committed * 1000, 3) if committed else 0.0,
+                "latency_max_ms": round(self._latency_max * 1000, 3),
+                "spool": self._spool.name if self._spool else None,
+                "spool_bytes": self._spool.size if self._spool else 0,
+            }
+
+
+def init_write_behind(app):
+    """
+    Registers the write-behind queue when WRITE_BEHIND_ENABLED is set, its writer starts with the first request
+    """
+    app.extensions[EXTENSION_KEY] = None
+    if not app.config['WRITE_BEHIND_ENABLED']:
+        return
+
+    writer = WriteBehindQueue(
+        app,
+        app.config['WRITE_BEHIND_SPOOL_DIR'],
+        max_size=app.config['WRITE_BEHIND_QUEUE_SIZE'],
+        batch_size=app.config['WRITE_BEHIND_BATCH_SIZE'],
+        flush_interval=app.config['WRITE_BEHIND_FLUSH_INTERVAL'],
+        enqueue_timeout=app.config['WRITE_BEHIND_ENQUEUE_TIMEOUT'],
+        shutdown_timeout=app.config['WRITE_BEHIND_SHUTDOWN_TIMEOUT'],
+        fsync=app.config['WRITE_BEHIND_SPOOL_FSYNC'],
+    )
+    app.extensions[EXTENSION_KEY] = writer
+
+    @app.before_request
+    def start_writer():
+        writer.start()
+
+
+def write_behind_queue():
+    """
+    Returns the app's WriteBehindQueue, or None when writes go straight to the database
+    """
+    return current_app.extensions.get(EXTENSION_KEY)
+
+
+def write_behind_stats():
+    writer = write_behind_queue()
+    if writer is None:
+        return {"enabled": False}
+    return writer.stats()
@@ -0,0 +1,8 @@
+"""
+Modules shared by the blog, user management and inventory services.
+
+Every service configures them through its own config.py (RATE_LIMIT_*,
+QUERY_BUDGET*, HTTP_CACHE_*, ASGI_*, PREFORK_*, SQLITE_PRAGMAS) and imports them
+from here: rate_limit, metrics, instrumentation, http_cache, lru_cache,
+database, query_plans, async_app and prefork.
+"""
@@ -0,0 +1,347 @@
+"""
+ASGI serving mode.
+
+`AsyncApp` wraps the Flask app for an ASGI server (uvicorn). GET requests
+matching one of its async routes are answered by a coroutine that queries
+through an async SQLAlchemy engine (aiosqlite for SQLite), so one event loop
+per worker keeps thousands of concurrent keep-alive clients busy. Every other
+request is handed to the Flask app on a pool of ASGI_THREADS threads, exactly
+as the WSGI mode would run it, and its body is streamed to the thread as it
+arrives. The async routes share the statements, the auth caches and the HTTP
+response cache with the Flask routes, but they skip the Flask request hooks
+(SQL instrumentation).
+
+Requires the packages in requirements-asgi.txt.
+"""
+import asyncio
+import io
+import logging
+import queue
+import re
+import sys
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import parse_qsl
+
+from flask import current_app
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+from sqlalchemy.pool import AsyncAdaptedQueuePool
+from werkzeug.datastructures import Headers, MultiDict
+from werkzeug.http import http_date, parse_date, parse_etags, quote_etag
+
+from service_common.database import configure_engine
+from service_common.http_cache import lookup, store, is_not_modified
+
+logger = logging.getLogger(__name__)
+
+ASYNC_DRIVERS = {
+    'sqlite': 'sqlite+aiosqlite',
+    'postgresql': 'postgresql+asyncpg',
+}
+
+# Bytes of a delegated response collected before they are handed to the event loop
+WSGI_SEND_BUFFER = 64 * 1024
+
+# Request body chunks received ahead of the worker thread reading them
+WSGI_INPUT_CHUNKS = 8
+
+AsyncResponse = namedtuple('AsyncResponse', ['body', 'status', 'headers'])
+
+_RULE_PARAMETER = re.compile(r'<(?:(int):)?(\w+)>')
+
+
+def async_database_uri(uri):
+    url = make_url(uri)
+    driver = ASYNC_DRIVERS.get(url.get_backend_name())
+    if driver is None:
+        raise ValueError(f"No async driver configured for {url.drivername}")
+    return url.set(drivername=driver)
+
+
+def json_response(payload, status=200, headers=None):
+    body = current_app.json.response(payload).get_data()
+    return AsyncResponse(body, status, [('Content-Type', 'application/json')] + list(headers or []))
+
+
+def _compile_rule(rule):
+    """
+    Turns a Flask style rule like /blog/posts/<int:post_id> into a regex and its converters
+    """
+    pattern, converters, position = '', {}, 0
+    for match in _RULE_PARAMETER.finditer(rule):
+        converter, name = match.groups()
+        pattern += re.escape(rule[position:match.start()])
+        pattern += rf'(?P<{name}>\d+)' if converter == 'int' else rf'(?P<{name}>[^/]+)'
+        converters[name] = int if converter == 'int' else str
+        position = match.end()
+    pattern += re.escape(rule[position:])
+    return re.compile(pattern + '$'), converters
+
+
+class AsyncRequest:
+    """
+    The parts of an incoming request the async routes need
+    """
+
+    def __init__(self, scope):
+        self.method = scope['method']
+        self.path = scope['path']
+        self.headers = Headers([(name.decode('latin-1'), value.decode('latin-1')) for name, value in scope['headers']])
+        self.args = MultiDict(parse_qsl(scope['query_string'].decode('latin-1'), keep_blank_values=True))
+
+    @property
+    def if_none_match(self):
+        return parse_etags(self.headers.get('If-None-Match'))
+
+    @property
+    def if_modified_since(self):
+        return parse_date(self.headers.get('If-Modified-Since'))
+
+
+class _RequestBody(io.RawIOBase):
+    """
+    Blocking wsgi.input of a delegated request. `feed` runs on the event loop and
+    queues the body chunks as they arrive, the worker thread reads them from the
+    queue. At most WSGI_INPUT_CHUNKS chunks wait in the queue, receiving pauses
+    until the thread has read some
+    """
+
+    def __init__(self, loop):
+        self._loop = loop
+        self._chunks = queue.Queue()
+        self._room = asyncio.Semaphore(WSGI_INPUT_CHUNKS)
+        self._pending = memoryview(b'')
+        self._finished = False
+
+    async def feed(self, receive):
+        try:
+            while True:
+                await self._room.acquire()
+                message = await receive()
+                if message['type'] != 'http.request':
+                    # The client disconnected, the app reads a truncated body
+                    return
+                self._chunks.put(message.get('body', b''))
+                if not message.get('more_body'):
+                    return
+        finally:
+            self._chunks.put(None)
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        while not self._pending and not self._finished:
+            chunk = self._chunks.get()
+            if chunk is None:
+                self._finished = True
+            else:
+                self._pending = memoryview(chunk)
+                self._loop.call_soon_threadsafe(self._room.release)
+        size = min(len(buffer), len(self._pending))
+        buffer[:size] = self._pending[:size]
+        self._pending = self._pending[size:]
+        return size
+
+
+def _wsgi_environ(scope, body):
+    server = scope.get('server') or ('localhost', 80)
+    environ = {
+        'REQUEST_METHOD': scope['method'],
+        'SCRIPT_NAME': scope.get('root_path', '').encode('utf-8').decode('latin-1'),
+        'PATH_INFO': scope['path'].encode('utf-8').decode('latin-1'),
+        'QUERY_STRING': scope['query_string'].decode('latin-1'),
+        'SERVER_PROTOCOL': 'HTTP/' + scope.get('http_version', '1.1'),
+        'SERVER_NAME': server[0],
+        'SERVER_PORT': str(server[1]),
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': scope.get('scheme', 'http'),
+        'wsgi.input': body,
+        # The body ends with the last chunk, even without a Content-Length
+        'wsgi.input_terminated': True,
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': True,
+        'wsgi.run_once': False,
+    }
+    if scope.get('client'):
+        environ['REMOTE_ADDR'] = scope['client'][0]
+    for name, value in scope['headers']:
+        key = name.decode('latin-1').upper().replace('-', '_')
+        if key not in ('CONTENT_TYPE', 'CONTENT_LENGTH'):
+            key = 'HTTP_' + key
+        value = value.decode('latin-1')
+        environ[key] = environ[key] + ',' + value if key in environ else value
+    return environ
+
+
+class AsyncApp:
+    """
+    ASGI application serving the registered async routes and delegating everything else to `flask_app`
+    """
+
+    def __init__(self, flask_app):
+        self.flask_app = flask_app
+        self.routes = []
+        self.engine = None
+        self.sessionmaker = None
+        self.executor = ThreadPoolExecutor(flask_app.config['ASGI_THREADS'], thread_name_prefix='wsgi')
+
+    def route(self, rule):
+        """
+        Registers a coroutine answering GET requests for `rule`. It is called with the
+        AsyncRequest, an AsyncSession and the rule parameters and returns an AsyncResponse
+        """
+        pattern, converters = _compile_rule(rule)
+
+        def decorator(f):
+            self.routes.append((pattern, converters, f))
+            return f
+        return decorator
+
+    def start(self):
+        config = self.flask_app.config
+        url = async_database_uri(config['SQLALCHEMY_DATABASE_URI'])
+        options = dict(config.get('SQLALCHEMY_ENGINE_OPTIONS', {}))
+        if url.get_backend_name() == 'sqlite' and 'pool_size' in options:
+            # aiosqlite defaults to NullPool, which opens a new connection for every session
+            options.setdefault('poolclass', AsyncAdaptedQueuePool)
+        self.engine = create_async_engine(url, **options)
+        configure_engine(self.engine.sync_engine, config['SQLITE_PRAGMAS'])
+        self.sessionmaker = async_sessionmaker(self.engine, expire_on_commit=False)
+
+    async def stop(self):
+        if self.engine is not None:
+            await self.engine.dispose()
+            self.engine = None
+        self.executor.shutdown(wait=False)
+
+    async def cached_json(self, request, key, load, status=200):
+        """
+        Async counterpart of http_cache.cached_json_response, `load` is a coroutine function
+        """
+        entry = lookup(key)
+        if entry is None:
+            loaded = await load()
+            if loaded is None:
+                return None
+            entry = store(key, loaded, status, request.if_none_match, request.if_modified_since)
+
+        headers = [('ETag', quote_etag(entry.etag))]
+        if entry.last_modified is not None:
+            headers.append(('Last-Modified', http_date(entry.last_modified)))
+        if is_not_modified(entry, request.if_none_match, request.if_modified_since):
+            return AsyncResponse(b'', 304, headers)
+        return AsyncResponse(entry.body, entry.status, [('Content-Type', 'application/json')] + headers)
+
+    def _match(self, scope):
+        if scope['method'] not in ('GET', 'HEAD'):
+            return None, None
+        for pattern, converters, handler in self.routes:
+            match = pattern.match(scope['path'])
+            if match:
+                return handler, {name: converters[name](value) for name, value in match.groupdict().items()}
+        return None, None
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            await self._lifespan(receive, send)
+            return
+        if scope['type'] != 'http':
+            return
+
+        handler, params = self._match(scope)
+        if handler is None:
+            await self._call_wsgi(scope, receive, send)
+            return
+
+        if self.engine is None:
+            self.start()
+        request = AsyncRequest(scope)
+        with self.flask_app.app_context():
+            try:
+                async with self.sessionmaker() as session:
+                    response = await handler(request, session, **params)
+            except Exception:
+                logger.exception("Error handling %s %s", scope['method'], scope['path'])
+                response = json_response({"error": "Internal Server Error"}, 500)
+        await self._send(send, response, head=scope['method'] == 'HEAD')
+
+    async def _send(self, send, response, head=False):
+        headers = [(name.encode('latin-1'), value.encode('latin-1')) for name, value in response.headers]
+        headers.append((b'content-length', str(len(response.body)).encode()))
+        await send({'type': 'http.response.start', 'status': response.status, 'headers': headers})
+        await send({'type': 'http.response.body', 'body': b'' if head else response.body})
+
+    async def _lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                self.start()
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                await self.stop()
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    async def _call_wsgi(self, scope, receive, send):
+        loop = asyncio.get_running_loop()
+        body = _RequestBody(loop)
+        feeding = asyncio.ensure_future(body.feed(receive))
+        environ = _wsgi_environ(scope, io.BufferedReader(body))
+
+        def send_from_thread(message):
+            asyncio.run_coroutine_threadsafe(send(message), loop).result()
+
+        def run():
+            started = []
+
+            def start_response(status, headers, exc_info=None):
+                started[:] = [int(status.split(' ', 1)[0]), [
+                    (name.lower().encode('latin-1'), value.encode('latin-1')) for name, value in headers
+                ]]
+
+            result = self.flask_app(environ, start_response)
+            try:
+                buffered = bytearray()
+                header_sent = False
+                # Streamed responses (exports) are forwarded in blocks as they are produced
+                for chunk in result:
+                    buffered += chunk
+                    if len(buffered) >= WSGI_SEND_BUFFER:
+                        if not header_sent:
+                            send_from_thread({'type': 'http.response.start', 'status': started[0], 'headers': started[1]})
+                            header_sent = True
+                        send_from_thread({'type': 'http.response.body', 'body': bytes(buffered), 'more_body': True})
+                        buffered.clear()
+                if not header_sent:
+                    send_from_thread({'type': 'http.response.start', 'status': started[0], 'headers': started[1]})
+                send_from_thread({'type': 'http.response.body', 'body': bytes(buffered)})
+            finally:
+                if hasattr(result, 'close'):
+                    result.close()
+
+        try:
+            await loop.run_in_executor(self.executor, run)
+        finally:
+            # The app may answer without reading the whole body
+            feeding.cancel()
+
+
+def serve(app_path, config, port):
+    """
+    Runs `app_path` (module:attribute of an AsyncApp) under uvicorn with ASGI_WORKERS processes.
+    Create and migrate the schema (init_db) before calling it, the workers do not touch it
+    """
+    import uvicorn
+
+    uvicorn.run(
+        app_path,
+        host=config['ASGI_HOST'],
+        port=port,
+        workers=config['ASGI_WORKERS'],
+        backlog=config['ASGI_BACKLOG'],
+        timeout_keep_alive=config['ASGI_KEEP_ALIVE_TIMEOUT'],
+        lifespan='on',
+    )
@@ -0,0 +1,28 @@
+"""
+Engine level database settings which can not be expressed as engine options.
+"""
+from sqlalchemy import event
+
+
+def app_engine(app):
+    """
+    Returns the engine of the app's Flask-SQLAlchemy extension
+    """
+    with app.app_context():
+        return app.extensions['sqlalchemy'].engine
+
+
+def configure_engine(engine, sqlite_pragmas):
+    """
+    Applies the configured PRAGMAs to every new SQLite connection.
+    Must be called before the engine hands out its first connection
+    """
+    if engine.dialect.name != 'sqlite' or not sqlite_pragmas:
+        return
+
+    @event.listens_for(engine, 'connect')
+    def set_sqlite_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        for name, value in sqlite_pragmas.items():
+            cursor.execute(f"PRAGMA {name} = {value}")
+        cursor.close()
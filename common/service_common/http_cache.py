@@ -0,0 +1,118 @@
+"""
+Conditional GET support backed by an in-process cache of serialized bodies.
+
+A cached read endpoint describes its resource with a key, e.g. ('post', 42).
+On a cache hit the stored body is sent (or a 304 when the client's validators
+match) without touching the database. On a miss the row is loaded once, the
+ETag is derived from its version and the payload is only serialized when the
+client does not already hold the current representation. Routes that change
+a resource must call `invalidate` with its key; entries also expire after
+HTTP_CACHE_TTL seconds so other worker processes' writes become visible.
+"""
+import datetime
+import hashlib
+from collections import namedtuple
+
+from flask import Response, current_app, request
+
+from service_common.lru_cache import LRUCache
+
+EXTENSION_KEY = 'http_cache'
+
+CachedBody = namedtuple('CachedBody', ['body', 'status', 'etag', 'last_modified'])
+
+
+def init_http_cache(app):
+    app.extensions[EXTENSION_KEY] = LRUCache(app.config['HTTP_CACHE_SIZE'], ttl=app.config['HTTP_CACHE_TTL'])
+
+
+def _cache():
+    return current_app.extensions[EXTENSION_KEY]
+
+
+def make_etag(key, version):
+    return hashlib.sha1(repr((key, version)).encode()).hexdigest()
+
+
+def _as_utc(value):
+    if value is not None and value.tzinfo is None:
+        # SQLite hands back naive timestamps, they are stored in UTC
+        return value.replace(tzinfo=datetime.timezone.utc)
+    return value
+
+
+def _not_modified(etag, last_modified, if_none_match, if_modified_since):
+    if if_none_match:
+        return if_none_match.contains(etag)
+    if last_modified is not None and if_modified_since is not None:
+        return last_modified.replace(microsecond=0) <= if_modified_since
+    return False
+
+
+def lookup(key):
+    """
+    Returns the CachedBody stored for `key` or None
+    """
+    return _cache().get(key)
+
+
+def store(key, loaded, status, if_none_match=None, if_modified_since=None):
+    """
+    Computes the validators of a freshly loaded resource and caches its serialized body.
+    `loaded` is the (version, last_modified, build_payload) tuple described in `cached_json_response`.
+    When the client's validators already match, the payload is not serialized and the
+    returned CachedBody has no body
+    """
+    version, last_modified, build_payload = loaded
+    etag = make_etag(key, version)
+    last_modified = _as_utc(last_modified)
+    if _not_modified(etag, last_modified, if_none_match, if_modified_since):
+        return CachedBody(None, status, etag, last_modified)
+
+    body = current_app.json.response(build_payload()).get_data()
+    entry = CachedBody(body, status, etag, last_modified)
+    _cache().set(key, entry)
+    return entry
+
+
+def is_not_modified(entry, if_none_match, if_modified_since):
+    return entry.body is None or _not_modified(entry.etag, entry.last_modified, if_none_match, if_modified_since)
+
+
+def _response(entry):
+    if is_not_modified(entry, request.if_none_match, request.if_modified_since):
+        response = Response(status=304)
+    else:
+        response = Response(entry.body, status=entry.status, mimetype='application/json')
+    response.set_etag(entry.etag)
+    if entry.last_modified is not None:
+        response.last_modified = entry.last_modified
+    return response
+
+
+def cached_json_response(key, load, status=200):
+    """
+    Answers a GET for the resource identified by `key`.
+    Args:
+        key: hashable cache key of the resource
+        load: callable returning None when the resource does not exist, otherwise
+            (version, last_modified, build_payload) where build_payload() returns the JSON payload
+        status: status code of a full response
+    Returns:
+        the response, or None when the resource does not exist
+    """
+    entry = lookup(key)
+    if entry is None:
+        loaded = load()
+        if loaded is None:
+            return None
+        entry = store(key, loaded, status, request.if_none_match, request.if_modified_since)
+    return _response(entry)
+
+
+def invalidate(key):
+    _cache().invalidate(key)
+
+
+def http_cache_stats():
+    return _cache().stats()
@@ -0,0 +1,130 @@
+"""
+Opt-in per request SQL instrumentation.
+
+With SQL_INSTRUMENTATION enabled every statement executed while a request is
+handled is counted and timed. The totals are returned in a Server-Timing
+header and logged as one JSON line per request, and statements slower than
+SLOW_QUERY_MS are reported with the request.
+
+Query budgets catch N+1 regressions: QUERY_BUDGET is the default maximum number
+of queries per request, QUERY_BUDGETS overrides it per endpoint and routes can
+declare their own with the @query_budget decorator. An exceeded budget is
+logged as a warning, or raises QueryBudgetExceeded when QUERY_BUDGET_STRICT is
+set (which fails the test that made the request).
+"""
+import json
+import logging
+import time
+
+from flask import current_app, g, has_request_context, request
+from sqlalchemy import event
+
+from service_common.database import app_engine
+
+logger = logging.getLogger('sql_instrumentation')
+
+_BUDGET_ATTRIBUTE = '_query_budget'
+
+
+class QueryBudgetExceeded(Exception):
+    pass
+
+
+class RequestQueryStats:
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.count = 0
+        self.total = 0.0
+        self.slow = []
+
+    def record(self, statement, duration, slow_threshold):
+        self.count += 1
+        self.total += duration
+        if duration >= slow_threshold:
+            self.slow.append((duration, statement))
+
+
+def query_budget(max_queries):
+    """
+    Declares the maximum number of SQL queries a route may issue per request
+    """
+    def decorator(f):
+        setattr(f, _BUDGET_ATTRIBUTE, max_queries)
+        return f
+    return decorator
+
+
+def _before_cursor_execute(connection, cursor, statement, parameters, context, executemany):
+    context._query_started = time.perf_counter()
+
+
+def _after_cursor_execute(connection, cursor, statement, parameters, context, executemany):
+    if not has_request_context():
+        return
+    stats = g.get('sql_stats')
+    if stats is not None:
+        stats.record(statement, time.perf_counter() - context._query_started,
+                     current_app.config['SLOW_QUERY_MS'] / 1000)
+
+
+def _budget_for_request(app):
+    view = app.view_functions.get(request.endpoint)
+    budget = getattr(view, _BUDGET_ATTRIBUTE, None)
+    return app.config['QUERY_BUDGETS'].get(request.endpoint, budget if budget is not None else app.config['QUERY_BUDGET'])
+
+
+def init_instrumentation(app):
+    """
+    Hooks the engine and request events when SQL_INSTRUMENTATION is enabled
+    """
+    if not app.config['SQL_INSTRUMENTATION']:
+        return
+
+    logger.setLevel(logging.INFO)
+    if not logger.handlers and not logging.getLogger().handlers:
+        logger.addHandler(logging.StreamHandler())
+
+    engine = app_engine(app)
+    event.listen(engine, 'before_cursor_execute', _before_cursor_execute)
+    event.listen(engine, 'after_cursor_execute', _after_cursor_execute)
+
+    @app.before_request
+    def start_query_stats():
+        g.sql_stats = RequestQueryStats()
+
+    @app.after_request
+    def report_query_stats(response):
+        stats = g.pop('sql_stats', None)
+        if stats is None:
+            return response
+
+        elapsed_ms = (time.perf_counter() - stats.started) * 1000
+        db_ms = stats.total * 1000
+        response.headers.add(
+            'Server-Timing', f'db;dur={db_ms:.2f};desc="{stats.count} queries", app;dur={elapsed_ms:.2f}'
+        )
+
+        budget = _budget_for_request(app)
+        slowest = sorted(stats.slow, key=lambda slow: slow[0], reverse=True)[:5]
+        logger.info(json.dumps({
+            "method": request.method,
+            "path": request.path,
+            "endpoint": request.endpoint,
+            "status": response.status_code,
+            "queries": stats.count,
+            "query_budget": budget,
+            "db_ms": round(db_ms, 2),
+            "total_ms": round(elapsed_ms, 2),
+            "slow_queries": [
+                {"ms": round(duration * 1000, 2), "statement": " ".join(statement.split())[:500]}
+                for duration, statement in slowest
+            ],
+        }))
+
+        if budget is not None and stats.count > budget:
+            message = f"{request.endpoint} issued {stats.count} SQL queries, the budget is {budget}"
+            if app.config['QUERY_BUDGET_STRICT']:
+                raise QueryBudgetExceeded(message)
+            logger.warning(message)
+        return response
@@ -0,0 +1,226 @@
+"""
+Prometheus metrics.
+
+GET /metrics returns `render_metrics`, in the Prometheus text format:
+
+* http_request_duration_seconds, a histogram per endpoint, method and status
+  (its _count is the request count), and http_requests_in_flight
+* db_queries_total and db_query_duration_seconds_total
+* db_pool_* gauges of the SQLAlchemy connection pool
+* cache_* counters and hit ratios of the in-process caches
+* rate_limit_* counters when rate limiting is enabled
+
+Request and query observations are recorded in lock stripes: every thread is
+assigned one stripe, so the lock it takes is practically never contended, and
+the stripes are only summed when /metrics is scraped. Recording a request costs
+a couple of microseconds. Metrics are per process, every worker is scraped on
+its own. The async routes of the ASGI mode are not observed.
+"""
+import itertools
+import threading
+import time
+from bisect import bisect_left
+
+from flask import request
+from sqlalchemy import event
+
+from service_common.database import app_engine
+from service_common.rate_limit import rate_limit_stats
+
+EXTENSION_KEY = 'metrics'
+
+# Upper bounds in seconds of the latency histogram buckets, the last bucket is +Inf
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+class _Stripe:
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        # (endpoint, method, status) -> [count per bucket..., sum of durations]
+        self.requests = {}
+        self.in_flight = 0
+        self.queries = 0
+        self.query_seconds = 0.0
+
+
+class StripedMetrics:
+    """
+    Request and query observations spread over `stripes` independently locked stripes
+    """
+
+    def __init__(self, stripes=16, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.cache_stats = None
+        self._stripes = [_Stripe() for _ in range(stripes)]
+        self._next_stripe = itertools.count()
+        self._local = threading.local()
+
+    def _stripe(self):
+        try:
+            return self._local.stripe
+        except AttributeError:
+            # Round robin assignment, thread idents are addresses and hash unevenly
+            stripe = self._local.stripe = self._stripes[next(self._next_stripe) % len(self._stripes)]
+            return stripe
+
+    def request_started(self):
+        stripe = self._stripe()
+        with stripe.lock:
+            stripe.in_flight += 1
+
+    def request_finished(self, endpoint, method, status, duration):
+        stripe = self._stripe()
+        key = (endpoint, method, status)
+        with stripe.lock:
+            stripe.in_flight -= 1
+            observations = stripe.requests.get(key)
+            if observations is None:
+                observations = stripe.requests[key] = [0] * (len(self.buckets) + 2)
+            observations[bisect_left(self.buckets, duration)] += 1
+            observations[-1] += duration
+
+    def query_executed(self, duration):
+        stripe = self._stripe()
+        with stripe.lock:
+            stripe.queries += 1
+            stripe.query_seconds += duration
+
+    def snapshot(self):
+        """
+        Returns the sums over all stripes: (requests, in flight, queries, query seconds)
+        """
+        requests, in_flight, queries, query_seconds = {}, 0, 0, 0.0
+        for stripe in self._stripes:
+            with stripe.lock:
+                for key, observations in stripe.requests.items():
+                    total = requests.get(key)
+                    requests[key] = list(observations) if total is None \
+                        else [a + b for a, b in zip(total, observations)]
+                in_flight += stripe.in_flight
+                queries += stripe.queries
+                query_seconds += stripe.query_seconds
+        return requests, in_flight, queries, query_seconds
+
+
+def _labels(**labels):
+    return '{' + ','.join(
+        '{}="{}"'.format(name, str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+        for name, value in labels.items()
+    ) + '}'
+
+
+def _metric(lines, name, metric_type, description, samples):
+    lines.append(f'# HELP {name} {description}')
+    lines.append(f'# TYPE {name} {metric_type}')
+    for suffix, labels, value in samples:
+        lines.append(f'{name}{suffix}{_labels(**labels) if labels else ""} {value}')
+
+
+def _request_samples(metrics, requests):
+    samples = []
+    for (endpoint, method, status), observations in sorted(requests.items()):
+        labels = {"endpoint": endpoint, "method": method, "status": status}
+        cumulative = 0
+        for bound, count in zip(metrics.buckets + ('+Inf',), observations):
+            cumulative += count
+            samples.append(('_bucket', {**labels, "le": bound}, cumulative))
+        samples.append(('_sum', labels, round(observations[-1], 6)))
+        samples.append(('_count', labels, cumulative))
+    return samples
+
+
+def _pool_samples(pool):
+    samples = {}
+    for name in ('size', 'checkedout', 'checkedin', 'overflow'):
+        # Only QueuePool style pools can tell their usage
+        method = getattr(pool, name, None)
+        if callable(method):
+            samples[name] = method()
+    return samples
+
+
+def render_metrics(app):
+    """
+    Returns the metrics of `app` in the Prometheus text exposition format
+    """
+    metrics = app.extensions[EXTENSION_KEY]
+    requests, in_flight, queries, query_seconds = metrics.snapshot()
+    lines = []
+
+    _metric(lines, 'http_request_duration_seconds', 'histogram', 'Request latency by endpoint, method and status',
+            _request_samples(metrics, requests))
+    _metric(lines, 'http_requests_in_flight', 'gauge', 'Requests being handled', [('', None, in_flight)])
+    _metric(lines, 'db_queries_total', 'counter', 'SQL statements executed', [('', None, queries)])
+    _metric(lines, 'db_query_duration_seconds_total', 'counter', 'Time spent executing SQL statements',
+            [('', None, round(query_seconds, 6))])
+
+    for name, value in _pool_samples(app_engine(app).pool).items():
+        _metric(lines, f'db_pool_{name}', 'gauge', f'Connection pool {name}', [('', None, value)])
+
+    caches = sorted(metrics.cache_stats().items()) if metrics.cache_stats else []
+    for name, metric_type, description in (
+        ('hits', 'counter', 'Cache hits'),
+        ('misses', 'counter', 'Cache misses'),
+        ('evictions', 'counter', 'Cache evictions'),
+        ('size', 'gauge', 'Cache entries'),
+        ('hit_ratio', 'gauge', 'Cache hits per lookup'),
+    ):
+        suffix = '_total' if metric_type == 'counter' else ''
+        _metric(lines, f'cache_{name}{suffix}', metric_type, description,
+                [('', {"cache": cache}, stats[name]) for cache, stats in caches])
+
+    limiter = rate_limit_stats()
+    if limiter["enabled"]:
+        _metric(lines, 'rate_limit_requests_total', 'counter', 'Requests checked against the token buckets', [
+            ('', {"endpoint": endpoint, "outcome": outcome}, count)
+            for endpoint, outcomes in sorted(limiter["routes"].items()) for outcome, count in sorted(outcomes.items())
+        ])
+        _metric(lines, 'rate_limit_shed_total', 'counter', 'Requests shed by the concurrency limit',
+                [('', None, limiter["shed"])])
+
+    return '\n'.join(lines) + '\n'
+
+
+def init_metrics(app, cache_stats=None):
+    """
+    Registers the request hooks and the query listener.
+    `cache_stats` returns the {name: stats} of the caches to expose.
+    Call it before the other request hooks so rejected requests are observed too
+    """
+    metrics = StripedMetrics()
+    metrics.cache_stats = cache_stats
+    app.extensions[EXTENSION_KEY] = metrics
+
+    engine = app_engine(app)
+
+    @event.listens_for(engine, 'before_cursor_execute')
+    def start_query_timer(connection, cursor, statement, parameters, context, executemany):
+        context._metrics_started = time.perf_counter()
+
+    @event.listens_for(engine, 'after_cursor_execute')
+    def observe_query(connection, cursor, statement, parameters, context, executemany):
+        metrics.query_executed(time.perf_counter() - context._metrics_started)
+
+    @app.before_request
+    def start_request_timer():
+        request.environ['metrics.started'] = time.perf_counter()
+        metrics.request_started()
+
+    @app.after_request
+    def observe_request(response):
+        started = request.environ.pop('metrics.started', None)
+        if started is not None:
+            metrics.request_finished(request.endpoint or 'none', request.method, response.status_code,
+                                     time.perf_counter() - started)
+        return response
+
+    @app.teardown_request
+    def finish_failed_request(exception=None):
+        # after_request is skipped when the view raised, the request still has to leave the in flight gauge
+        started = request.environ.pop('metrics.started', None)
+        if started is not None:
+            metrics.request_finished(request.endpoint or 'none', request.method, 500, time.perf_counter() - started)
+
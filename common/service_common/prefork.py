@@ -0,0 +1,110 @@
+"""
+Pre-fork serving mode.
+
+`serve` runs the Flask app under gunicorn with PREFORK_WORKERS worker
+processes (default one per CPU), each running PREFORK_THREADS requests at a
+time. The master process loads the app once and warms it before forking: the
+mappers are configured, the URL rules compiled and the service's `warm_up`
+runs the queries of the read endpoints (filling the engine's compiled
+statement cache) and loads its in-memory caches. Every worker starts from that
+state instead of paying for it on its first requests, and shares the warmed
+memory with the master until it writes to it. Database connections are closed
+before forking and again in every worker after the fork (post_fork), each
+worker opens its own. The rate limiter's SQLite connections, and the service's
+own pools and queues, drop themselves in a forked child (os.register_at_fork)
+or are started by the first request of each worker.
+
+Caches are per process (shared nothing): a worker starts with a copy of the
+master's caches and keeps them up to date from its own writes, the writes of
+the other workers become visible when the entries expire.
+
+Signals handled by the master:
+
+    HUP         graceful restart: the app is warmed up again and new workers are
+                forked, the old ones stop accepting connections and exit once their
+                in-flight requests are done (at most PREFORK_GRACEFUL_TIMEOUT seconds).
+                The listening socket stays open, no connection is refused.
+                The code is not reloaded
+    USR2        starts a new master with the current code on the same socket,
+                then TERM to the old master finishes a deployment
+    TERM        graceful shutdown, INT and QUIT stop immediately
+    TTIN, TTOU  one worker more, one worker less
+
+Requires the packages in requirements-prefork.txt.
+"""
+import gc
+
+from gunicorn.app.base import BaseApplication
+from sqlalchemy.orm import configure_mappers
+
+from service_common.database import app_engine
+
+
+def prepare(app, warm_up=None):
+    """
+    Warms the app in the master process, before workers are forked
+    """
+    configure_mappers()
+    # Otherwise compiled by the first request of every worker
+    app.url_map.update()
+    if warm_up is not None:
+        warm_up(app)
+    # Connections must not be shared by the forked workers
+    app_engine(app).dispose()
+    # Objects of the master are never collected, so the collector of a worker
+    # does not write to (and copy) the memory pages it shares with the master
+    gc.collect()
+    gc.freeze()
+
+
+def after_fork(app):
+    """
+    Runs in every worker right after the fork
+    """
+    # Forgets connections inherited from the master without closing them, the master owns them
+    app_engine(app).dispose(close=False)
+
+
+class PreforkApplication(BaseApplication):
+
+    def __init__(self, app, options, warm_up=None):
+        self.flask_app = app
+        self.options = options
+        self.warm_up = warm_up
+        super().__init__()
+
+    def load_config(self):
+        for name, value in self.options.items():
+            self.cfg.set(name, value)
+        # Run by HUP before the new workers are forked
+        self.cfg.set('on_reload', lambda arbiter: prepare(self.flask_app, self.warm_up))
+        self.cfg.set('post_fork', lambda arbiter, worker: after_fork(self.flask_app))
+
+    def load(self):
+        return self.flask_app
+
+
+def gunicorn_options(config):
+    return {
+        'bind': [config['PREFORK_BIND']],
+        'workers': config['PREFORK_WORKERS'],
+        'worker_class': 'gthread',
+        'threads': config['PREFORK_THREADS'],
+        'backlog': config['PREFORK_BACKLOG'],
+        'keepalive': config['PREFORK_KEEP_ALIVE_TIMEOUT'],
+        'timeout': config['PREFORK_TIMEOUT'],
+        'graceful_timeout': config['PREFORK_GRACEFUL_TIMEOUT'],
+        # The app is loaded and warmed once, in the master
+        'preload_app': True,
+        # Its default path would be shared by the three services of a host, signals do the same
+        'control_socket_disable': True,
+    }
+
+
+def serve(app, warm_up=None):
+    """
+    Serves `app` with PREFORK_WORKERS pre-forked gunicorn workers until the master is stopped.
+    Create and migrate the schema (init_db) before calling it, the workers do not touch it
+    """
+    prepare(app, warm_up)
+    PreforkApplication(app, gunicorn_options(app.config), warm_up).run()
@@ -0,0 +1,68 @@
+"""
+Prints the SQLite query plan of every statement the read endpoints issue.
+
+Each sample request is sent through the Flask test client while the statements
+it executes are captured and run through EXPLAIN QUERY PLAN on the same
+connection. A plan step that scans a table without an index is flagged, so an
+index regression is visible before it reaches production. Every service lists
+its sample requests in its own query_plans module.
+
+    flask --app app explain-queries [--fail-on-scan]
+"""
+from sqlalchemy import event
+
+from service_common.database import app_engine
+
+
+def is_full_scan(detail):
+    # "SCAN post" is a table scan while "SCAN post USING INDEX ..." walks an index
+    # and "SCAN inventory_fts VIRTUAL TABLE INDEX ..." is answered by the FTS index.
+    # sqlite_master is only read once per process, e.g. when a search index is detected
+    return detail.startswith('SCAN ') and ' USING ' not in detail and ' VIRTUAL TABLE ' not in detail \
+        and detail != 'SCAN sqlite_master'
+
+
+def explain_endpoints(app, requests):
+    """
+    Sends `requests`, (method, url, json payload, headers, whether a full scan is expected)
+    per endpoint, and returns [(method, url, [(statement, [plan detail, ...]), ...], scan_expected), ...]
+    """
+    results = []
+    captured = []
+
+    def capture(connection, cursor, statement, parameters, context, executemany):
+        if not statement.lstrip().upper().startswith(('SELECT', 'WITH')):
+            return
+        plan = cursor.connection.execute('EXPLAIN QUERY PLAN ' + statement, parameters).fetchall()
+        captured.append((statement, [row[-1] for row in plan]))
+
+    engine = app_engine(app)
+    event.listen(engine, 'before_cursor_execute', capture)
+    try:
+        client = app.test_client()
+        for method, url, payload, headers, scan_expected in requests:
+            del captured[:]
+            client.open(url, method=method, json=payload, headers=headers).close()
+            results.append((method, url, list(captured), scan_expected))
+    finally:
+        event.remove(engine, 'before_cursor_execute', capture)
+    return results
+
+
+def print_query_plans(app, requests, echo=print):
+    """
+    Prints the plans and returns the number of unexpected full table scans
+    """
+    unexpected_scans = 0
+    for method, url, statements, scan_expected in explain_endpoints(app, requests):
+        echo(f"{method} {url}")
+        for statement, plan in statements:
+            echo("    " + " ".join(statement.split()))
+            for detail in plan:
+                flag = ""
+                if is_full_scan(detail):
+                    flag = "  (full scan, expected)" if scan_expected else "  <-- FULL SCAN"
+                    unexpected_scans += 0 if scan_expected else 1
+                echo("        " + detail + flag)
+        echo("")
+    return unexpected_scans
@@ -0,0 +1,300 @@
+"""
+Rate limiting and admission control.
+
+With RATE_LIMIT_ENABLED every request passes two checks before its view runs:
+
+* Token buckets. Routes declare limits with the @rate_limit decorator (or
+  RATE_LIMITS per endpoint in the config): `per_client` buckets are keyed by
+  endpoint and client address, `per_route` buckets are shared by all clients of
+  the endpoint. RATE_LIMIT_DEFAULT applies a per client limit to the other
+  routes. An empty bucket answers 429 with a Retry-After header.
+* A concurrency limit. At most RATE_LIMIT_MAX_CONCURRENT requests run at once
+  per process; a request that does not get a slot within
+  RATE_LIMIT_QUEUE_TIMEOUT seconds is shed with 503 instead of queueing.
+
+Buckets live in process memory, spread over lock stripes so concurrent
+requests rarely contend. With RATE_LIMIT_SQLITE_PATH they are kept in a SQLite
+file instead and shared by all worker processes of the host. Allowed, limited
+and shed requests are counted, see `rate_limit_stats`.
+
+The async routes of the ASGI mode do not pass through the Flask request hooks
+and are not limited.
+"""
+import math
+import os
+import sqlite3
+import threading
+import time
+import weakref
+from collections import Counter, OrderedDict, namedtuple
+
+from flask import current_app, g, jsonify, request
+
+EXTENSION_KEY = 'rate_limiter'
+
+_LIMITS_ATTRIBUTE = '_rate_limits'
+
+Limit = namedtuple('Limit', ['rate', 'burst'])
+
+
+def rate_limit(per_client=None, per_route=None):
+    """
+    Declares the token bucket limits of a route, each a (requests per second, burst) tuple
+    """
+    def decorator(f):
+        setattr(f, _LIMITS_ATTRIBUTE, {
+            "per_client": Limit(*per_client) if per_client else None,
+            "per_route": Limit(*per_route) if per_route else None,
+        })
+        return f
+    return decorator
+
+
+class MemoryBuckets:
+    """
+    Token buckets in process memory. Keys are spread over `stripes` locks, each
+    stripe keeps its buckets from the least to the most recently updated one.
+    Buckets that refilled completely are dropped from the front, and a stripe
+    never holds more than max_keys / stripes of them: past that its least
+    recently updated buckets are dropped even if not full, those clients start
+    over with a full bucket
+    """
+    name = 'memory'
+
+    def __init__(self, stripes=64, max_keys=100000):
+        self._stripes = [(threading.Lock(), OrderedDict()) for _ in range(stripes)]
+        self._stripe_max_keys = max(1, max_keys // stripes)
+
+    def take(self, key, limit):
+        """
+        Takes one token. Returns 0 if it was available, otherwise the seconds until it will be
+        """
+        now = time.monotonic()
+        lock, buckets = self._stripes[hash(key) % len(self._stripes)]
+        with lock:
+            tokens, updated, _ = buckets.get(key, (limit.burst, now, now))
+            tokens = min(limit.burst, tokens + (now - updated) * limit.rate)
+            wait = 0.0 if tokens >= 1 else (1 - tokens) / limit.rate
+            if not wait:
+                tokens -= 1
+            buckets[key] = (tokens, now, now + (limit.burst - tokens) / limit.rate)
+            buckets.move_to_end(key)
+            # A bucket is dropped once it would be full again, it then behaves exactly like a missing one.
+            # Every bucket is dropped at most once per update, so this stays O(1) amortized
+            while buckets:
+                oldest_key = next(iter(buckets))
+                if buckets[oldest_key][2] > now and len(buckets) <= self._stripe_max_keys:
+                    break
+                del buckets[oldest_key]
+        return wait
+
+    def __len__(self):
+        return sum(len(buckets) for _, buckets in self._stripes)
+
+
+_sqlite_buckets = weakref.WeakSet()
+
+
+class SQLiteBuckets:
+    """
+    Token buckets in a SQLite file shared by the worker processes of a host.
+    A token is taken with a single atomic upsert, each thread keeps its own connection.
+    A forked child opens new connections, SQLite connections must not cross a fork
+    """
+    name = 'sqlite'
+
+    _CREATE_TABLE = (
+        "CREATE TABLE IF NOT EXISTS rate_limit_buckets ("
+        "key TEXT PRIMARY KEY, tokens REAL NOT NULL, updated REAL NOT NULL, full_at REAL NOT NULL)"
+    )
+    # Every expression of the update reads the stored values, the WHERE clause leaves an empty bucket untouched
+    _TAKE = (
+        "INSERT INTO rate_limit_buckets (key, tokens, updated, full_at) "
+        "VALUES (:key, :burst - 1, :now, :now + 1.0 / :rate) "
+        "ON CONFLICT (key) DO UPDATE SET "
+        "tokens = min(:burst, tokens + (:now - updated) * :rate) - 1, "
+        "updated = :now, "
+        "full_at = :now + (:burst - min(:burst, tokens + (:now - updated) * :rate) + 1) / :rate "
+        "WHERE min(:burst, tokens + (:now - updated) * :rate) >= 1 "
+        "RETURNING tokens"
+    )
+    PRUNE_EVERY = 10000
+
+    def __init__(self, path, busy_timeout=5.0):
+        self.path = path
+        self.busy_timeout = busy_timeout
+        self._local = threading.local()
+        self._takes = 0
+        _sqlite_buckets.add(self)
+        connection = self._connection()
+        connection.execute("PRAGMA journal_mode=WAL")
+        connection.execute(self._CREATE_TABLE)
+
+    def _connection(self):
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=self.busy_timeout, isolation_level=None,
+                                         check_same_thread=False)
+            connection.execute("PRAGMA synchronous=NORMAL")
+            self._local.connection = connection
+        return connection
+
+    def take(self, key, limit):
+        now = time.time()
+        connection = self._connection()
+        row = connection.execute(
+            self._TAKE, {"key": '\x1f'.join(map(str, key)), "burst": limit.burst, "rate": limit.rate, "now": now}
+        ).fetchone()
+        self._takes += 1
+        if self._takes % self.PRUNE_EVERY == 0:
+            connection.execute("DELETE FROM rate_limit_buckets WHERE full_at <= :now", {"now": now})
+        # The stored level is not read back on a miss, one token takes 1 / rate seconds to refill
+        return 0.0 if row is not None else 1 / limit.rate
+
+    def __len__(self):
+        return self._connection().execute("SELECT count(*) FROM rate_limit_buckets").fetchone()[0]
+
+    def reset_after_fork(self):
+        # The parent's connections are left open, closing them would affect the parent
+        self._local = threading.local()
+
+
+def _reset_sqlite_buckets_after_fork():
+    for buckets in list(_sqlite_buckets):
+        buckets.reset_after_fork()
+
+
+os.register_at_fork(after_in_child=_reset_sqlite_buckets_after_fork)
+
+
+class RateLimiter:
+
+    def __init__(self, buckets, max_concurrent=0, queue_timeout=0.0):
+        self.buckets = buckets
+        self.max_concurrent = max_concurrent
+        self.queue_timeout = queue_timeout
+        self._slots = threading.BoundedSemaphore(max_concurrent) if max_concurrent else None
+        self._lock = threading.Lock()
+        self._counters = Counter()
+        self.in_flight = 0
+        self.peak_in_flight = 0
+        self.shed = 0
+
+    def check(self, endpoint, client, limits):
+        """
+        Takes a token from every bucket of the request, returns 0 or the seconds to wait before retrying
+        """
+        wait = 0.0
+        if limits["per_client"] is not None:
+            wait = self.buckets.take((endpoint, client), limits["per_client"])
+        if not wait and limits["per_route"] is not None:
+            wait = self.buckets.take((endpoint,), limits["per_route"])
+        with self._lock:
+            self._counters[endpoint, 'limited' if wait else 'allowed'] += 1
+        return wait
+
+    def acquire(self):
+        """
+        Returns whether a concurrency slot was obtained, the caller must `release` it
+        """
+        if self._slots is not None:
+            acquired = self._slots.acquire(timeout=self.queue_timeout) if self.queue_timeout \
+                else self._slots.acquire(blocking=False)
+            if not acquired:
+                with self._lock:
+                    self.shed += 1
+                return False
+        with self._lock:
+            self.in_flight += 1
+            self.peak_in_flight = max(self.peak_in_flight, self.in_flight)
+        return True
+
+    def release(self):
+        with self._lock:
+            self.in_flight -= 1
+        if self._slots is not None:
+            self._slots.release()
+
+    def stats(self):
+        with self._lock:
+            routes = {}
+            for (endpoint, outcome), count in self._counters.items():
+                routes.setdefault(endpoint, {"allowed": 0, "limited": 0})[outcome] = count
+            return {
+                "enabled": True,
+                "backend": self.buckets.name,
+                "buckets": len(self.buckets),
+                "max_concurrent": self.max_concurrent,
+                "in_flight": self.in_flight,
+                "peak_in_flight": self.peak_in_flight,
+                "shed": self.shed,
+                "routes": routes,
+            }
+
+
+def _limits_for_request(app):
+    configured = app.config['RATE_LIMITS'].get(request.endpoint)
+    if configured is not None:
+        return {
+            "per_client": Limit(*configured["per_client"]) if configured.get("per_client") else None,
+            "per_route": Limit(*configured["per_route"]) if configured.get("per_route") else None,
+        }
+    view = app.view_functions.get(request.endpoint)
+    limits = getattr(view, _LIMITS_ATTRIBUTE, None)
+    if limits is not None:
+        return limits
+    default = app.config['RATE_LIMIT_DEFAULT']
+    if default:
+        return {"per_client": Limit(*default), "per_route": None}
+    return None
+
+
+def _too_many_requests(status, message, retry_after):
+    response = jsonify({"error": message})
+    response.status_code = status
+    response.headers['Retry-After'] = str(max(1, math.ceil(retry_after)))
+    return response
+
+
+def init_rate_limiting(app):
+    """
+    Registers the admission checks when RATE_LIMIT_ENABLED is set
+    """
+    app.extensions[EXTENSION_KEY] = None
+    if not app.config['RATE_LIMIT_ENABLED']:
+        return
+
+    if app.config['RATE_LIMIT_SQLITE_PATH']:
+        buckets = SQLiteBuckets(app.config['RATE_LIMIT_SQLITE_PATH'])
+    else:
+        buckets = MemoryBuckets(max_keys=app.config['RATE_LIMIT_MAX_KEYS'])
+    limiter = RateLimiter(
+        buckets,
+        max_concurrent=app.config['RATE_LIMIT_MAX_CONCURRENT'],
+        queue_timeout=app.config['RATE_LIMIT_QUEUE_TIMEOUT'],
+    )
+    app.extensions[EXTENSION_KEY] = limiter
+
+    @app.before_request
+    def admit_request():
+        limits = _limits_for_request(app)
+        if limits is not None:
+            wait = limiter.check(request.endpoint, request.remote_addr, limits)
+            if wait:
+                return _too_many_requests(429, "Too many requests", wait)
+
+        if not limiter.acquire():
+            return _too_many_requests(503, "Server is busy, please try again", 1)
+        g.rate_limit_slot = True
+
+    @app.teardown_request
+    def release_slot(exception=None):
+        if g.pop('rate_limit_slot', False):
+            limiter.release()
+
+
+def rate_limit_stats():
+    limiter = current_app.extensions.get(EXTENSION_KEY)
+    if limiter is None:
+        return {"enabled": False}
+    return limiter.stats()
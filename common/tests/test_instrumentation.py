@@ -0,0 +1,75 @@
+import logging
+
+import pytest
+from flask import Flask
+from flask_sqlalchemy import SQLAlchemy
+
+from service_common.instrumentation import QueryBudgetExceeded, init_instrumentation, query_budget
+
+
+def create_app(**config):
+    app = Flask(__name__)
+    app.config.update(
+        TESTING=True,
+        SQLALCHEMY_DATABASE_URI='sqlite://',
+        SQL_INSTRUMENTATION=True,
+        SLOW_QUERY_MS=100,
+        QUERY_BUDGET=3,
+        QUERY_BUDGETS={},
+        QUERY_BUDGET_STRICT=False,
+    )
+    app.config.update(config)
+    db = SQLAlchemy(app)
+    init_instrumentation(app)
+
+    def run_queries(count):
+        for _ in range(count):
+            db.session.execute(db.text('SELECT 1'))
+        return {"queries": count}
+
+    @app.route('/queries/<int:count>')
+    def queries(count):
+        return run_queries(count)
+
+    @app.route('/budgeted/<int:count>')
+    @query_budget(1)
+    def budgeted(count):
+        return run_queries(count)
+
+    return app
+
+
+def budget_warnings(caplog):
+    return [record.getMessage() for record in caplog.records
+            if record.name == 'sql_instrumentation' and record.levelno == logging.WARNING]
+
+
+def test_within_budget_is_not_reported(caplog):
+    response = create_app().test_client().get('/queries/3')
+
+    assert response.status_code == 200
+    assert 'db;dur=' in response.headers['Server-Timing']
+    assert budget_warnings(caplog) == []
+
+
+def test_exceeded_budget_is_logged(caplog):
+    response = create_app().test_client().get('/queries/4')
+
+    assert response.status_code == 200
+    assert budget_warnings(caplog) == ["queries issued 4 SQL queries, the budget is 3"]
+
+
+def test_route_budget_overrides_the_default(caplog):
+    app = create_app()
+    app.test_client().get('/budgeted/2')
+    app.test_client().get('/queries/2')
+
+    assert budget_warnings(caplog) == ["budgeted issued 2 SQL queries, the budget is 1"]
+
+
+def test_exceeded_budget_raises_when_strict():
+    client = create_app(QUERY_BUDGET_STRICT=True, QUERY_BUDGETS={'queries': 5}).test_client()
+
+    assert client.get('/queries/5').status_code == 200
+    with pytest.raises(QueryBudgetExceeded, match="issued 6 SQL queries, the budget is 5"):
+        client.get('/queries/6')
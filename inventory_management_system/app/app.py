@@ -1,27 +1,119 @@
-from flask import Flask, request, jsonify
+from flask import Blueprint, Flask, current_app, Response, request, jsonify, abort
 from models import db, Inventory
-from config import Config
-from utils import validate_create_inventory_payload
+from config import get_config
+from utils import validate_create_inventory_payload, parse_stock_adjustments, ndjson_response, iter_ndjson, chunked
+from search_index import init_search_index, create_search_index, is_enabled as search_index_enabled, \
+    build_match_query, search_inventory, matching_statement
+from search_totals import init_search_totals, search_total, search_totals_stats, COUNT_MODES
+from category_summary import init_category_summary, get_category_summary
+from inventory_snapshot import init_inventory_snapshot, get_inventory_snapshot
+from migrations import upgrade as upgrade_schema
+from service_common.database import configure_engine
+from service_common.instrumentation import init_instrumentation, query_budget
+from query_plans import sample_requests
+from service_common.query_plans import print_query_plans
+from read_queries import item_statement, item_resource
+from serializers import INVENTORY_LISTING_SCHEMA, init_json_provider
+from service_common.metrics import init_metrics, render_metrics, CONTENT_TYPE as METRICS_CONTENT_TYPE
+from service_common.rate_limit import init_rate_limiting, rate_limit, rate_limit_stats
+from service_common.http_cache import init_http_cache, cached_json_response, invalidate as invalidate_http_cache, http_cache_stats
+import inventory_events
+from inventory_events import InventoryChange, InventoryState
+
+import click
+import math
+from sqlalchemy.orm.exc import StaleDataError
+
+bp = Blueprint('inventory', __name__, cli_group=None)
+
+
+def create_app(config=None):
+    """
+    Builds the inventory app from `config` (a config class), by default the one selected by APP_PROFILE.
+    Creating the app does not touch the database, the schema is created by `flask --app app init-db`
+    """
+    app = Flask(__name__)
+    app.config.from_object(config or get_config())
+    init_json_provider(app)
+
+    db.init_app(app)
+    init_category_summary(app)
+    init_inventory_snapshot(app)
+    init_http_cache(app)
+    init_search_index(app)
+    init_search_totals(app)
+    init_metrics(app, cache_stats=lambda: {"http": http_cache_stats(), "search_totals": search_totals_stats()})
+    init_rate_limiting(app)
+
+    with app.app_context():
+        configure_engine(db.engine, app.config['SQLITE_PRAGMAS'])
+        init_instrumentation(app)
+
+    app.register_blueprint(bp)
+    return app
+
+
+def init_db(app):
+    """
+    Creates the missing tables and applies the pending migrations, returns the versions applied
+    """
+    with app.app_context():
+        db.create_all()
+        applied = upgrade_schema(db.engine)
+        create_search_index(app)
+    return applied
+
+
+def warm_up(app):
+    """
+    Loads the category summary and the inventory snapshot, detects the search index and runs
+    the item read query once. wsgi.py calls it before forking its workers so that they start warm
+    """
+    with app.app_context():
+        get_category_summary().stats()
+        get_inventory_snapshot().value_by_category()
+        search_index_enabled()
+        db.session.execute(item_statement(0)).all()
+
+
+def invalidate_item_responses(changes):
+    for change in changes:
+        invalidate_http_cache(('inventory', change.id))
+
+
+inventory_events.subscribe(invalidate_item_responses)
+
 
-app = Flask(__name__)
-app.config.from_object(Config)
+@bp.cli.command('init-db')
+def init_db_command():
+    """Create the missing tables and apply the pending schema migrations"""
+    applied = init_db(current_app._get_current_object())
+    click.echo(f"Applied migrations: {applied}" if applied else "Schema is up to date")
 
 
-# Initialize the database
-db.init_app(app)
+@bp.cli.command('db-upgrade')
+def db_upgrade_command():
+    """Apply the pending schema migrations"""
+    applied = upgrade_schema(db.engine)
+    click.echo(f"Applied migrations: {applied}" if applied else "Schema is up to date")
 
 
-# Create the database tables
-with app.app_context():
-    db.create_all()
+@bp.cli.command('explain-queries')
+@click.option('--fail-on-scan', is_flag=True, help='Exit with an error when an endpoint scans a table')
+def explain_queries_command(fail_on_scan):
+    """Print EXPLAIN QUERY PLAN for the queries of every read endpoint"""
+    app = current_app._get_current_object()
+    unexpected_scans = print_query_plans(app, sample_requests(app), echo=click.echo)
+    if fail_on_scan and unexpected_scans:
+        raise click.ClickException(f"{unexpected_scans} unexpected full table scan(s)")
 
 
-@app.route('/')
+@bp.route('/')
 def hello_world():
     return 'Hello, World!'
 
 
-@app.route('/inventory/create', methods=['POST'])
+@bp.route('/inventory/create', methods=['POST'])
 def create_inventory():
     """
     This function will create a new inventory with the mandatory fields
@@ -56,28 +148,136 @@ def create_inventory():
     return jsonify({'success': True, 'message': 'Inventory created successfully'}), 201
 
 
-@app.route('/inventory/read/<int:inventory_id>', methods=['GET'])
-def get_inventory_details(inventory_id):
+def _upsert_inventory_chunk(rows, start_index, seen_names):
     """
-    This function will retrieve the individual inventory details
+    Creates or updates one chunk of inventory rows in a single transaction.
+    Existing items are resolved with one IN query for the whole chunk
     Args:
-        inventory_id: Integer
+        rows: list of payloads
+        start_index: position of the first row in the request
+        seen_names: names already processed earlier in the same request
+    Returns:
+        list of per row results
     """
-    item = Inventory.query.filter_by(id=inventory_id).first()
-    if item:
-        item_details = {
-            "name": item.name,
-            "description": item.description,
-            "quantity": item.quantity,
-            "price": item.price,
-            "category": item.category
+    results = []
+    valid_rows = []
+    for index, data in enumerate(rows, start=start_index):
+        if not isinstance(data, dict) or not validate_create_inventory_payload(data):
+            results.append({"index": index, "status": "error",
+                            "error": "Please provide item name, quantity, price and category"})
+        elif data['name'] in seen_names:
+            results.append({"index": index, "name": data['name'], "status": "error",
+                            "error": "Duplicate name in request"})
+        else:
+            seen_names.add(data['name'])
+            valid_rows.append((index, data))
+
+    if not valid_rows:
+        return results
+
+    names = [data['name'] for _, data in valid_rows]
+    existing_items = {item.name: item for item in Inventory.query.filter(Inventory.name.in_(names))}
+
+    saved = []
+    for index, data in valid_rows:
+        item = existing_items.get(data['name'])
+        if item:
+            item.description = data.get('description', '')
+            item.quantity = data.get('quantity')
+            item.price = data.get('price')
+            item.category = data.get('category')
+            saved.append((index, item, "updated"))
+        else:
+            item = Inventory(
+                name=data.get('name'),
+                description=data.get('description'),
+                quantity=data.get('quantity'),
+                price=data.get('price'),
+                category=data.get('category')
+            )
+            db.session.add(item)
+            saved.append((index, item, "created"))
+
+    try:
+        db.session.commit()
+    except Exception as e:
+        # Log the exception
+        db.session.rollback()
+        for index, data in valid_rows:
+            results.append({"index": index, "name": data['name'], "status": "error",
+                            "error": "Failed to save the inventory"})
+        results.sort(key=lambda result: result["index"])
+        return results
+
+    for index, item, status in saved:
+        results.append({"index": index, "name": item.name, "id": item.id, "status": status})
+    results.sort(key=lambda result: result["index"])
+    return results
+
+
+@bp.route('/inventory/bulk', methods=['POST'])
+def bulk_upsert_inventory():
+    """
+    This function will create or update many inventories in one request.
+    Items are matched by name: existing items are updated, the others are created.
+    The payload is either a JSON array of inventory objects or, with the
+    Content-Type application/x-ndjson, one inventory object per line.
+    Rows are saved in chunks of BULK_CHUNK_SIZE, one transaction per chunk
+    Returns:
+        {
+            "success": True,
+            "created": <count>,
+            "updated": <count>,
+            "failed": <count>,
+            "results": [{"index": 0, "name": "", "id": 1, "status": "created|updated|error"}]
         }
-        return jsonify({"success": True, "item_details": item_details}), 201
+    """
+    if request.mimetype == 'application/x-ndjson':
+        rows = iter_ndjson(request.stream)
     else:
+        rows = request.get_json(silent=True)
+        if not isinstance(rows, list):
+            return jsonify({"error": "Invalid input"}), 404
+
+    chunk_size = current_app.config['BULK_CHUNK_SIZE']
+    seen_names = set()
+    results = []
+    for chunk_number, chunk in enumerate(chunked(rows, chunk_size)):
+        results.extend(_upsert_inventory_chunk(chunk, chunk_number * chunk_size, seen_names))
+
+    counts = {"created": 0, "updated": 0, "error": 0}
+    for result in results:
+        counts[result["status"]] += 1
+
+    return jsonify({
+        "success": True,
+        "created": counts["created"],
+        "updated": counts["updated"],
+        "failed": counts["error"],
+        "results": results,
+    })
+
+
+@bp.route('/inventory/read/<int:inventory_id>', methods=['GET'])
+@query_budget(1)
+def get_inventory_details(inventory_id):
+    """
+    This function will retrieve the individual inventory details.
+    The serialized item is cached until the item changes and the response carries
+    an ETag, so conditional requests get a 304 Not Modified
+    Args:
+        inventory_id: Integer
+    """
+    def load():
+        return item_resource(db.session.execute(item_statement(inventory_id)).first())
+
+    response = cached_json_response(('inventory', inventory_id), load, status=201)
+    if response is None:
         return jsonify({"error": "Inventory not found with the specified id"}), 400
+    return response
 
 
-@app.route('/inventory/update/<int:inventory_id>', methods=['PUT'])
+@bp.route('/inventory/update/<int:inventory_id>', methods=['PUT'])
 def update_inventory(inventory_id):
     """
     This function will update the inventory details with the specified inventory
@@ -92,21 +292,31 @@ def update_inventory(inventory_id):
         return jsonify({'error': 'Bad Request', 'message': 'Please provide item name, quantity, price and category'}), 400
 
     item = Inventory.query.filter_by(id=inventory_id).first()
-    if item:
-        item.description = data.get('description', '')
-        item.quantity = data.get('quantity')
-        item.price = data.get('price')
-        item.category = data.get('category')
+    if not item:
+        return jsonify({"error": "Inventory not found with specified id"})
+
+    # Optimistic locking: clients send the version they read to not overwrite a newer change
+    expected_version = data.get('version')
+    if expected_version is not None and expected_version != item.version:
+        return jsonify({"error": "Inventory was modified by another request", "version": item.version}), 409
+
+    item.description = data.get('description', '')
+    item.quantity = data.get('quantity')
+    item.price = data.get('price')
+    item.category = data.get('category')
 
+    try:
         db.session.add(item)
         db.session.commit()
-    else:
-        return jsonify({"error": "Inventory not found with specified id"})
+    except StaleDataError:
+        # The row changed between the read above and this write
+        db.session.rollback()
+        return jsonify({"error": "Inventory was modified by another request"}), 409
 
-    return jsonify({"success": True, "message": "Succesfully update the inventory"})
+    return jsonify({"success": True, "message": "Succesfully update the inventory", "version": item.version})
 
 
-@app.route('/inventory/delete/<int:inventory_id>', methods=['POST'])
+@bp.route('/inventory/delete/<int:inventory_id>', methods=['POST'])
 def delete_inventory(inventory_id):
     """
     This function will delete an inventory related to a specified inventory id
@@ -117,32 +327,266 @@ def delete_inventory(inventory_id):
     """
     item = Inventory.query.filter_by(id=inventory_id).first()
     if item:
-        db.session.delete(item)
-        db.session.commit()
+        try:
+            db.session.delete(item)
+            db.session.commit()
+        except StaleDataError:
+            db.session.rollback()
+            return jsonify({"error": "Inventory was modified by another request"}), 409
     else:
         return jsonify({"error": "Inventory not found with specified id"})
 
     return jsonify({"success": True, "inventory": "Inventory successfully deleted"})
 
 
-@app.route('/inventory/category', methods=['GET'])
+def _adjust_stock(deltas, atomic=True):
+    """
+    Applies quantity deltas with a single conditional UPDATE ... RETURNING, so concurrent
+    adjustments neither lose updates nor take the stock below zero, and no row is read first
+    Args:
+        deltas: dict of inventory id to quantity change
+        atomic: when True nothing is applied unless every adjustment can be
+    Returns:
+        list of per item results, in the order of `deltas`
+    """
+    delta = db.case(deltas, value=Inventory.id)
+    statement = db.update(Inventory).where(
+        Inventory.id.in_(list(deltas)),
+        Inventory.quantity + delta >= 0
+    ).values(
+        quantity=Inventory.quantity + delta,
+        version=Inventory.version + 1
+    ).returning(
+        Inventory.id, Inventory.category, Inventory.quantity, Inventory.price, Inventory.version
+    ).execution_options(synchronize_session=False)
+
+    begun = inventory_events.clock()
+    updated = {row.id: row for row in db.session.execute(statement)}
+    rejected = [inventory_id for inventory_id in deltas if inventory_id not in updated]
+    if rejected and atomic:
+        db.session.rollback()
+        updated = {}
+    else:
+        db.session.commit()
+        # The UPDATE bypasses the ORM, so its change events are published here
+        inventory_events.publish([
+            InventoryChange(
+                row.id,
+                InventoryState(row.category, row.quantity - deltas[row.id], row.price, row.version - 1),
+                InventoryState(row.category, row.quantity, row.price, row.version)
+            ) for row in updated.values()
+        ], begun)
+
+    # Only the failure path reads the rows, to tell missing items from insufficient stock
+    current = {}
+    if rejected:
+        current = dict(db.session.query(Inventory.id, Inventory.quantity).filter(Inventory.id.in_(rejected)))
+
+    results = []
+    for inventory_id in deltas:
+        if inventory_id in updated:
+            row = updated[inventory_id]
+            results.append({"id": inventory_id, "status": "adjusted", "quantity": row.quantity, "version": row.version})
+        elif inventory_id in current:
+            results.append({"id": inventory_id, "status": "insufficient_stock", "quantity": current[inventory_id]})
+        elif inventory_id in rejected:
+            results.append({"id": inventory_id, "status": "not_found"})
+        else:
+            results.append({"id": inventory_id, "status": "rolled_back"})
+    return results
+
+
+@bp.route('/inventory/<int:inventory_id>/adjust', methods=['POST'])
+def adjust_inventory(inventory_id):
+    """
+    This API atomically adds a delta (negative to take stock out) to the quantity of an inventory.
+    The adjustment is refused with 409 when the quantity would go below zero
+    Function Payload:
+        {"delta": <integer>}
+    Returns:
+        {"success": True, "id": <inventory id>, "quantity": <new quantity>, "version": <new version>}
+    """
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict):
+        return jsonify({"error": "Invalid input"}), 404
+
+    deltas = parse_stock_adjustments([{"id": inventory_id, "delta": data.get('delta')}])
+    if deltas is None:
+        return jsonify({'error': 'Bad Request', 'message': 'Please provide an integer delta'}), 400
+
+    result = _adjust_stock(deltas)[0]
+    if result["status"] == "not_found":
+        return jsonify({"error": "Inventory not found with specified id"}), 400
+    if result["status"] == "insufficient_stock":
+        return jsonify({"error": "Insufficient stock", "quantity": result["quantity"]}), 409
+
+    return jsonify({"success": True, "id": inventory_id, "quantity": result["quantity"], "version": result["version"]})
+
+
+@bp.route('/inventory/adjust', methods=['POST'])
+def adjust_inventory_batch():
+    """
+    This API applies many stock adjustments with one UPDATE. Deltas of the same id are summed.
+    By default the batch is atomic: when any adjustment fails nothing is applied and 409 is returned.
+    With "atomic": false the possible adjustments are applied and the others reported
+    Function Payload:
+        {
+            "adjustments": [{"id": <inventory id>, "delta": <integer>}],
+            "atomic": true
+        }
+    Returns:
+        {
+            "success": True|False,
+            "results": [{"id": 1, "status": "adjusted|insufficient_stock|not_found|rolled_back", "quantity": 0, "version": 2}]
+        }
+    """
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict):
+        return jsonify({"error": "Invalid input"}), 404
+
+    deltas = parse_stock_adjustments(data.get('adjustments'))
+    if deltas is None:
+        return jsonify({'error': 'Bad Request', 'message': 'Please provide a list of {"id", "delta"} adjustments'}), 400
+    if len(deltas) > current_app.config['ADJUST_MAX_BATCH']:
+        return jsonify({'error': 'Bad Request',
+                        'message': f"At most {current_app.config['ADJUST_MAX_BATCH']} items can be adjusted at once"}), 400
+
+    atomic = data.get('atomic', True) is not False
+    results = _adjust_stock(deltas, atomic=atomic)
+    success = all(result["status"] == "adjusted" for result in results)
+    return jsonify({"success": success, "results": results}), 200 if success or not atomic else 409
+
+
+def _conditional_json(payload, etag):
+    """
+    Answers with 304 when the client already holds the representation with this etag
+    """
+    if request.if_none_match.contains(etag):
+        response = Response(status=304)
+    else:
+        response = jsonify(payload)
+    response.set_etag(etag)
+    return response
+
+
+@bp.route('/inventory/category', methods=['GET'])
+@query_budget(1)
 def get_categories():
     """
-    This function will list down all the inventory categories avaialble in the DB
+    This function will list down all the inventory categories avaialble in the DB.
+    The list is served from the in-memory category summary and supports If-None-Match
     Returns:
         {
             "success": True,
             "categories": []
         }
     """
-    categories = []
-    for inventory in Inventory.query.with_entities(Inventory.category).distinct():
-        categories.append(inventory.category)
-    
-    return jsonify({"success": True, "categories": categories})
+    categories, etag = get_category_summary().categories()
+    return _conditional_json({"success": True, "categories": categories}, etag)
 
 
-@app.route('/inventory/search', methods=['POST'])
+@bp.route('/inventory/category/stats', methods=['GET'])
+@query_budget(1)
+def get_category_stats():
+    """
+    This function will return the item count, total quantity and total stock value of every category.
+    The stats are served from the in-memory category summary and support If-None-Match
+    Returns:
+        {
+            "success": True,
+            "categories": {
+                <category>: {"items": <int>, "total_quantity": <int>, "total_value": <float>}
+            }
+        }
+    """
+    stats, etag = get_category_summary().stats()
+    return _conditional_json({"success": True, "categories": stats}, etag)
+
+
+@bp.route('/inventory/analytics/value', methods=['GET'])
+@query_budget(1)
+def get_stock_value():
+    """
+    This API returns the total stock value (quantity * price) per category and overall.
+    It is computed from the in-memory inventory snapshot
+    Returns:
+        {
+            "success": True,
+            "total_value": <float>,
+            "categories": {
+                <category>: {"items": <int>, "total_quantity": <int>, "total_value": <float>}
+            }
+        }
+    """
+    categories = get_inventory_snapshot().value_by_category()
+    total_value = round(sum((stats["total_value"] for stats in categories.values()), 0.0), 2)
+    return jsonify({"success": True, "total_value": total_value, "categories": categories})
+
+
+@bp.route('/inventory/analytics/low-stock', methods=['GET'])
+@query_budget(1)
+def get_low_stock():
+    """
+    This API lists the items with a quantity below a threshold, lowest quantity first.
+    It is computed from the in-memory inventory snapshot
+    Query string:
+        threshold: default INVENTORY_LOW_STOCK_THRESHOLD
+        limit: items returned, default 100, at most 1000
+        category: optional
+    Returns:
+        {
+            "success": True,
+            "threshold": <int>,
+            "total": <number of items below the threshold>,
+            "items": [{"id", "quantity", "price", "category"}]
+        }
+    """
+    threshold = request.args.get('threshold', current_app.config['INVENTORY_LOW_STOCK_THRESHOLD'], type=int)
+    limit = request.args.get('limit', 100, type=int)
+    if not 1 <= limit <= 1000:
+        return jsonify({'error': 'Bad Request', 'message': 'limit must be between 1 and 1000'}), 400
+
+    category = request.args.get('category', '').lower()
+    total, items = get_inventory_snapshot().low_stock(threshold, limit, category)
+    return jsonify({"success": True, "threshold": threshold, "total": total, "items": items})
+
+
+@bp.route('/inventory/analytics/price-histogram', methods=['GET'])
+@query_budget(1)
+def get_price_histogram():
+    """
+    This API returns a histogram of the item prices with equal width bins.
+    It is computed from the in-memory inventory snapshot
+    Query string:
+        bins: default 20, at most 1000
+        category: optional
+        min, max: range of the bins, by default the lowest and highest price.
+            Prices outside of the range are not counted
+    Returns:
+        {
+            "success": True,
+            "items": <number of prices counted>,
+            "edges": [<bins + 1 bin edges>],
+            "counts": [<count of every bin>]
+        }
+    """
+    bins = request.args.get('bins', 20, type=int)
+    low = request.args.get('min', type=float)
+    high = request.args.get('max', type=float)
+    if not 1 <= bins <= 1000:
+        return jsonify({'error': 'Bad Request', 'message': 'bins must be between 1 and 1000'}), 400
+    if any(value is not None and not math.isfinite(value) for value in (low, high)) \
+            or (low is not None and high is not None and high < low):
+        return jsonify({'error': 'Bad Request', 'message': 'min and max must be numbers, min not above max'}), 400
+
+    category = request.args.get('category', '').lower()
+    histogram = get_inventory_snapshot().price_histogram(bins, category, low, high)
+    return jsonify({"success": True, **histogram})
+
+
+@bp.route('/inventory/search', methods=['POST'])
+@rate_limit(per_client=(10, 20), per_route=(200, 400))
+@query_budget(2)
 def inventory_search():
     """
     This API will fetch the inventory records that matches with the user specified details.
@@ -155,7 +599,15 @@ def inventory_search():
             "category": "",
             "page_number": <Page number for pagination>
             "per_page": <records per page in pagination>
+            "count": "exact" (default), "approx" or "none"
         }
+    When SQLite FTS5 is available the search string is matched word by word
+    (prefix matches) against a full text index and results are ranked by relevance,
+    otherwise the name and description are scanned with LIKE.
+    has_next never needs the total. With count "exact" the total is counted once and
+    reused by the next pages, "approx" stops counting at SEARCH_APPROX_COUNT_LIMIT
+    (total_is_approximate is then true and the total a lower bound) and "none" skips
+    the count, total_items and pages are then null.
     Response:
         Sucess if found
         empty if not found
@@ -168,47 +620,101 @@ def inventory_search():
     category = data.get("category", "").lower()
     page_number = data.get("page_number", 1)
     per_page = data.get("per_page", 10)
-
-    if category:
-        inventory_query = Inventory.query.filter(db.and_(
-            Inventory.category == category,
-            db.or_(
-                Inventory.name.contains(search_text),
-                Inventory.description.contains(search_text)
-                )
-            )
-        )
+    count_mode = data.get("count", "exact")
+    if count_mode not in COUNT_MODES:
+        return jsonify({'error': 'Bad Request', 'message': 'count must be one of exact, approx or none'}), 400
+
+    # Same page rules as Flask-SQLAlchemy's paginate
+    if not isinstance(page_number, int) or not isinstance(per_page, int) or page_number < 1 or per_page < 1:
+        abort(404)
+
+    match_query = build_match_query(search_text) if search_index_enabled() else None
+    if match_query:
+        # Ranked full text search with prefix matching
+        items, has_next = search_inventory(match_query, category, page_number, per_page)
+        totals_key = ('fts', match_query, category)
+        matching = matching_statement(match_query, category)
     else:
-        inventory_query = Inventory.query.filter(db.or_(
+        condition = db.or_(
             Inventory.name.contains(search_text),
             Inventory.description.contains(search_text)
-            )
         )
+        if category:
+            condition = db.and_(Inventory.category == category, condition)
+
+        # One extra row tells whether there is a next page, rows are read as plain columns
+        statement = db.select(*INVENTORY_LISTING_SCHEMA.columns).where(condition).order_by(Inventory.id) \
+            .limit(per_page + 1).offset((page_number - 1) * per_page)
+        items = INVENTORY_LISTING_SCHEMA.serialize_many(db.session.execute(statement))
+        items, has_next = items[:per_page], len(items) > per_page
+        totals_key = ('like', search_text, category)
+        matching = db.select(Inventory.id).where(condition)
+
+    # Past the last page, like paginate
+    if not items and page_number != 1:
+        abort(404)
+
+    total_items, is_lower_bound = search_total(totals_key, matching, count_mode)
+    pagination_details = {
+        "total_items": total_items,
+        "page": page_number,
+        "per_page": per_page,
+        "pages": math.ceil(total_items / per_page) if total_items is not None and not is_lower_bound else None,
+        "has_next": has_next,
+        "has_prev": page_number > 1,
+    }
+    if count_mode == 'approx':
+        pagination_details["total_is_approximate"] = is_lower_bound
+
+    return jsonify({"items": items, **pagination_details})
+
+
+@bp.route('/inventory/export', methods=['GET'])
+@query_budget(1)
+def export_inventory():
+    """
+    This API streams every inventory item as newline delimited JSON.
+    Rows are fetched in batches of EXPORT_BATCH_SIZE so memory usage stays constant
+    """
+    statement = db.select(*INVENTORY_LISTING_SCHEMA.columns).order_by(Inventory.id).execution_options(
+        yield_per=current_app.config['EXPORT_BATCH_SIZE']
+    )
 
-    pagination = inventory_query.paginate(page=page_number, per_page=per_page)
-
-    inventory_items = []
-    for item in pagination.items:
-        each_inventory = {
-            "id": item.id,
-            "name": item.name,
-            "description": item.description,
-            "quantity": item.quantity,
-            "price": item.price,
-            "category": item.category
-        }
-        inventory_items.append(each_inventory)
+    def rows():
+        for row in db.session.execute(statement):
+            yield INVENTORY_LISTING_SCHEMA.serialize(row)
 
-    return jsonify({
-        "items": inventory_items,
-        "total_items": pagination.total,
-        "page": pagination.page,
-        "per_page": pagination.per_page,
-        "pages": pagination.pages,
-        "has_next": pagination.has_next,
-        "has_prev": pagination.has_prev,
-    })
+    return ndjson_response(rows())
+
+
+@bp.route('/inventory/cache/stats', methods=['GET'])
+def get_cache_stats():
+    """
+    This API returns the size and hit/miss counters of the HTTP response and search totals caches,
+    and the size of the inventory snapshot behind the analytics endpoints
+    """
+    return jsonify({"success": True, "caches": {"http": http_cache_stats(), "search_totals": search_totals_stats()},
+                    "inventory_snapshot": get_inventory_snapshot().stats()})
+
+
+@bp.route('/inventory/rate-limit/stats', methods=['GET'])
+def get_rate_limit_stats():
+    """
+    This API returns the rate limiter counters: allowed and limited requests per route,
+    requests in flight and requests shed by the concurrency limit
+    """
+    return jsonify({"success": True, "rate_limit": rate_limit_stats()})
+
+
+@bp.route('/metrics', methods=['GET'])
+def get_metrics():
+    """
+    This API exposes request, database, cache and rate limiting metrics in the Prometheus text format
+    """
+    return Response(render_metrics(current_app), content_type=METRICS_CONTENT_TYPE)
 
 
 if __name__ == '__main__':
+    app = create_app()
+    init_db(app)
     app.run(port=5002, debug=True)
@@ -0,0 +1,30 @@
+"""
+ASGI entry point of the inventory service.
+
+Item reads are served by an async handler, every other endpoint by the Flask app.
+
+    python asgi.py
+    uvicorn asgi:application --port 5002 --workers 4
+"""
+from app import create_app, init_db
+from service_common.async_app import AsyncApp, json_response, serve
+from read_queries import item_statement, item_resource
+
+app = create_app()
+application = AsyncApp(app)
+
+
+@application.route('/inventory/read/<int:inventory_id>')
+async def get_inventory_details(request, session, inventory_id):
+    async def load():
+        return item_resource((await session.execute(item_statement(inventory_id))).first())
+
+    response = await application.cached_json(request, ('inventory', inventory_id), load, status=201)
+    if response is None:
+        return json_response({"error": "Inventory not found with the specified id"}, 400)
+    return response
+
+
+if __name__ == '__main__':
+    init_db(app)
+    serve('asgi:application', app.config, port=5002)
@@ -0,0 +1,144 @@
+"""
+In-memory summary of the inventory per category (item count, total quantity
+and total stock value).
+
+The summary is loaded with one GROUP BY query on first use and then kept up to
+date from the committed inventory changes, so the category endpoints never
+scan the table. Other worker processes do not see each other's writes, so the
+summary is reloaded once it is older than CATEGORY_SUMMARY_MAX_AGE seconds.
+
+Unlike the snapshot's, the summary's updates are deltas and must be applied
+exactly once. A commit can race a reload, so every batch is checked against the
+clock ticks taken around the last load: batches the load already saw are
+skipped, and when it cannot be told the summary is dropped and reloaded.
+"""
+import hashlib
+import json
+import threading
+import time
+
+from flask import current_app
+from sqlalchemy import func
+
+from models import db, Inventory
+import inventory_events
+
+EXTENSION_KEY = 'category_summary'
+
+
+class CategorySummary:
+
+    def __init__(self, max_age=None):
+        self.max_age = max_age
+        self._stats = None
+        self._loaded_at = 0
+        # clock() ticks taken before and after the last load
+        self._load_window = (0, 0)
+        self._etags = None
+        self._lock = threading.Lock()
+
+    def _load(self):
+        started = inventory_events.clock()
+        stats = {}
+        rows = db.session.query(
+            Inventory.category,
+            func.count(Inventory.id),
+            func.coalesce(func.sum(Inventory.quantity), 0),
+            func.coalesce(func.sum(Inventory.quantity * Inventory.price), 0),
+        ).group_by(Inventory.category)
+        for category, items, total_quantity, total_value in rows:
+            stats[category] = [items, total_quantity, total_value]
+        self._stats = stats
+        self._loaded_at = time.monotonic()
+        self._load_window = (started, inventory_events.clock())
+        self._etags = None
+
+    def _ensure_loaded(self):
+        if self._stats is None or (self.max_age is not None and time.monotonic() - self._loaded_at > self.max_age):
+            self._load()
+
+    def _add(self, state, sign):
+        entry = self._stats.setdefault(state.category, [0, 0, 0])
+        entry[0] += sign
+        entry[1] += sign * state.quantity
+        entry[2] += sign * state.quantity * float(state.price)
+        if entry[0] <= 0:
+            del self._stats[state.category]
+
+    def apply(self, changes):
+        """
+        Subscriber for inventory_events, applies the committed changes
+        """
+        with self._lock:
+            if self._stats is None:
+                # Nothing loaded yet, the first read will see these rows
+                return
+            load_started, load_finished = self._load_window
+            if changes.committed < load_started:
+                # Committed before the last load, which counted these rows
+                return
+            if changes.begun < load_finished:
+                # The load ran while this transaction committed, it may or may not have seen it
+                self._stats = None
+                return
+            try:
+                for change in changes:
+                    if change.old is not None:
+                        self._add(change.old, -1)
+                    if change.new is not None:
+                        self._add(change.new, 1)
+            except Exception:
+                # Part of the batch may be counted, the next read reloads the summary
+                self._stats = None
+                raise
+            self._etags = None
+
+    def invalidate(self):
+        with self._lock:
+            self._stats = None
+
+    def _snapshot(self):
+        with self._lock:
+            self._ensure_loaded()
+            if self._etags is None:
+                categories = sorted(self._stats)
+                stats = {
+                    category: {
+                        "items": items,
+                        "total_quantity": total_quantity,
+                        "total_value": round(total_value, 2),
+                    }
+                    for category, (items, total_quantity, total_value) in sorted(self._stats.items())
+                }
+                self._etags = {
+                    "categories": (categories, _etag(categories)),
+                    "stats": (stats, _etag(stats)),
+                }
+            return self._etags
+
+    def categories(self):
+        """
+        Returns (sorted list of categories, etag)
+        """
+        return self._snapshot()["categories"]
+
+    def stats(self):
+        """
+        Returns ({category: {"items", "total_quantity", "total_value"}}, etag)
+        """
+        return self._snapshot()["stats"]
+
+
+def _etag(value):
+    return hashlib.md5(json.dumps(value, sort_keys=True).encode()).hexdigest()
+
+
+def init_category_summary(app):
+    summary = CategorySummary(max_age=app.config['CATEGORY_SUMMARY_MAX_AGE'])
+    app.extensions[EXTENSION_KEY] = summary
+    inventory_events.subscribe(summary.apply, app)
+    return summary
+
+
+def get_category_summary():
+    return current_app.extensions[EXTENSION_KEY]
@@ -5,5 +5,94 @@ basedir = os.path.abspath(os.path.dirname(__file__))
 
 class Config:
     SECRET_KEY = os.environ.get('SECRET_KEY') or 'you-will-never-guess'
-    SQLALCHEMY_DATABASE_URI = 'sqlite:///' + os.path.join(basedir, 'inventory.db')
-    SQLALCHEMY_TRACK_MODIFICATIONS = False
\ No newline at end of file
+    SQLALCHEMY_DATABASE_URI = os.environ.get('DATABASE_URL') or 'sqlite:///' + os.path.join(basedir, 'inventory.db')
+    SQLALCHEMY_TRACK_MODIFICATIONS = False
+    SQLITE_PRAGMAS = {}
+    EXPORT_BATCH_SIZE = 1000
+    BULK_CHUNK_SIZE = 1000
+    ADJUST_MAX_BATCH = 1000
+    INVENTORY_FTS_ENABLED = os.environ.get('INVENTORY_FTS_ENABLED', '1') == '1'
+    CATEGORY_SUMMARY_MAX_AGE = int(os.environ.get('CATEGORY_SUMMARY_MAX_AGE', 60))
+    # Columnar snapshot behind /inventory/analytics, reloaded after this many seconds to see other processes' writes
+    INVENTORY_SNAPSHOT_MAX_AGE = int(os.environ.get('INVENTORY_SNAPSHOT_MAX_AGE', 300))
+    INVENTORY_LOW_STOCK_THRESHOLD = int(os.environ.get('INVENTORY_LOW_STOCK_THRESHOLD', 10))
+    HTTP_CACHE_SIZE = int(os.environ.get('HTTP_CACHE_SIZE', 10000))
+    HTTP_CACHE_TTL = int(os.environ.get('HTTP_CACHE_TTL', 30))
+    # Search totals reused by the following pages of the same search, see search_totals.py
+    SEARCH_TOTALS_CACHE_SIZE = int(os.environ.get('SEARCH_TOTALS_CACHE_SIZE', 1000))
+    SEARCH_TOTALS_CACHE_TTL = int(os.environ.get('SEARCH_TOTALS_CACHE_TTL', 30))
+    SEARCH_APPROX_COUNT_LIMIT = int(os.environ.get('SEARCH_APPROX_COUNT_LIMIT', 1000))
+    SQL_INSTRUMENTATION = os.environ.get('SQL_INSTRUMENTATION', '0') == '1'
+    SLOW_QUERY_MS = float(os.environ.get('SLOW_QUERY_MS', 100))
+    QUERY_BUDGET = int(os.environ['QUERY_BUDGET']) if os.environ.get('QUERY_BUDGET') else None
+    QUERY_BUDGETS = {}
+    QUERY_BUDGET_STRICT = os.environ.get('QUERY_BUDGET_STRICT', '0') == '1'
+    ASGI_HOST = os.environ.get('ASGI_HOST', '127.0.0.1')
+    ASGI_WORKERS = int(os.environ.get('ASGI_WORKERS', 1))
+    # Threads running the endpoints that are not served asynchronously
+    ASGI_THREADS = int(os.environ.get('ASGI_THREADS', 32))
+    ASGI_BACKLOG = int(os.environ.get('ASGI_BACKLOG', 2048))
+    ASGI_KEEP_ALIVE_TIMEOUT = int(os.environ.get('ASGI_KEEP_ALIVE_TIMEOUT', 5))
+    # Pre-fork mode (wsgi.py): gunicorn worker processes, each running PREFORK_THREADS requests at a time
+    PREFORK_BIND = os.environ.get('PREFORK_BIND', '127.0.0.1:5002')
+    PREFORK_WORKERS = int(os.environ.get('PREFORK_WORKERS', os.cpu_count() or 1))
+    PREFORK_THREADS = int(os.environ.get('PREFORK_THREADS', 8))
+    PREFORK_BACKLOG = int(os.environ.get('PREFORK_BACKLOG', 2048))
+    PREFORK_KEEP_ALIVE_TIMEOUT = int(os.environ.get('PREFORK_KEEP_ALIVE_TIMEOUT', 5))
+    # Seconds a worker may stop responding before it is replaced
+    PREFORK_TIMEOUT = int(os.environ.get('PREFORK_TIMEOUT', 30))
+    # Seconds a stopping worker is given to finish its in-flight requests
+    PREFORK_GRACEFUL_TIMEOUT = int(os.environ.get('PREFORK_GRACEFUL_TIMEOUT', 30))
+    RATE_LIMIT_ENABLED = os.environ.get('RATE_LIMIT_ENABLED', '0') == '1'
+    # {endpoint: {"per_client": (requests per second, burst), "per_route": (...)}}, overrides @rate_limit
+    RATE_LIMITS = {}
+    # Per client (requests per second, burst) of the routes without their own limits
+    RATE_LIMIT_DEFAULT = None
+    RATE_LIMIT_MAX_CONCURRENT = int(os.environ.get('RATE_LIMIT_MAX_CONCURRENT', 0))
+    RATE_LIMIT_QUEUE_TIMEOUT = float(os.environ.get('RATE_LIMIT_QUEUE_TIMEOUT', 0))
+    RATE_LIMIT_MAX_KEYS = int(os.environ.get('RATE_LIMIT_MAX_KEYS', 100000))
+    # Shares the buckets between the worker processes of a host
+    RATE_LIMIT_SQLITE_PATH = os.environ.get('RATE_LIMIT_SQLITE_PATH')
+
+
+class ProductionConfig(Config):
+    """
+    Engine profile for serving concurrent traffic: SQLite runs in WAL mode so
+    readers do not block on writers, and connections come from a sized pool.
+    Setting DATABASE_URL to a postgresql:// URI switches the database and
+    enables pool_pre_ping, the SQLite pragmas are ignored in that case.
+    The ASGI mode starts one worker process per CPU, and rate limiting is on
+    with at most RATE_LIMIT_MAX_CONCURRENT (default 64) requests per process.
+    """
+    SQLITE_PRAGMAS = {
+        'journal_mode': 'WAL',
+        'synchronous': 'NORMAL',
+        # Negative values are in KiB
+        'cache_size': int(os.environ.get('SQLITE_CACHE_SIZE', -64000)),
+        'mmap_size': int(os.environ.get('SQLITE_MMAP_SIZE', 268435456)),
+        'busy_timeout': int(os.environ.get('SQLITE_BUSY_TIMEOUT', 5000)),
+        'temp_store': 'MEMORY',
+    }
+    ASGI_WORKERS = int(os.environ.get('ASGI_WORKERS', os.cpu_count() or 1))
+    RATE_LIMIT_ENABLED = os.environ.get('RATE_LIMIT_ENABLED', '1') == '1'
+    RATE_LIMIT_MAX_CONCURRENT = int(os.environ.get('RATE_LIMIT_MAX_CONCURRENT', 64))
+    SQLALCHEMY_ENGINE_OPTIONS = {
+        'pool_size': int(os.environ.get('DB_POOL_SIZE', 10)),
+        'max_overflow': int(os.environ.get('DB_MAX_OVERFLOW', 20)),
+        'pool_timeout': int(os.environ.get('DB_POOL_TIMEOUT', 10)),
+        'pool_recycle': 1800,
+        'pool_pre_ping': not Config.SQLALCHEMY_DATABASE_URI.startswith('sqlite'),
+    }
+
+
+CONFIGS = {
+    'default': Config,
+    'production': ProductionConfig,
+}
+
+
+def get_config():
+    """
+    Returns the config class selected by the APP_PROFILE environment variable
+    """
+    return CONFIGS[os.environ.get('APP_PROFILE', 'default')]
@@ -0,0 +1,144 @@
+"""
+Delivers committed changes of inventory rows to in-process subscribers.
+
+Changes made through the ORM are collected from the session while it flushes
+and handed to the subscribers once the transaction commits; they are dropped
+on rollback. Writes that bypass the ORM (e.g. a Core UPDATE) must call
+`publish` themselves after committing.
+
+Every delivered batch carries two ticks of `clock()`: `begun`, taken before the
+transaction committed, and `committed`, taken after. A subscriber that reloads
+its state from the database takes ticks around the load to tell whether the
+load already saw a batch (committed before the load started), missed it (begun
+after the load finished) or cannot know (the windows overlap).
+
+A subscriber that keeps state of one app subscribes with that app and only
+gets the changes committed under it. It goes away with the app.
+"""
+import itertools
+import logging
+import weakref
+from collections import namedtuple
+
+from flask import current_app, has_app_context
+from sqlalchemy import event, inspect
+from sqlalchemy.orm import Session
+
+from models import Inventory
+
+logger = logging.getLogger(__name__)
+
+# The part of an inventory row the subscribers care about, version is the row's
+# version in that state (None when unknown)
+InventoryState = namedtuple('InventoryState', ['category', 'quantity', 'price', 'version'], defaults=(None,))
+# old is None for a created item and new is None for a deleted item
+InventoryChange = namedtuple('InventoryChange', ['id', 'old', 'new'])
+
+_SESSION_KEY = 'inventory_changes'
+_BEGUN_KEY = 'inventory_changes_begun'
+_subscribers = []
+# {app: [callback, ...]}, the subscribers of the changes committed under one app
+_app_subscribers = weakref.WeakKeyDictionary()
+_clock = itertools.count(1)
+
+
+class ChangeBatch(list):
+    """
+    The InventoryChanges of one commit, with the clock() ticks taken before and after it
+    """
+
+    def __init__(self, changes, begun, committed):
+        super().__init__(changes)
+        self.begun = begun
+        self.committed = committed
+
+
+def clock():
+    """
+    Returns a process wide tick, larger than every tick returned before
+    """
+    return next(_clock)
+
+
+def subscribe(callback, app=None):
+    """
+    Registers a callable receiving a list of InventoryChange after every commit,
+    or only after the commits made under `app` when it is given
+    """
+    subscribers = _subscribers if app is None else _app_subscribers.setdefault(app, [])
+    if callback not in subscribers:
+        subscribers.append(callback)
+
+
+def unsubscribe(callback, app=None):
+    subscribers = _subscribers if app is None else _app_subscribers.get(app, [])
+    if callback in subscribers:
+        subscribers.remove(callback)
+
+
+def _subscribers_of_current_app():
+    if not has_app_context():
+        return []
+    return _app_subscribers.get(current_app._get_current_object(), [])
+
+
+def publish(changes, begun=None):
+    """
+    Delivers the changes of a committed transaction, `begun` is a clock() tick taken before it
+    wrote anything (unknown if None, the batch then overlaps every earlier load)
+    """
+    if not changes:
+        return
+    batch = ChangeBatch(changes, begun or 0, clock())
+    for callback in _subscribers + _subscribers_of_current_app():
+        try:
+            callback(batch)
+        except Exception:
+            # The other subscribers still get the batch, one that keeps state drops it when it fails
+            logger.exception("Inventory change subscriber %r failed", callback)
+
+
+def _committed_state(item, version):
+    attributes = inspect(item).attrs
+
+    def committed(key):
+        history = attributes[key].history
+        if history.deleted:
+            return history.deleted[0]
+        return getattr(item, key)
+
+    return InventoryState(committed('category'), committed('quantity'), committed('price'), version)
+
+
+def _current_state(item):
+    return InventoryState(item.category, item.quantity, item.price, item.version)
+
+
+@event.listens_for(Session, 'after_flush')
+def _collect_changes(session, flush_context):
+    changes = []
+    for item in session.new:
+        if isinstance(item, Inventory):
+            changes.append(InventoryChange(item.id, None, _current_state(item)))
+    for item in session.dirty:
+        if isinstance(item, Inventory) and session.is_modified(item):
+            # The flush already incremented the version of an updated row
+            changes.append(InventoryChange(item.id, _committed_state(item, item.version - 1), _current_state(item)))
+    for item in session.deleted:
+        if isinstance(item, Inventory):
+            changes.append(InventoryChange(item.id, _committed_state(item, item.version), None))
+    if changes:
+        if _BEGUN_KEY not in session.info:
+            session.info[_BEGUN_KEY] = clock()
+        session.info.setdefault(_SESSION_KEY, []).extend(changes)
+
+
+@event.listens_for(Session, 'after_commit')
+def _publish_changes(session):
+    publish(session.info.pop(_SESSION_KEY, None), session.info.pop(_BEGUN_KEY, None))
+
+
+@event.listens_for(Session, 'after_rollback')
+def _discard_changes(session):
+    session.info.pop(_SESSION_KEY, None)
+    session.info.pop(_BEGUN_KEY, None)
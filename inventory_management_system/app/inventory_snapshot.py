@@ -0,0 +1,352 @@
+"""
+Columnar in-memory snapshot of the inventory behind the analytics endpoints.
+
+The snapshot keeps five parallel columns: id, quantity, price, category code
+(an index into the list of category names) and row version. It is loaded with
+one streamed query on first use and then kept up to date from the committed
+inventory changes, like the category summary. A change carries the full new
+state of its row and its version, so applying one twice is harmless and a
+change delivered after a newer one of the same row is ignored. A removed row
+is replaced by the last one, the columns stay dense.
+
+The columns are array.array buffers. With NumPy installed (pip install -r
+requirements-analytics.txt) the reports run vectorized over zero-copy views of
+them, a few milliseconds for millions of rows; otherwise they fall back to
+Python loops over the same arrays. Other worker processes' writes are picked
+up when the snapshot is reloaded after INVENTORY_SNAPSHOT_MAX_AGE seconds.
+"""
+import array
+import heapq
+import threading
+import time
+
+from flask import current_app
+
+from models import db, Inventory
+import inventory_events
+
+try:
+    import numpy
+except ImportError:  # optional dependency
+    numpy = None
+
+EXTENSION_KEY = 'inventory_snapshot'
+
+# Versions of deleted rows remembered between two loads, older updates of them are ignored
+MAX_DELETED_VERSIONS = 100000
+
+
+class _Columns:
+
+    def __init__(self):
+        self.ids = array.array('q')
+        self.quantities = array.array('q')
+        self.prices = array.array('d')
+        self.codes = array.array('i')
+        # 0 when the version is unknown
+        self.versions = array.array('q')
+        # id -> position in the columns
+        self.positions = {}
+
+    def __len__(self):
+        return len(self.ids)
+
+    def set(self, item_id, quantity, price, code, version):
+        position = self.positions.get(item_id)
+        if position is None:
+            self.positions[item_id] = len(self.ids)
+            self.ids.append(item_id)
+            self.quantities.append(quantity)
+            self.prices.append(price)
+            self.codes.append(code)
+            self.versions.append(version or 0)
+        else:
+            self.quantities[position] = quantity
+            self.prices[position] = price
+            self.codes[position] = code
+            self.versions[position] = version or 0
+
+    def version(self, item_id):
+        position = self.positions.get(item_id)
+        return None if position is None else self.versions[position]
+
+    def remove(self, item_id):
+        position = self.positions.pop(item_id, None)
+        if position is None:
+            return
+        last = len(self.ids) - 1
+        if position != last:
+            moved_id = self.ids[last]
+            self.ids[position] = moved_id
+            self.quantities[position] = self.quantities[last]
+            self.prices[position] = self.prices[last]
+            self.codes[position] = self.codes[last]
+            self.versions[position] = self.versions[last]
+            self.positions[moved_id] = position
+        for column in (self.ids, self.quantities, self.prices, self.codes, self.versions):
+            column.pop()
+
+    def nbytes(self):
+        return sum(column.itemsize * len(column)
+                   for column in (self.ids, self.quantities, self.prices, self.codes, self.versions))
+
+    def views(self):
+        """
+        Zero-copy NumPy views of (ids, quantities, prices, codes).
+        An array can not grow while a view of it exists, so views must not outlive the snapshot lock
+        """
+        return tuple(
+            numpy.frombuffer(column, dtype=column.typecode) if len(column) else numpy.empty(0, dtype=column.typecode)
+            for column in (self.ids, self.quantities, self.prices, self.codes)
+        )
+
+
+# The vectorized reports only return plain Python values, their views are released when they return
+
+def _value_by_category_numpy(columns, category_count):
+    _, quantities, prices, codes = columns.views()
+    return (
+        numpy.bincount(codes, minlength=category_count).tolist(),
+        numpy.bincount(codes, weights=quantities, minlength=category_count).tolist(),
+        numpy.bincount(codes, weights=quantities * prices, minlength=category_count).tolist(),
+    )
+
+
+def _low_stock_numpy(columns, threshold, limit, code):
+    ids, quantities, prices, codes = columns.views()
+    mask = quantities < threshold
+    if code is not None:
+        mask &= codes == code
+    positions = numpy.flatnonzero(mask)
+    total = len(positions)
+    if limit < total:
+        positions = positions[numpy.argpartition(quantities[positions], limit)[:limit]]
+    # Lowest quantity first, ties by id
+    positions = positions[numpy.lexsort((ids[positions], quantities[positions]))]
+    return total, list(zip(ids[positions].tolist(), quantities[positions].tolist(),
+                           prices[positions].tolist(), codes[positions].tolist()))
+
+
+def _histogram_numpy(columns, bins, code, low, high):
+    _, _, prices, codes = columns.views()
+    if code is not None:
+        prices = prices[codes == code]
+    if low is None:
+        low = float(prices.min()) if len(prices) else 0.0
+    if high is None:
+        high = float(prices.max()) if len(prices) else 0.0
+    counts, edges = numpy.histogram(prices, bins=bins, range=(low, high if high > low else low + 1.0))
+    return {"items": int(counts.sum()), "edges": edges.tolist(), "counts": counts.tolist()}
+
+
+def _histogram(prices, bins, low, high):
+    if low is None:
+        low = min(prices) if prices else 0.0
+    if high is None:
+        high = max(prices) if prices else 0.0
+    if high <= low:
+        high = low + 1.0
+    width = (high - low) / bins
+    counts = [0] * bins
+    for price in prices:
+        if low <= price <= high:
+            counts[min(int((price - low) / width), bins - 1)] += 1
+    return {"items": sum(counts), "edges": [low + width * i for i in range(bins)] + [high], "counts": counts}
+
+
+class InventorySnapshot:
+
+    def __init__(self, max_age=None, batch_size=10000):
+        self.max_age = max_age
+        self.batch_size = batch_size
+        self._columns = None
+        self._categories = []
+        self._category_codes = {}
+        # id -> version of the rows deleted since the last load
+        self._deleted = {}
+        self._loaded_at = 0
+        self._lock = threading.Lock()
+
+    @property
+    def backend(self):
+        return 'numpy' if numpy is not None else 'array'
+
+    def _category_code(self, category):
+        code = self._category_codes.get(category)
+        if code is None:
+            # Codes are never reused, a category without items only reports zeros
+            code = self._category_codes[category] = len(self._categories)
+            self._categories.append(category)
+        return code
+
+    def _load(self):
+        self._categories, self._category_codes = [], {}
+        self._deleted = {}
+        columns = _Columns()
+        statement = db.select(Inventory.id, Inventory.quantity, Inventory.price, Inventory.category, Inventory.version) \
+            .execution_options(yield_per=self.batch_size)
+        for item_id, quantity, price, category, version in db.session.execute(statement):
+            columns.set(item_id, quantity, float(price), self._category_code(category), version)
+        self._columns = columns
+        self._loaded_at = time.monotonic()
+
+    def _ensure_loaded(self):
+        if self._columns is None or (self.max_age is not None and time.monotonic() - self._loaded_at > self.max_age):
+            self._load()
+
+    def apply(self, changes):
+        """
+        Subscriber for inventory_events, applies the committed changes
+        """
+        with self._lock:
+            if self._columns is None:
+                # Nothing loaded yet, the first report will see these rows
+                return
+            try:
+                for change in changes:
+                    if change.old is None and change.id in self._deleted:
+                        # Either the creation of a deleted row delivered late or a reused id, only a reload can tell
+                        self._columns = None
+                        return
+                    if self._is_outdated(change):
+                        continue
+                    if change.new is None:
+                        self._columns.remove(change.id)
+                        self._remember_deleted(change.id, change.old.version)
+                    else:
+                        self._columns.set(change.id, change.new.quantity, float(change.new.price),
+                                          self._category_code(change.new.category), change.new.version)
+            except Exception:
+                # The columns may be left half updated, the next report reloads them
+                self._columns = None
+                raise
+
+    def _is_outdated(self, change):
+        """
+        Whether a newer change of the row was applied already, changes without a version never are
+        """
+        applied = self._columns.version(change.id)
+        if change.new is None:
+            version = change.old.version
+        else:
+            version = change.new.version
+            if applied is None:
+                applied = self._deleted.get(change.id)
+        if version is None or applied is None:
+            return False
+        # A deletion applies to the version it removed, an update must be newer than the row it replaces
+        return applied > version if change.new is None else applied >= version
+
+    def _remember_deleted(self, item_id, version):
+        if version is None:
+            return
+        if len(self._deleted) >= MAX_DELETED_VERSIONS:
+            # Changes are delivered late by moments, the oldest deletions no longer need guarding
+            self._deleted.clear()
+        self._deleted[item_id] = max(version, self._deleted.get(item_id, 0))
+
+    def invalidate(self):
+        with self._lock:
+            self._columns = None
+
+    def value_by_category(self):
+        """
+        Returns {category: {"items", "total_quantity", "total_value"}} of the categories with items
+        """
+        with self._lock:
+            self._ensure_loaded()
+            columns, categories = self._columns, self._categories
+            if numpy is not None:
+                items, total_quantities, total_values = _value_by_category_numpy(columns, len(categories))
+            else:
+                items = [0] * len(categories)
+                total_quantities = [0] * len(categories)
+                total_values = [0.0] * len(categories)
+                for quantity, price, code in zip(columns.quantities, columns.prices, columns.codes):
+                    items[code] += 1
+                    total_quantities[code] += quantity
+                    total_values[code] += quantity * price
+
+        return {
+            category: {
+                "items": items[code],
+                "total_quantity": int(total_quantities[code]),
+                "total_value": round(total_values[code], 2),
+            }
+            for code, category in sorted(enumerate(categories), key=lambda entry: entry[1])
+            if items[code]
+        }
+
+    def low_stock(self, threshold, limit, category=None):
+        """
+        Returns (number of items with a quantity below `threshold`, the `limit` lowest of them
+        as {"id", "quantity", "price", "category"} dicts, lowest quantity first)
+        """
+        with self._lock:
+            self._ensure_loaded()
+            columns, categories = self._columns, self._categories
+            code = self._category_codes.get(category) if category else None
+            if category and code is None:
+                return 0, []
+
+            if numpy is not None:
+                total, rows = _low_stock_numpy(columns, threshold, limit, code)
+            else:
+                matches = [
+                    (quantity, item_id, position)
+                    for position, (item_id, quantity) in enumerate(zip(columns.ids, columns.quantities))
+                    if quantity < threshold and (code is None or columns.codes[position] == code)
+                ]
+                total = len(matches)
+                rows = [
+                    (item_id, quantity, columns.prices[position], columns.codes[position])
+                    for quantity, item_id, position in heapq.nsmallest(limit, matches)
+                ]
+
+        return total, [
+            {"id": item_id, "quantity": quantity, "price": price, "category": categories[item_code]}
+            for item_id, quantity, price, item_code in rows
+        ]
+
+    def price_histogram(self, bins, category=None, low=None, high=None):
+        """
+        Returns {"items", "edges", "counts"} of the prices, `bins` equal width bins between
+        `low` and `high` (by default the lowest and highest price). The last bin includes `high`
+        """
+        with self._lock:
+            self._ensure_loaded()
+            columns = self._columns
+            code = self._category_codes.get(category) if category else None
+            if category and code is None:
+                return _histogram([], bins, low, high)
+            if numpy is not None:
+                return _histogram_numpy(columns, bins, code, low, high)
+            prices = [price for price, item_code in zip(columns.prices, columns.codes)
+                      if code is None or item_code == code]
+        return _histogram(prices, bins, low, high)
+
+    def stats(self):
+        with self._lock:
+            loaded = self._columns is not None
+            return {
+                "backend": self.backend,
+                "loaded": loaded,
+                "rows": len(self._columns) if loaded else 0,
+                "categories": len(self._categories),
+                "bytes": self._columns.nbytes() if loaded else 0,
+                "age_seconds": round(time.monotonic() - self._loaded_at, 1) if loaded else None,
+            }
+
+
+def init_inventory_snapshot(app):
+    snapshot = InventorySnapshot(
+        max_age=app.config['INVENTORY_SNAPSHOT_MAX_AGE'],
+        batch_size=app.config['EXPORT_BATCH_SIZE'],
+    )
+    app.extensions[EXTENSION_KEY] = snapshot
+    inventory_events.subscribe(snapshot.apply, app)
+    return snapshot
+
+
+def get_inventory_snapshot():
+    return current_app.extensions[EXTENSION_KEY]
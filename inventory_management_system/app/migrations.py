@@ -0,0 +1,73 @@
+"""
+Versioned schema migrations.
+
+db.create_all() creates missing tables but never changes existing ones, so
+every schema change is added to MIGRATIONS with the next version number.
+`upgrade` applies the pending migrations in order, each in its own
+transaction, and records them in the schema_migrations table. Steps are SQL
+strings or callables taking the connection, and must be safe to run on a
+database that create_all() just built from the current models.
+
+    flask --app app db-upgrade
+"""
+import datetime
+
+from sqlalchemy import inspect, text
+
+
+def add_column_if_missing(table_name, column_name, column_ddl):
+    """
+    Returns a migration step adding a column unless the table already has it
+    """
+    def step(connection):
+        columns = [column['name'] for column in inspect(connection).get_columns(table_name)]
+        if column_name not in columns:
+            connection.execute(text(f"ALTER TABLE {table_name} ADD COLUMN {column_name} {column_ddl}"))
+    return step
+
+
+MIGRATIONS = [
+    (1, "Add a covering index for category filters and the category summary", [
+        "CREATE INDEX IF NOT EXISTS ix_inventory_category ON inventory (category, quantity, price)",
+    ]),
+    (2, "Add the row version used for optimistic locking", [
+        add_column_if_missing('inventory', 'version', "INTEGER NOT NULL DEFAULT 1"),
+    ]),
+]
+
+_CREATE_VERSION_TABLE = (
+    "CREATE TABLE IF NOT EXISTS schema_migrations ("
+    "version INTEGER PRIMARY KEY, description VARCHAR(200) NOT NULL, applied_at VARCHAR(32) NOT NULL)"
+)
+
+
+def applied_versions(connection):
+    connection.execute(text(_CREATE_VERSION_TABLE))
+    return {row[0] for row in connection.execute(text("SELECT version FROM schema_migrations"))}
+
+
+def upgrade(engine, migrations=MIGRATIONS):
+    """
+    Applies the pending migrations and returns the list of versions applied
+    """
+    with engine.begin() as connection:
+        done = applied_versions(connection)
+
+    applied = []
+    for version, description, steps in sorted(migrations, key=lambda migration: migration[0]):
+        if version in done:
+            continue
+        with engine.begin() as connection:
+            for step in steps:
+                if callable(step):
+                    step(connection)
+                else:
+                    connection.execute(text(step))
+            connection.execute(
+                text("INSERT INTO schema_migrations (version, description, applied_at) "
+                     "VALUES (:version, :description, :applied_at)"),
+                {"version": version, "description": description,
+                 "applied_at": datetime.datetime.utcnow().isoformat()}
+            )
+        applied.append(version)
+    return applied
@@ -10,6 +10,16 @@ class Inventory(db.Model):
     quantity = db.Column(db.Integer, nullable=False)
     price = db.Column(db.Float, nullable=False)
     category = db.Column(db.String(50), nullable=False)
+    # Incremented by every write. ORM updates and deletes check it (StaleDataError on a
+    # concurrent change) and stock adjustments bump it in their UPDATE
+    version = db.Column(db.Integer, nullable=False, default=1, server_default='1')
+
+    __table_args__ = (
+        db.Index('ix_inventory_category', 'category', 'quantity', 'price'),
+    )
+    __mapper_args__ = {
+        'version_id_col': version,
+    }
 
     def __repr__(self):
         return f'<Inventory {self.name}>'
@@ -0,0 +1,19 @@
+"""
+Sample requests of `flask --app app explain-queries`, the plans are printed by
+service_common.query_plans.
+"""
+
+
+def sample_requests(app):
+    """
+    (method, url, json payload, headers, whether a full scan is expected) per endpoint
+    """
+    return [
+        ('GET', '/inventory/read/1', None, {}, False),
+        ('GET', '/inventory/category/stats', None, {}, False),
+        ('POST', '/inventory/search', {'search_string': 'apple', 'category': 'food'}, {}, False),
+        ('POST', '/inventory/search', {'search_string': '', 'category': 'food'}, {}, False),
+        ('POST', '/inventory/search', {'search_string': '', 'category': ''}, {}, True),
+        ('GET', '/inventory/export', None, {}, True),
+    ]
+
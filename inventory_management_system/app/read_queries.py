@@ -0,0 +1,26 @@
+"""
+Statements and payload builders of the read endpoints.
+
+They are shared by the Flask routes in app.py and the async handlers in
+asgi.py, so every statement is a 2.0 style select that runs unchanged on the
+sync and on the async session.
+"""
+from models import db, Inventory
+from serializers import INVENTORY_SCHEMA
+
+ITEM_SCHEMA = INVENTORY_SCHEMA.only("name", "description", "quantity", "price", "category", "version")
+
+
+def item_statement(inventory_id):
+    return db.select(*ITEM_SCHEMA.columns).where(Inventory.id == inventory_id)
+
+
+def item_resource(row):
+    """
+    Returns the (version, last_modified, build_payload) tuple http_cache expects for a
+    row of item_statement, or None when the item does not exist
+    """
+    if row is None:
+        return None
+    # Inventory has no modification time, the row version is bumped by every write
+    return row.version, None, lambda: {"success": True, "item_details": ITEM_SCHEMA.serialize(row)}
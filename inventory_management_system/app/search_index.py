@@ -0,0 +1,147 @@
+"""
+Full text search over the inventory name and description using SQLite FTS5.
+
+The index is an external content FTS5 table that points at the inventory table
+and is kept in sync by triggers, so every insert, update and delete (including
+bulk writes) updates it in the same transaction. When FTS5 is not available,
+for example on another database backend or a SQLite build without the module,
+`is_enabled` returns False and the caller falls back to LIKE filtering. The
+index is created by `flask --app app init-db` together with the tables.
+"""
+import re
+
+from flask import current_app
+from sqlalchemy import column, literal_column, table, text
+from sqlalchemy.exc import OperationalError
+
+from models import db, Inventory
+from serializers import INVENTORY_LISTING_SCHEMA
+
+FTS_TABLE_NAME = 'inventory_fts'
+EXTENSION_KEY = 'inventory_fts'
+
+inventory_fts = table(FTS_TABLE_NAME, column('rowid'), column('rank'))
+
+_CREATE_TABLE = (
+    "CREATE VIRTUAL TABLE {table} USING fts5("
+    "name, description, content='inventory', content_rowid='id', "
+    "tokenize='unicode61 remove_diacritics 2', prefix='2 3')"
+).format(table=FTS_TABLE_NAME)
+
+_CREATE_TRIGGERS = [
+    "CREATE TRIGGER IF NOT EXISTS {table}_ai AFTER INSERT ON inventory BEGIN "
+    "INSERT INTO {table}(rowid, name, description) VALUES (new.id, new.name, new.description); "
+    "END",
+    "CREATE TRIGGER IF NOT EXISTS {table}_ad AFTER DELETE ON inventory BEGIN "
+    "INSERT INTO {table}({table}, rowid, name, description) VALUES ('delete', old.id, old.name, old.description); "
+    "END",
+    "CREATE TRIGGER IF NOT EXISTS {table}_au AFTER UPDATE OF name, description ON inventory BEGIN "
+    "INSERT INTO {table}({table}, rowid, name, description) VALUES ('delete', old.id, old.name, old.description); "
+    "INSERT INTO {table}(rowid, name, description) VALUES (new.id, new.name, new.description); "
+    "END",
+]
+
+_TOKEN_PATTERN = re.compile(r'\w+', re.UNICODE)
+
+
+def init_search_index(app):
+    """
+    Full text search support is detected on first use, so building the app does not touch the database
+    """
+    app.extensions[EXTENSION_KEY] = None
+
+
+def create_search_index(app):
+    """
+    Creates the FTS5 table and its triggers if needed and records whether full
+    text search can be used. Must be called inside an application context
+    """
+    app.extensions[EXTENSION_KEY] = False
+
+    if not app.config.get('INVENTORY_FTS_ENABLED', True) or db.engine.dialect.name != 'sqlite':
+        return False
+
+    try:
+        with db.engine.begin() as connection:
+            if not _index_exists(connection):
+                connection.execute(text(_CREATE_TABLE))
+                # Index the rows which were written before the table existed
+                connection.execute(text(
+                    "INSERT INTO {table}({table}) VALUES ('rebuild')".format(table=FTS_TABLE_NAME)
+                ))
+            for statement in _CREATE_TRIGGERS:
+                connection.execute(text(statement.format(table=FTS_TABLE_NAME)))
+    except OperationalError as e:
+        app.logger.warning("Full text search is unavailable, falling back to LIKE search: %s", e)
+        return False
+
+    app.extensions[EXTENSION_KEY] = True
+    return True
+
+
+def _index_exists(connection):
+    return connection.execute(
+        text("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = :name"),
+        {"name": FTS_TABLE_NAME}
+    ).first() is not None
+
+
+def is_enabled():
+    enabled = current_app.extensions.get(EXTENSION_KEY)
+    if enabled is None:
+        # The index is created by init-db, another process may have done it
+        enabled = current_app.config.get('INVENTORY_FTS_ENABLED', True) and db.engine.dialect.name == 'sqlite'
+        if enabled:
+            with db.engine.connect() as connection:
+                enabled = _index_exists(connection)
+        current_app.extensions[EXTENSION_KEY] = enabled
+    return enabled
+
+
+def build_match_query(search_text):
+    """
+    Converts user input into an FTS5 query where every word is a prefix match
+    and all words must be present. Returns None if the input has no words
+    """
+    tokens = _TOKEN_PATTERN.findall(search_text or '')
+    if not tokens:
+        return None
+    return ' '.join('"{}"*'.format(token) for token in tokens)
+
+
+def _match_clause(match_query):
+    return literal_column(FTS_TABLE_NAME).op('MATCH')(match_query)
+
+
+def matching_statement(match_query, category):
+    """
+    Returns a select of the rowids matching a full text search, to count them
+    """
+    statement = db.select(inventory_fts.c.rowid).where(_match_clause(match_query))
+    if category:
+        statement = statement.join(Inventory, inventory_fts.c.rowid == Inventory.id).where(Inventory.category == category)
+    return statement
+
+
+def search_inventory(match_query, category, page, per_page):
+    """
+    Runs a ranked full text search
+    Args:
+        match_query: query built by build_match_query
+        category: optional category to filter on
+        page: 1 based page number
+        per_page: records per page
+    Returns:
+        (list of INVENTORY_LISTING_SCHEMA dicts, whether there is a next page)
+    """
+    statement = db.select(*INVENTORY_LISTING_SCHEMA.columns).join(
+        inventory_fts, inventory_fts.c.rowid == Inventory.id
+    ).where(_match_clause(match_query))
+    if category:
+        statement = statement.where(Inventory.category == category)
+
+    # One extra row tells whether there is a next page without counting the matches
+    statement = statement.order_by(inventory_fts.c.rank).limit(per_page + 1).offset((page - 1) * per_page)
+
+    items = INVENTORY_LISTING_SCHEMA.serialize_many(db.session.execute(statement))
+    return items[:per_page], len(items) > per_page
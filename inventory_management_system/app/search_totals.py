@@ -0,0 +1,77 @@
+"""
+Totals of the inventory search.
+
+Counting every match of a popular search costs more than reading one page of
+it, so the search takes a `count` mode:
+
+* exact (default): the matches are counted once per (search, category) and the
+  total is reused by the following pages for SEARCH_TOTALS_CACHE_TTL seconds
+* approx: a cached total when there is one, otherwise the matches are counted
+  up to SEARCH_APPROX_COUNT_LIMIT; a larger result is reported as that limit,
+  flagged as a lower bound
+* none: nothing is counted
+
+Creating or deleting an item, or moving it to another category, drops the
+cached totals. Other edits (e.g. a new description) show up when the entry
+expires. Whether there is a next page does not depend on the total, the page
+query reads one row more than per_page.
+"""
+from flask import current_app
+
+import inventory_events
+from service_common.lru_cache import LRUCache
+from models import db
+
+EXTENSION_KEY = 'search_totals'
+
+COUNT_MODES = ('exact', 'approx', 'none')
+
+
+def _changes_totals(change):
+    return change.old is None or change.new is None or change.old.category != change.new.category
+
+
+def init_search_totals(app):
+    cache = LRUCache(app.config['SEARCH_TOTALS_CACHE_SIZE'], ttl=app.config['SEARCH_TOTALS_CACHE_TTL'])
+    app.extensions[EXTENSION_KEY] = cache
+
+    def drop_totals(changes):
+        if any(_changes_totals(change) for change in changes):
+            cache.clear()
+
+    inventory_events.subscribe(drop_totals, app)
+
+
+def _cache():
+    return current_app.extensions[EXTENSION_KEY]
+
+
+def search_total(key, matching, mode):
+    """
+    Returns (total, is_lower_bound) of a search, (None, False) when mode is 'none'
+    Args:
+        key: hashable identifying the search, e.g. ('fts', match query, category)
+        matching: select of one column of the matching rows
+        mode: one of COUNT_MODES
+    """
+    if mode == 'none':
+        return None, False
+
+    cache = _cache()
+    total = cache.get(key)
+    if total is not None:
+        return total, False
+
+    if mode == 'approx':
+        limit = current_app.config['SEARCH_APPROX_COUNT_LIMIT']
+        total = db.session.scalar(db.select(db.func.count()).select_from(matching.limit(limit + 1).subquery()))
+        if total > limit:
+            return limit, True
+    else:
+        total = db.session.scalar(db.select(db.func.count()).select_from(matching.subquery()))
+    cache.set(key, total)
+    return total, False
+
+
+def search_totals_stats():
+    return _cache().stats()
@@ -1,3 +1,10 @@
+import itertools
+
+from flask import Response, stream_with_context
+
+from serializers import dumps, loads
+
+
 def validate_create_inventory_payload(request_json):
     if not request_json or \
         'name' not in request_json or \
@@ -5,5 +12,74 @@ def validate_create_inventory_payload(request_json):
                 'price' not in request_json or \
                     'category' not in request_json:
         return False
-    else:
-        return True
+    # The in-memory summary and snapshot add these up, a string or a float quantity would not fit them
+    name, category = request_json['name'], request_json['category']
+    quantity, price = request_json['quantity'], request_json['price']
+    if not isinstance(name, str) or not isinstance(category, str):
+        return False
+    # bool is an int subclass, reject it explicitly
+    if not isinstance(quantity, int) or isinstance(quantity, bool):
+        return False
+    if not isinstance(price, (int, float)) or isinstance(price, bool):
+        return False
+    return True
+
+
+def parse_stock_adjustments(adjustments):
+    """
+    Validates a list of {"id": <inventory id>, "delta": <quantity change>} objects.
+    Returns a dict of the summed delta per inventory id, or None if the list is invalid
+    """
+    if not isinstance(adjustments, list) or not adjustments:
+        return None
+
+    deltas = {}
+    for adjustment in adjustments:
+        if not isinstance(adjustment, dict):
+            return None
+        inventory_id, delta = adjustment.get('id'), adjustment.get('delta')
+        # bool is an int subclass, reject it explicitly
+        if not isinstance(inventory_id, int) or not isinstance(delta, int) \
+                or isinstance(inventory_id, bool) or isinstance(delta, bool):
+            return None
+        deltas[inventory_id] = deltas.get(inventory_id, 0) + delta
+    return deltas
+
+
+def ndjson_response(rows):
+    """
+    Streams an iterable of dicts as newline delimited JSON.
+    `rows` should be a generator so the query only runs once the response is being sent
+    """
+    def generate():
+        for row in rows:
+            yield dumps(row) + b'\n'
+
+    return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+
+
+def iter_ndjson(stream):
+    """
+    Yields the decoded objects of a newline delimited JSON stream.
+    Lines which are not valid JSON are yielded as None so callers can report them per row
+    """
+    for line in stream:
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            yield loads(line)
+        except ValueError:
+            yield None
+
+
+def chunked(iterable, size):
+    """
+    Splits an iterable into lists of at most `size` items without materializing it
+    """
+    iterator = iter(iterable)
+    while True:
+        chunk = list(itertools.islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
@@ -0,0 +1,17 @@
+"""
+WSGI entry point of the inventory service.
+
+    python wsgi.py                  pre-forked gunicorn workers, see service_common.prefork
+    gunicorn wsgi:app --workers 4   any other WSGI server, without the warm up
+"""
+from app import create_app, init_db, warm_up
+
+app = create_app()
+
+
+if __name__ == '__main__':
+    # gunicorn is only required by the pre-fork launcher
+    from service_common.prefork import serve
+
+    init_db(app)
+    serve(app, warm_up)
@@ -1,22 +1,128 @@
-from flask import Flask, request, jsonify
+from flask import Blueprint, Flask, current_app, Response, request, jsonify
 from models import db, User
-from config import Config
-from utils import validate_create_user_payload, username_exists, email_exists
+from config import get_config
+from utils import validate_create_user_payload, find_taken, ndjson_response
+from cache import init_auth_cache, decode_token, load_user, invalidate_user, user_statement, auth_cache_stats
+from passwords import init_password_hasher, HasherBusy
+from migrations import upgrade as upgrade_schema
+from service_common.database import configure_engine
+from service_common.instrumentation import init_instrumentation, query_budget
+from query_plans import sample_requests
+from service_common.query_plans import print_query_plans
+from read_queries import profile_resource
+from serializers import USER_SCHEMA, init_json_provider
+from service_common.metrics import init_metrics, render_metrics, CONTENT_TYPE as METRICS_CONTENT_TYPE
+from service_common.rate_limit import init_rate_limiting, rate_limit, rate_limit_stats
+from service_common.http_cache import init_http_cache, cached_json_response, invalidate as invalidate_http_cache, http_cache_stats
+from user_import import FORMATS, detect_format, hash_pool, iter_rows, import_users, read_checkpoint, write_checkpoint
+import click
 import jwt
 import datetime
+import os
 from functools import wraps
 
-app = Flask(__name__)
-app.config.from_object(Config)
-
-
-# Initialize the database
-db.init_app(app)
-
-
-# Create the database tables
-with app.app_context():
-    db.create_all()
+bp = Blueprint('auth', __name__, cli_group=None)
+
+
+def create_app(config=None):
+    """
+    Builds the user management app from `config` (a config class), by default the one selected by APP_PROFILE.
+    Creating the app does not touch the database, the schema is created by `flask --app app init-db`
+    """
+    app = Flask(__name__)
+    app.config.from_object(config or get_config())
+    init_json_provider(app)
+
+    db.init_app(app)
+    init_auth_cache(app)
+    init_password_hasher(app)
+    init_http_cache(app)
+    init_metrics(app, cache_stats=lambda: {**auth_cache_stats(), "http": http_cache_stats()})
+    init_rate_limiting(app)
+
+    with app.app_context():
+        configure_engine(db.engine, app.config['SQLITE_PRAGMAS'])
+        init_instrumentation(app)
+
+    app.register_blueprint(bp)
+    return app
+
+
+def init_db(app):
+    """
+    Creates the missing tables and applies the pending migrations, returns the versions applied
+    """
+    with app.app_context():
+        db.create_all()
+        applied = upgrade_schema(db.engine)
+    return applied
+
+
+def warm_up(app):
+    """
+    Runs the queries of login and profile reads once, wsgi.py calls it before forking
+    its workers so that they start with compiled statements
+    """
+    with app.app_context():
+        User.query.filter_by(email='').first()
+        db.session.execute(user_statement(0)).all()
+
+
+@bp.cli.command('init-db')
+def init_db_command():
+    """Create the missing tables and apply the pending schema migrations"""
+    applied = init_db(current_app._get_current_object())
+    click.echo(f"Applied migrations: {applied}" if applied else "Schema is up to date")
+
+
+@bp.cli.command('db-upgrade')
+def db_upgrade_command():
+    """Apply the pending schema migrations"""
+    applied = upgrade_schema(db.engine)
+    click.echo(f"Applied migrations: {applied}" if applied else "Schema is up to date")
+
+
+@bp.cli.command('explain-queries')
+@click.option('--fail-on-scan', is_flag=True, help='Exit with an error when an endpoint scans a table')
+def explain_queries_command(fail_on_scan):
+    """Print EXPLAIN QUERY PLAN for the queries of every read endpoint"""
+    app = current_app._get_current_object()
+    unexpected_scans = print_query_plans(app, sample_requests(app), echo=click.echo)
+    if fail_on_scan and unexpected_scans:
+        raise click.ClickException(f"{unexpected_scans} unexpected full table scan(s)")
+
+
+@bp.cli.command('import-users')
+@click.argument('path', type=click.Path(exists=True, dir_okay=False))
+@click.option('--format', 'data_format', type=click.Choice(FORMATS), help='Defaults to the file extension')
+@click.option('--checkpoint', help='Checkpoint file, defaults to PATH.checkpoint')
+@click.option('--restart', is_flag=True, help='Ignore the checkpoint and start from the first row')
+def import_users_command(path, data_format, checkpoint, restart):
+    """Import users from a CSV or NDJSON file, resuming after the last committed chunk"""
+    data_format = data_format or detect_format(path)
+    if data_format is None:
+        raise click.UsageError("Cannot tell the file format from its extension, pass --format")
+
+    source = os.path.abspath(path)
+    checkpoint_path = checkpoint or path + '.checkpoint'
+    previous = None if restart else read_checkpoint(checkpoint_path, source)
+    skip = previous["processed"] if previous else 0
+    if skip:
+        click.echo(f"Resuming after row {skip}")
+
+    def report(stats):
+        write_checkpoint(checkpoint_path, source, stats, previous)
+        click.echo(f"{stats['processed']} rows: {stats['created']} created, {stats['failed']} rejected, "
+                   f"{stats['rows_per_second']} rows/s")
+
+    with open(path, 'rb') as stream, hash_pool(current_app.config['IMPORT_HASH_WORKERS']) as executor:
+        stats = import_users(iter_rows(stream, data_format), current_app.config['IMPORT_CHUNK_SIZE'], executor,
+                             skip=skip, max_errors=current_app.config['IMPORT_MAX_ERRORS'], on_chunk=report)
+
+    for error in stats["errors"]:
+        click.echo(f"Row {error['index']}: {error['error']}", err=True)
+    click.echo(f"Imported {stats['created']} users in {stats['seconds']}s ({stats['rows_per_second']} rows/s), "
+               f"{stats['failed']} rows rejected")
 
 
 def token_required(f):
@@ -28,8 +134,8 @@ def token_required(f):
             return jsonify({'message': 'Token is missing'}), 403
 
         try:
-            data = jwt.decode(token, app.config['SECRET_KEY'], algorithms=["HS256"])
-            current_user = User.query.filter_by(id=data['user_id']).first()
+            data = decode_token(token)
+            current_user = load_user(data['user_id'])
         except Exception as e:
             return jsonify({'message': 'Token is invalid', 'error': str(e)}), 403
 
@@ -38,12 +144,13 @@ def token_required(f):
     return decorated
 
 
-@app.route('/')
+@bp.route('/')
 def hello_world():
     return 'Hello, World!'
 
 
-@app.route('/auth/register', methods=['POST'])
+@bp.route('/auth/register', methods=['POST'])
+@rate_limit(per_client=(1, 10))
 def add_user():
     data = request.get_json()
     if not data:
@@ -52,10 +159,11 @@ def add_user():
     if not validate_create_user_payload(data):
         return jsonify({'error': 'Bad Request', 'message': 'Please provide username, email, and password'}), 400
 
-    if username_exists(data['username']):
+    taken_usernames, taken_emails = find_taken([data['username']], [data['email']])
+    if taken_usernames:
         return jsonify({'error': 'Username already exists'}), 400
 
-    if email_exists(data['email']):
+    if taken_emails:
         return jsonify({'error': 'User exists with the same email'}), 400
 
     new_user = User(
@@ -71,7 +179,8 @@ def add_user():
     return jsonify({'success': True, 'message': 'User created successfully'}), 201
 
 
-@app.route('/auth/login', methods=['POST'])
+@bp.route('/auth/login', methods=['POST'])
+@rate_limit(per_client=(1, 10))
 def login():
     data = request.get_json()
 
@@ -83,31 +192,38 @@ def login():
 
     user = User.query.filter_by(email=email).first()
 
-    if not user or not user.check_password(password):
-        return jsonify({"error": 'email or password is incorrect'}), 401
+    try:
+        if not user or not user.check_password(password):
+            return jsonify({"error": 'email or password is incorrect'}), 401
+    except HasherBusy:
+        return jsonify({"error": 'Too many login attempts, please try again'}), 503
+
+    if user.password_needs_rehash():
+        # The hashing parameters changed since this password was stored
+        user.set_password(password)
+        db.session.commit()
 
-    token = jwt.encode({'user_id': user.id, 'exp': datetime.datetime.utcnow() + datetime.timedelta(minutes=30)}, app.config['SECRET_KEY'], algorithm="HS256")
+    token = jwt.encode({'user_id': user.id, 'exp': datetime.datetime.utcnow() + datetime.timedelta(minutes=30)}, current_app.config['SECRET_KEY'], algorithm="HS256")
 
     return jsonify({'token': token})
 
 
-@app.route('/auth/profile', methods=['GET'])
+@bp.route('/auth/profile', methods=['GET'])
+@query_budget(1)
 @token_required
 def get_user_profile(user_object):
     if not user_object:
         return jsonify({"error": "User not found"}), 401
-    user_details = {
-        "username": user_object.username,
-        "email": user_object.email,
-        "first_name": user_object.first_name,
-        "last_name": user_object.last_name,
-    }
-    return jsonify(user_details), 200
 
+    return cached_json_response(('profile', user_object.id), lambda: profile_resource(user_object), status=200)
 
-@app.route('/auth/profile', methods=['PUT'])
+
+@bp.route('/auth/profile', methods=['PUT'])
 @token_required
 def update_profile(user_object):
+    if not user_object:
+        return jsonify({"error": "User not found"}), 401
+
     data = request.get_json()
     if not data:
         return jsonify({"error": "Invalid input"}), 404
@@ -124,16 +240,101 @@ def update_profile(user_object):
         if new_email_user.email == data["email"]:
             return jsonify({"error": "User already exists with the same email"}), 404            
 
-    user_object.username = data.get('username')
-    user_object.email = data.get('email')
-    user_object.first_name = data.get('first_name')
-    user_object.last_name = data.get('last_name')
+    # token_required hands over a cached snapshot, so load the row to update it
+    user_row = db.session.get(User, user_object.id)
+    user_row.username = data.get('username')
+    user_row.email = data.get('email')
+    user_row.first_name = data.get('first_name')
+    user_row.last_name = data.get('last_name')
 
-    db.session.add(user_object)
+    db.session.add(user_row)
     db.session.commit()
+    invalidate_user(user_row.id)
+    invalidate_http_cache(('profile', user_row.id))
 
     return jsonify({"success": True, "message":"User updated successfully"})
 
 
+@bp.route('/auth/users/export', methods=['GET'])
+@query_budget(2)
+@token_required
+def export_users(user_object):
+    """
+    This API streams every user as newline delimited JSON. This API is authenticated.
+    Rows are fetched in batches of EXPORT_BATCH_SIZE so memory usage stays constant
+    """
+    statement = db.select(*USER_SCHEMA.columns).order_by(User.id).execution_options(
+        yield_per=current_app.config['EXPORT_BATCH_SIZE']
+    )
+
+    def rows():
+        for row in db.session.execute(statement):
+            yield USER_SCHEMA.serialize(row)
+
+    return ndjson_response(rows())
+
+
+@bp.route('/auth/users/import', methods=['POST'])
+@rate_limit(per_client=(0.1, 2))
+@token_required
+def import_users_endpoint(user_object):
+    """
+    This API creates users from a CSV (Content-Type text/csv, with a header row) or a
+    newline delimited JSON (application/x-ndjson) body. This API is authenticated and
+    disabled unless IMPORT_ENDPOINT_ENABLED is set.
+    Rows are committed in chunks of IMPORT_CHUNK_SIZE and the response tells how many rows
+    were consumed, a failed upload can be resent with ?skip=<processed> to resume.
+    Passwords are hashed on the shared password hashing pool, within its budget
+    """
+    if not current_app.config['IMPORT_ENDPOINT_ENABLED']:
+        return jsonify({'error': 'Forbidden', 'message': 'The import endpoint is disabled'}), 403
+
+    data_format = detect_format(None, request.mimetype)
+    if data_format is None:
+        return jsonify({'error': 'Bad Request', 'message': 'Send text/csv or application/x-ndjson'}), 400
+
+    skip = max(0, request.args.get('skip', 0, type=int))
+    progress = {"processed": skip}
+    try:
+        stats = import_users(iter_rows(request.stream, data_format), current_app.config['IMPORT_CHUNK_SIZE'],
+                             skip=skip, max_errors=current_app.config['IMPORT_MAX_ERRORS'],
+                             on_chunk=progress.update, shared_pool=True)
+    except HasherBusy:
+        # The chunks before are committed, the client resumes from there
+        return jsonify({"error": 'Too many password hashes in progress, please try again',
+                        "processed": progress["processed"]}), 503
+
+    return jsonify({"success": True, **stats})
+
+
+@bp.route('/auth/cache/stats', methods=['GET'])
+def get_cache_stats():
+    """
+    This API returns the size and hit/miss counters of the token, user and HTTP response caches
+    """
+    caches = auth_cache_stats()
+    caches["http"] = http_cache_stats()
+    return jsonify({"success": True, "caches": caches})
+
+
+@bp.route('/auth/rate-limit/stats', methods=['GET'])
+def get_rate_limit_stats():
+    """
+    This API returns the rate limiter counters: allowed and limited requests per route,
+    requests in flight and requests shed by the concurrency limit
+    """
+    return jsonify({"success": True, "rate_limit": rate_limit_stats()})
+
+
+@bp.route('/metrics', methods=['GET'])
+def get_metrics():
+    """
+    This API exposes request, database, cache and rate limiting metrics in the Prometheus text format
+    """
+    return Response(render_metrics(current_app), content_type=METRICS_CONTENT_TYPE)
+
+
 if __name__ == '__main__':
+    app = create_app()
+    init_db(app)
     app.run(port=5001, debug=True)
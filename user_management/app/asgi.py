@@ -0,0 +1,52 @@
+"""
+ASGI entry point of the user management service.
+
+The profile read is served by an async handler, every other endpoint
+(including register and login, which hash passwords) by the Flask app.
+
+    python asgi.py
+    uvicorn asgi:application --port 5001 --workers 4
+"""
+from app import create_app, init_db
+from service_common.async_app import AsyncApp, json_response, serve
+from cache import decode_token, cached_user, remember_user, user_statement
+from read_queries import profile_resource
+
+app = create_app()
+application = AsyncApp(app)
+
+
+async def load_user(session, user_id):
+    user = cached_user(user_id)
+    if user is None:
+        row = (await session.execute(user_statement(user_id))).first()
+        if row is None:
+            return None
+        user = remember_user(row)
+    return user
+
+
+@application.route('/auth/profile')
+async def get_user_profile(request, session):
+    token = request.headers.get('x-access-tokens')
+    if not token:
+        return json_response({'message': 'Token is missing'}, 403)
+
+    try:
+        data = decode_token(token)
+        user_object = await load_user(session, data['user_id'])
+    except Exception as e:
+        return json_response({'message': 'Token is invalid', 'error': str(e)}, 403)
+
+    if not user_object:
+        return json_response({"error": "User not found"}, 401)
+
+    async def load():
+        return profile_resource(user_object)
+
+    return await application.cached_json(request, ('profile', user_object.id), load, status=200)
+
+
+if __name__ == '__main__':
+    init_db(app)
+    serve('asgi:application', app.config, port=5001)
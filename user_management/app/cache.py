@@ -0,0 +1,88 @@
+"""
+In-process caches for the authentication layer.
+
+Decoded JWTs are cached until the token expires and user rows are cached as
+read-only snapshots for USER_CACHE_TTL seconds, so an authenticated request
+neither re-verifies the signature nor queries the user table when it is hot.
+Routes that change a user must call `invalidate_user`.
+"""
+from collections import namedtuple
+
+import jwt
+from flask import current_app
+
+from models import db, User
+from service_common.lru_cache import LRUCache
+
+EXTENSION_KEY = 'auth_cache'
+
+CachedUser = namedtuple('CachedUser', ['id', 'username', 'email', 'first_name', 'last_name'])
+
+
+def init_auth_cache(app, token_cache=None, user_cache=None):
+    """
+    Registers the token and user caches on the app.
+    Any object implementing get/set/invalidate/stats like LRUCache can be passed in
+    """
+    app.extensions[EXTENSION_KEY] = {
+        "tokens": token_cache or LRUCache(app.config['TOKEN_CACHE_SIZE']),
+        "users": user_cache or LRUCache(app.config['USER_CACHE_SIZE'], ttl=app.config['USER_CACHE_TTL']),
+    }
+
+
+def _caches():
+    return current_app.extensions[EXTENSION_KEY]
+
+
+def decode_token(token):
+    """
+    Returns the token payload, verifying the signature only on a cache miss.
+    Cached payloads are dropped when the token expires
+    """
+    token_cache = _caches()["tokens"]
+    data = token_cache.get(token)
+    if data is None:
+        data = jwt.decode(token, current_app.config['SECRET_KEY'], algorithms=["HS256"])
+        token_cache.set(token, data, expires_at=data.get('exp'))
+    return data
+
+
+def user_statement(user_id):
+    return db.select(*[getattr(User, field) for field in CachedUser._fields]).where(User.id == user_id)
+
+
+def cached_user(user_id):
+    """
+    Returns the cached snapshot of a user or None, without querying the database
+    """
+    return _caches()["users"].get(user_id)
+
+
+def remember_user(row):
+    """
+    Caches a row of user_statement and returns it as a CachedUser
+    """
+    user = CachedUser._make(row)
+    _caches()["users"].set(user.id, user)
+    return user
+
+
+def load_user(user_id):
+    """
+    Returns a CachedUser snapshot for the given id or None if the user does not exist
+    """
+    user = cached_user(user_id)
+    if user is None:
+        row = db.session.execute(user_statement(user_id)).first()
+        if row is None:
+            return None
+        user = remember_user(row)
+    return user
+
+
+def invalidate_user(user_id):
+    _caches()["users"].invalidate(user_id)
+
+
+def auth_cache_stats():
+    return {name: cache.stats() for name, cache in _caches().items()}
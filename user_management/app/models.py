@@ -1,5 +1,6 @@
 from flask_sqlalchemy import SQLAlchemy
-from werkzeug.security import generate_password_hash, check_password_hash
+
+from passwords import get_password_hasher
 
 db = SQLAlchemy()
 
@@ -13,10 +14,13 @@ class User(db.Model):
     last_name = db.Column(db.String(50), nullable=False)
 
     def set_password(self, password):
-        self.password_hash = generate_password_hash(password)
+        self.password_hash = get_password_hasher().hash(password)
 
     def check_password(self, password):
-        return check_password_hash(self.password_hash, password)
+        return get_password_hasher().verify(self.password_hash, password)
+
+    def password_needs_rehash(self):
+        return get_password_hasher().needs_rehash(self.password_hash)
 
     def __repr__(self):
         return f'<User {self.username}>'
@@ -0,0 +1,129 @@
+"""
+Password hashing with a configurable cost.
+
+The hashing method comes from PASSWORD_HASH_METHOD (any werkzeug method string,
+e.g. "scrypt" or "pbkdf2:sha256:600000"). Verification can be offloaded to a
+bounded process pool (PASSWORD_HASH_WORKERS) so a burst of logins does not
+starve the request threads, and at most PASSWORD_HASH_MAX_PENDING verifications
+are admitted at once; callers get HasherBusy instead of queueing forever.
+Batches hashed for the import endpoint go through the same pool and take one
+slot of that budget per batch.
+
+The pool is started by the first verification of each process: a pool
+inherited through fork (the pre-fork workers) would belong to the parent, its
+management thread does not run in the child, so every hasher drops its pool in
+a forked child.
+"""
+import contextlib
+import os
+import threading
+import weakref
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+
+from flask import current_app
+from werkzeug.security import generate_password_hash, check_password_hash
+
+EXTENSION_KEY = 'password_hasher'
+
+_hashers = weakref.WeakSet()
+
+
+class HasherBusy(Exception):
+    """
+    Raised when no verification slot frees up within the configured timeout
+    """
+
+
+class PasswordHasher:
+
+    def __init__(self, method='scrypt', workers=0, max_pending=0, timeout=None):
+        self.method = method
+        self.timeout = timeout
+        # Hashes store the fully expanded method, e.g. "scrypt:32768:8:1"
+        self.method_prefix = generate_password_hash('', method=method).split('$', 1)[0]
+        self._budget = threading.BoundedSemaphore(max_pending) if max_pending else None
+        self.workers = workers
+        self._executor = None
+        self._executor_lock = threading.Lock()
+        _hashers.add(self)
+
+    def _pool(self):
+        if not self.workers:
+            return None
+        with self._executor_lock:
+            if self._executor is None:
+                self._executor = ProcessPoolExecutor(max_workers=self.workers)
+            return self._executor
+
+    def reset_after_fork(self):
+        """
+        Forgets the parent's pool in a forked child, without shutting it down
+        """
+        self._executor = None
+        self._executor_lock = threading.Lock()
+
+    def hash(self, password):
+        return generate_password_hash(password, method=self.method)
+
+    def hash_many(self, passwords, executor=None):
+        """
+        Hashes a batch of passwords, spread over the worker processes of `executor` when one is given
+        """
+        if executor is None:
+            return [self.hash(password) for password in passwords]
+        return list(executor.map(partial(generate_password_hash, method=self.method), passwords, chunksize=8))
+
+    @contextlib.contextmanager
+    def _admitted(self):
+        if self._budget is not None and not self._budget.acquire(timeout=self.timeout):
+            raise HasherBusy()
+        try:
+            yield
+        finally:
+            if self._budget is not None:
+                self._budget.release()
+
+    def hash_batch(self, passwords):
+        """
+        Hashes a batch of passwords on the shared pool, as one of the max_pending admitted calls
+        """
+        with self._admitted():
+            return self.hash_many(passwords, self._pool())
+
+    def verify(self, password_hash, password):
+        with self._admitted():
+            executor = self._pool()
+            if executor is None:
+                return check_password_hash(password_hash, password)
+            return executor.submit(check_password_hash, password_hash, password).result()
+
+    def needs_rehash(self, password_hash):
+        return password_hash.split('$', 1)[0] != self.method_prefix
+
+    def shutdown(self):
+        with self._executor_lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown()
+
+
+def _reset_hashers_after_fork():
+    for hasher in list(_hashers):
+        hasher.reset_after_fork()
+
+
+os.register_at_fork(after_in_child=_reset_hashers_after_fork)
+
+
+def init_password_hasher(app):
+    app.extensions[EXTENSION_KEY] = PasswordHasher(
+        method=app.config['PASSWORD_HASH_METHOD'],
+        workers=app.config['PASSWORD_HASH_WORKERS'],
+        max_pending=app.config['PASSWORD_HASH_MAX_PENDING'],
+        timeout=app.config['PASSWORD_HASH_TIMEOUT'],
+    )
+
+
+def get_password_hasher():
+    return current_app.extensions[EXTENSION_KEY]
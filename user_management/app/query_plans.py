@@ -0,0 +1,23 @@
+"""
+Sample requests of `flask --app app explain-queries`, the plans are printed by
+service_common.query_plans.
+"""
+import datetime
+
+import jwt
+
+
+def sample_requests(app):
+    """
+    (method, url, json payload, headers, whether a full scan is expected) per endpoint
+    """
+    token = jwt.encode(
+        {'user_id': 1, 'exp': datetime.datetime.utcnow() + datetime.timedelta(minutes=5)},
+        app.config['SECRET_KEY'], algorithm="HS256"
+    )
+    return [
+        ('GET', '/auth/profile', None, {'x-access-tokens': token}, False),
+        ('GET', '/auth/users/export', None, {'x-access-tokens': token}, True),
+        ('POST', '/auth/login', {'email': 'nobody@example.com', 'password': 'x'}, {}, False),
+    ]
+
@@ -0,0 +1,20 @@
+"""
+Payload builders of the read endpoints.
+
+They are shared by the Flask routes in app.py and the async handlers in
+asgi.py. The user rows themselves are loaded through cache.py.
+"""
+from serializers import USER_SCHEMA
+
+PROFILE_SCHEMA = USER_SCHEMA.only("username", "email", "first_name", "last_name")
+
+
+def profile_resource(user_object):
+    """
+    Returns the (version, last_modified, build_payload) tuple http_cache expects for a
+    CachedUser, or None when there is no user
+    """
+    if user_object is None:
+        return None
+    # The cached user snapshot is the version, any profile change yields a new ETag
+    return tuple(user_object), None, lambda: PROFILE_SCHEMA.serialize_object(user_object)
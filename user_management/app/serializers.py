@@ -0,0 +1,133 @@
+"""
+Output schemas and JSON encoding.
+
+Every model declares its output fields once as a Schema. Endpoints select the
+schema's columns (no ORM objects are built) and turn the row tuples into dicts
+by position. Encoding goes through orjson when it is installed, both for the
+Flask JSON provider (jsonify, cached bodies) and for the NDJSON exports, with
+the standard library json module as the fallback. Dates and datetimes are
+encoded as ISO 8601 strings by both backends.
+"""
+import datetime
+import json
+import operator
+from functools import lru_cache
+
+from flask.json.provider import DefaultJSONProvider
+
+from models import User
+
+try:
+    import orjson
+except ImportError:  # optional dependency
+    orjson = None
+
+_ORJSON_OPTIONS = orjson.OPT_NON_STR_KEYS if orjson else 0
+
+
+class Schema:
+    """
+    Ordered output fields of a model, each mapped to the column it is read from
+    """
+
+    def __init__(self, **fields):
+        self.fields = fields
+        self.names = tuple(fields)
+        self.columns = tuple(column.label(name) for name, column in fields.items())
+        self._attributes = operator.attrgetter(*self.names)
+
+    @lru_cache(maxsize=256)
+    def only(self, *names):
+        """
+        Returns the schema restricted to `names`, in that order. Subsets are built once and reused
+        """
+        return Schema(**{name: self.fields[name] for name in names})
+
+    def serialize(self, row):
+        # Rows may carry extra trailing columns (e.g. cursor keys), zip stops at the schema fields
+        return dict(zip(self.names, row))
+
+    def serialize_many(self, rows):
+        names = self.names
+        return [dict(zip(names, row)) for row in rows]
+
+    def serialize_object(self, obj):
+        """
+        Serializes an object (e.g. a cached snapshot) by attribute name instead of position
+        """
+        values = self._attributes(obj)
+        return dict(zip(self.names, values if len(self.names) > 1 else (values,)))
+
+
+USER_SCHEMA = Schema(
+    id=User.id,
+    username=User.username,
+    email=User.email,
+    first_name=User.first_name,
+    last_name=User.last_name,
+)
+
+
+def _default(value):
+    if isinstance(value, (datetime.date, datetime.datetime)):
+        return value.isoformat()
+    return DefaultJSONProvider.default(value)
+
+
+def dumps(obj):
+    """
+    Encodes `obj` as compact JSON bytes, keys in insertion order
+    """
+    if orjson is not None:
+        try:
+            return orjson.dumps(obj, default=_default, option=_ORJSON_OPTIONS)
+        except TypeError:
+            # e.g. integers wider than 64 bits, which only the json module encodes
+            pass
+    return json.dumps(obj, default=_default, separators=(',', ':')).encode()
+
+
+def loads(data):
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+class FastJSONProvider(DefaultJSONProvider):
+    """
+    Flask JSON provider encoding with orjson when it is installed.
+    Keeps the behaviour of the default provider: sorted keys and indentation in debug mode
+    """
+
+    def dumps(self, obj, **kwargs):
+        if orjson is None or kwargs:
+            kwargs.setdefault('default', _default)
+            return super().dumps(obj, **kwargs)
+        return self._encode(obj, indent=False).decode()
+
+    def loads(self, s, **kwargs):
+        if orjson is None or kwargs:
+            return super().loads(s, **kwargs)
+        return orjson.loads(s)
+
+    def _encode(self, obj, indent):
+        option = _ORJSON_OPTIONS
+        if self.sort_keys:
+            option |= orjson.OPT_SORT_KEYS
+        if indent:
+            option |= orjson.OPT_INDENT_2
+        try:
+            return orjson.dumps(obj, default=_default, option=option)
+        except TypeError:
+            return super().dumps(obj, default=_default).encode()
+
+    def response(self, *args, **kwargs):
+        if orjson is None:
+            return super().response(*args, **kwargs)
+        obj = self._prepare_response_obj(args, kwargs)
+        indent = self.compact is False or (self.compact is None and self._app.debug)
+        return self._app.response_class(self._encode(obj, indent) + b'\n', mimetype=self.mimetype)
+
+
+def init_json_provider(app):
+    app.json = FastJSONProvider(app)
@@ -0,0 +1,202 @@
+"""
+Bulk user import.
+
+Rows come from a CSV file (header: username,email,password,first_name,last_name)
+or from newline delimited JSON objects with the same keys, and are processed in
+chunks of IMPORT_CHUNK_SIZE. For every chunk the taken usernames and emails are
+looked up with one IN query, the passwords of the new users are hashed across a
+process pool and the users are inserted with one executemany in their own
+transaction. After each committed chunk the number of rows consumed is written
+to a checkpoint, so an interrupted import resumes where it stopped.
+
+    flask --app app import-users users.csv
+"""
+import contextlib
+import csv
+import io
+import itertools
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from models import db, User
+from passwords import get_password_hasher
+from utils import chunked, find_taken, iter_ndjson
+
+FORMATS = ('csv', 'ndjson')
+
+
+def detect_format(filename, mimetype=None):
+    """
+    Returns 'csv' or 'ndjson' from a mimetype or a file extension, or None if unknown
+    """
+    if mimetype in ('text/csv', 'application/csv'):
+        return 'csv'
+    if mimetype in ('application/x-ndjson', 'application/jsonl'):
+        return 'ndjson'
+    extension = os.path.splitext(filename or '')[1].lower()
+    if extension == '.csv':
+        return 'csv'
+    if extension in ('.ndjson', '.jsonl'):
+        return 'ndjson'
+    return None
+
+
+def hash_pool(workers):
+    """
+    Returns a process pool of `workers` processes to use as a context manager, or a null context if 0
+    """
+    return ProcessPoolExecutor(max_workers=workers) if workers else contextlib.nullcontext()
+
+
+def iter_rows(stream, data_format):
+    """
+    Yields the user dicts of a binary stream, None for lines which could not be decoded
+    """
+    if data_format == 'ndjson':
+        return iter_ndjson(stream)
+    return csv.DictReader(io.TextIOWrapper(stream, encoding='utf-8-sig', newline=''))
+
+
+def _validate(data):
+    if not isinstance(data, dict):
+        return "Invalid row"
+    for key in ('username', 'email', 'password'):
+        if not isinstance(data.get(key), str) or not data[key]:
+            return "Please provide username, email, and password"
+    for key in ('first_name', 'last_name'):
+        if not isinstance(data.get(key) or '', str):
+            return f"Invalid {key}"
+    return None
+
+
+def _import_chunk(rows, start_index, executor, shared_pool=False):
+    """
+    Inserts the new users of one chunk in a single transaction
+    Returns:
+        (number of users created, list of {"index", "error"} for the rejected rows)
+    """
+    errors = []
+    valid_rows = []
+    usernames, emails = set(), set()
+    for index, data in enumerate(rows, start=start_index):
+        error = _validate(data)
+        if error is None and (data['username'] in usernames or data['email'] in emails):
+            error = "Duplicate username or email in the import"
+        if error:
+            errors.append({"index": index, "error": error})
+            continue
+        usernames.add(data['username'])
+        emails.add(data['email'])
+        valid_rows.append((index, data))
+
+    if not valid_rows:
+        return 0, errors
+
+    # Users created by earlier chunks are committed, so the database check covers them
+    taken_usernames, taken_emails = find_taken(usernames, emails)
+    new_rows = []
+    for index, data in valid_rows:
+        if data['username'] in taken_usernames:
+            errors.append({"index": index, "error": "Username already exists"})
+        elif data['email'] in taken_emails:
+            errors.append({"index": index, "error": "User exists with the same email"})
+        else:
+            new_rows.append((index, data))
+
+    if not new_rows:
+        errors.sort(key=lambda error: error["index"])
+        return 0, errors
+
+    # Only the users which will actually be inserted are hashed
+    hasher = get_password_hasher()
+    passwords = [data['password'] for _, data in new_rows]
+    password_hashes = hasher.hash_batch(passwords) if shared_pool else hasher.hash_many(passwords, executor)
+    users = [
+        {
+            "username": data['username'],
+            "email": data['email'],
+            "password_hash": password_hash,
+            "first_name": data.get('first_name') or '',
+            "last_name": data.get('last_name') or '',
+        }
+        for (_, data), password_hash in zip(new_rows, password_hashes)
+    ]
+    try:
+        db.session.execute(db.insert(User), users)
+        db.session.commit()
+    except Exception as e:
+        # Log the exception e, most likely a concurrent registration of the same username or email
+        db.session.rollback()
+        errors.extend({"index": index, "error": "Failed to save the user"} for index, _ in new_rows)
+        created = 0
+    else:
+        created = len(users)
+    errors.sort(key=lambda error: error["index"])
+    return created, errors
+
+
+def import_users(rows, chunk_size, executor=None, skip=0, max_errors=1000, on_chunk=None, shared_pool=False):
+    """
+    Imports an iterable of user dicts chunk by chunk
+    Args:
+        rows: iterable of user dicts (see iter_rows)
+        chunk_size: rows per transaction
+        executor: process pool the passwords are hashed on, hashed in process if None
+        skip: number of leading rows to skip, they were imported by an earlier run
+        max_errors: rejected rows reported individually, the others are only counted
+        on_chunk: called with the running stats after every committed chunk
+        shared_pool: hash on the app's PasswordHasher pool instead of `executor`, within its
+            PASSWORD_HASH_MAX_PENDING budget (raises HasherBusy when no slot frees up)
+    Returns:
+        {"processed", "created", "failed", "errors", "seconds", "rows_per_second"},
+        processed counts the skipped rows too, so it is the skip value to resume from
+    """
+    stats = {"processed": skip, "created": 0, "failed": 0, "errors": [], "seconds": 0.0, "rows_per_second": 0.0}
+    rows = itertools.islice(rows, skip, None)
+
+    started = time.perf_counter()
+    for chunk in chunked(rows, chunk_size):
+        created, errors = _import_chunk(chunk, stats["processed"], executor, shared_pool)
+        stats["processed"] += len(chunk)
+        stats["created"] += created
+        stats["failed"] += len(errors)
+        stats["errors"].extend(errors[:max(0, max_errors - len(stats["errors"]))])
+
+        elapsed = time.perf_counter() - started
+        stats["seconds"] = round(elapsed, 3)
+        stats["rows_per_second"] = round((stats["processed"] - skip) / elapsed, 1) if elapsed else 0.0
+        if on_chunk is not None:
+            on_chunk(stats)
+    return stats
+
+
+def read_checkpoint(path, source):
+    """
+    Returns the checkpoint stored at `path` for `source`, or None
+    """
+    try:
+        with open(path) as f:
+            checkpoint = json.load(f)
+    except (OSError, ValueError):
+        return None
+    return checkpoint if checkpoint.get('source') == source else None
+
+
+def write_checkpoint(path, source, stats, previous=None):
+    """
+    Atomically records how far the import of `source` got, counts add up across resumed runs
+    """
+    previous = previous or {}
+    checkpoint = {
+        "source": source,
+        "processed": stats["processed"],
+        "created": previous.get("created", 0) + stats["created"],
+        "failed": previous.get("failed", 0) + stats["failed"],
+    }
+    temporary_path = path + '.tmp'
+    with open(temporary_path, 'w') as f:
+        json.dump(checkpoint, f)
+    os.replace(temporary_path, path)
+    return checkpoint
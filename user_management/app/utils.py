@@ -1,4 +1,9 @@
-from models import User
+import itertools
+
+from flask import Response, stream_with_context
+
+from models import db, User
+from serializers import dumps, loads
 
 
 def validate_create_user_payload(request_json):
@@ -11,18 +16,56 @@ def validate_create_user_payload(request_json):
         return True
 
 
-def username_exists(username):
-    try:
-        user_object = User.query.filter_by(username=username).first()
-    except Exception as e:
-        # Log the exception e
-        return False
-    return user_object
+def find_taken(usernames, emails):
+    """
+    Returns the (usernames, emails) sets among the given ones that are already registered,
+    with one query served by the unique indexes of both columns
+    """
+    usernames, emails = list(usernames), list(emails)
+    rows = db.session.execute(
+        db.select(User.username, User.email).where(db.or_(User.username.in_(usernames), User.email.in_(emails)))
+    )
+    taken_usernames, taken_emails = set(), set()
+    for row in rows:
+        taken_usernames.add(row.username)
+        taken_emails.add(row.email)
+    return taken_usernames & set(usernames), taken_emails & set(emails)
 
 
-def email_exists(email):
-    try:
-        user_object = User.query.filter_by(email=email).first()
-    except Exception as e:
-        return False
-    return user_object
+def ndjson_response(rows):
+    """
+    Streams an iterable of dicts as newline delimited JSON.
+    `rows` should be a generator so the query only runs once the response is being sent
+    """
+    def generate():
+        for row in rows:
+            yield dumps(row) + b'\n'
+
+    return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+
+
+def iter_ndjson(stream):
+    """
+    Yields the decoded objects of a newline delimited JSON stream.
+    Lines which are not valid JSON are yielded as None so callers can report them per row
+    """
+    for line in stream:
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            yield loads(line)
+        except ValueError:
+            yield None
+
+
+def chunked(iterable, size):
+    """
+    Splits an iterable into lists of at most `size` items without materializing it
+    """
+    iterator = iter(iterable)
+    while True:
+        chunk = list(itertools.islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk